@@ -1,5 +1,4 @@
 import logging
-from math import sqrt
 
 import torch
 from einops import rearrange
@@ -13,7 +12,15 @@ from CameraControl.CamI2V.cami2v_modified_modules import (
     new_forward_for_TimestepEmbedSequential,
     new_forward_for_unet,
 )
-from CameraControl.CamI2V.epipolar import Epipolar, pix2coord
+from CameraControl.CamI2V.epipolar import (
+    Epipolar,
+    add_small_perturbation,
+    fill_epipolar_config_defaults,
+    get_epipolar_mask,
+    get_fundamental_matrix,
+    get_relative_c2w_RT_pairs,
+    unpack_epipolar_mask,
+)
 
 mainlogger = logging.getLogger('mainlogger')
 
@@ -25,26 +32,7 @@ class CamI2V(CameraControlLVDM):
 
         self.epipolar_config = epipolar_config
         if self.epipolar_config is not None:
-            if not hasattr(self.epipolar_config, "is_3d_full_attn"):
-                self.epipolar_config.is_3d_full_attn = False
-            if not hasattr(self.epipolar_config, "attention_resolution"):
-                self.epipolar_config.attention_resolution = [8, 4, 2, 1]
-            if not hasattr(self.epipolar_config, "apply_epipolar_soft_mask"):
-                self.epipolar_config.apply_epipolar_soft_mask = False
-            if not hasattr(self.epipolar_config, "soft_mask_temperature"):
-                self.epipolar_config.soft_mask_temperature = 1.0
-            if not hasattr(self.epipolar_config, "epipolar_hybrid_attention"):
-                self.epipolar_config.epipolar_hybrid_attention = False
-            if not hasattr(self.epipolar_config, "epipolar_hybrid_attention_v2"):
-                self.epipolar_config.epipolar_hybrid_attention_v2 = False
-            if not hasattr(self.epipolar_config, "only_self_pixel_on_current_frame"):
-                self.epipolar_config.only_self_pixel_on_current_frame = False
-            if not hasattr(self.epipolar_config, "current_frame_as_register_token"):
-                self.epipolar_config.current_frame_as_register_token = False
-            if not hasattr(self.epipolar_config, "pluker_add_type"):
-                self.epipolar_config.pluker_add_type = "add_to_pre_x_only"
-            if not hasattr(self.epipolar_config, "add_small_perturbation_on_zero_T"):
-                self.epipolar_config.add_small_perturbation_on_zero_T = False
+            self.epipolar_config = fill_epipolar_config_defaults(self.epipolar_config)
 
         bound_method = new_forward_for_unet.__get__(
             self.model.diffusion_model,
@@ -91,108 +79,20 @@ class CamI2V(CameraControlLVDM):
     @torch.no_grad()
     @torch.autocast(device_type="cuda", enabled=False)
     def get_relative_c2w_RT_pairs(self, RT: Tensor):
-        '''
-        :param RT: B, T, 4 4   c2w relative RT
-        :return: relative RT pairs, c2w, (B, T, T, 4, 4)
-        given c2w RT, camera system transform from T1 to T2: inverse(RT_2) @ (RT_1)
-        '''
-
-        RT_inv = rearrange(RT.inverse(), "b t ... -> b 1 t ...")
-        relative_RT_pairs = RT_inv @ rearrange(RT, "b t ... -> b t 1 ...")  # B, T, T, 4, 4
-
-        return relative_RT_pairs  # B,T,T,4,4
+        return get_relative_c2w_RT_pairs(RT)
 
     @torch.no_grad()
     @torch.autocast(device_type="cuda", enabled=False)
     def get_fundamental_matrix(self, K: Tensor, R: Tensor, t: Tensor) -> Tensor:
-        '''
-        :param   K: B, 3, 3
-        :param   R: B, 3, 3
-        :param   t: B, 3, 1
-        :return: F: B, 3, 3
-        '''
-        E = torch.cross(t, R, dim=-2)
-        K_inv = torch.inverse(K)
-        F = K_inv.transpose(-1, -2) @ E @ K_inv
-        return F
+        return get_fundamental_matrix(K, R, t)
 
     @torch.no_grad()
     @torch.autocast(device_type="cuda", enabled=False)
     def get_epipolar_mask(self, F: Tensor, T: int, H: int, W: int, downsample: int):
-        """
-        modified to take in batch inputs
-
-        Args:
-            grid: (H*W, 3)
-            F: camera fundamental matrix (B, T1, T2, 3, 3)
-            resolution: feature map resolution H * W
-            downsample: downsample scale
-
-        return: weight matrix M(HW * HW)
-        """
-        # B = F.shape[0]
-        device = F.device
-
-        y = torch.arange(0, H, dtype=torch.float, device=device)  # 0 .. 128
-        x = torch.arange(0, W, dtype=torch.float, device=device)  # 0 .. 84
-
-        y = pix2coord(y, downsample)  # H
-        x = pix2coord(x, downsample)  # W
-
-        grid_y, grid_x = torch.meshgrid(y, x)  # H * W
-        # grid_y: 84x128
-        # 3 x HW·
-        # TODO check whether yx or xy
-        grid = torch.stack([grid_x, grid_y, torch.ones_like(grid_x)], dim=2).view(-1, 3).float()  # H*W, 3
-
-        lines = F @ grid.transpose(-1, -2)  # [B, T1, T2, 3, H*W]
-        norm = torch.norm(lines[..., :2, :], dim=-2, keepdim=True)  # [B, T1, T2, 1, H*W]
-        # norm = torch.where(
-        #     norm == 0.0,
-        #     torch.ones_like(norm),
-        #     norm
-        # )
-        lines = lines / norm  # [B, T1, T2, 3, H*W]
-
-        dist = (lines.transpose(-1, -2) @ grid.transpose(-1, -2)).abs()  # [B, T1, T2, H*W, H*W]
-        mask = dist < (downsample * sqrt(2) / 2)  # [B, T1, T2, H*W, H*W]
-        # switch to 3d full attention if epipolar mask is empty
-        if self.epipolar_config.apply_epipolar_soft_mask:
-            raise NotImplementedError
-            mask = -dist * self.epipolar_config.soft_mask_temperature  # 高斯分布形式的权重
-
-        if self.epipolar_config.epipolar_hybrid_attention:    # Handling Empty Epipolar Masks
-            mask = torch.where(mask.any(dim=-1, keepdim=True), mask, torch.ones_like(mask))
-
-        if self.epipolar_config.epipolar_hybrid_attention_v2:  # Handling Empty Epipolar Masks
-            mask = torch.where(mask.any(dim=[2,4], keepdim=True).repeat(1,1,T,1,H*W), mask, torch.ones_like(mask))
-
-        if self.epipolar_config.only_self_pixel_on_current_frame:
-            # Step 1: Zero out masks for same frame interactions
-            same_frame = torch.eye(T, device=device, dtype=mask.dtype).view(1, T, T, 1, 1)
-            mask = mask * (~same_frame)  # Zero out same frame interactions
-
-            # Step 2: Create identity mask for same pixel in the same frame
-            identity_hw = torch.eye(T * H * W, device=device, dtype=mask.dtype).reshape(T, H, W, T, H, W)
-            identity_hw = rearrange(
-                identity_hw,
-                'T1 H1 W1 T2 H2 W2 -> 1 T1 T2 (H1 W1) (H2 W2)'
-            ).repeat(mask.shape[0], 1, 1, 1, 1)
-            mask = torch.where(identity_hw, identity_hw, mask)
-
-        if self.epipolar_config.current_frame_as_register_token:
-            # Step 1: Zero out masks for same frame interactions
-            same_frame = torch.eye(T, device=device, dtype=mask.dtype).view(1, T, T, 1, 1).repeat(mask.shape[0], 1, 1, H * W, H * W)
-            mask = torch.where(same_frame, same_frame, mask)
-
-        return rearrange(mask, "B T1 T2 HW1 HW2 -> B (T1 HW1) (T2 HW2)")
+        return get_epipolar_mask(F, T, H, W, downsample, self.epipolar_config)
 
     def add_small_perturbation(self, t, epsilon=1e-6):
-        zero_mask = (t.abs() < epsilon).all(dim=-2, keepdim=True)  # 检查 T 的 x, y, z 是否都接近 0
-        perturbation = torch.randn_like(t) * epsilon  # 生成微小扰动
-        t = torch.where(zero_mask, perturbation, t)  # 如果 T 为零，替换为扰动，否则保持原值
-
-        return t
+        return add_small_perturbation(t, epsilon=epsilon)
 
     def get_batch_input_camera_condition_process(self, batch, x, cond_frame_index, trace_scale_factor, rand_cond_frame, *args, **kwargs):
         return_log = {}
@@ -208,23 +108,38 @@ class CamI2V(CameraControlLVDM):
             relative_c2w_RT_4x4 = self.get_relative_pose(c2w_RT_4x4, cond_frame_index, mode='left', normalize_T0=self.normalize_T0)  # b,t,4,4
             relative_c2w_RT_4x4[:, :, :3, 3] = relative_c2w_RT_4x4[:, :, :3, 3] * trace_scale_factor
 
-            if self.epipolar_config is not None and not self.epipolar_config.is_3d_full_attn:
-                relative_c2w_RT_4x4_pairs = self.get_relative_c2w_RT_pairs(relative_c2w_RT_4x4)  # b,t,t,4,4
-                R = relative_c2w_RT_4x4_pairs[..., :3, :3]  # b,t,t,3,3
-                t = relative_c2w_RT_4x4_pairs[..., :3, 3:4]  # b,t,t,3,1
-
-                if self.epipolar_config.add_small_perturbation_on_zero_T:
-                    t = self.add_small_perturbation(t, epsilon=1e-6)
-
-                K = camera_intrinsics_3x3.unsqueeze(1)
-                F = self.get_fundamental_matrix(K, R, t)
-                sample_locs_dict = {d: self.get_epipolar_mask(F, T, H // d, W // d, d) for d in [int(8 * ds) for ds in self.epipolar_config.attention_resolution]}
+            # precomputed in dataloader workers by CameraConditionTransform, valid for its cond frame and unscaled trace
+            use_precomputed = (
+                "cond_frame_index" in batch and trace_scale_factor == 1.0
+                and torch.equal(batch["cond_frame_index"].to(cond_frame_index), cond_frame_index)
+            )
+            downsamples = [int(8 * ds) for ds in self.epipolar_config.attention_resolution] if self.epipolar_config is not None else []
+
+            if self.epipolar_config is not None and not self.epipolar_config.is_3d_full_attn and use_precomputed and all(f"epipolar_mask_{d}" in batch for d in downsamples):
+                sample_locs_dict = {d: unpack_epipolar_mask(batch[f"epipolar_mask_{d}"].to(device), T * (H // d) * (W // d)) for d in downsamples}
+            elif self.epipolar_config is not None and not self.epipolar_config.is_3d_full_attn:
+                if use_precomputed and "fundamental_matrix" in batch:
+                    F = batch["fundamental_matrix"].to(device).float()  # b,t,t,3,3
+                else:
+                    relative_c2w_RT_4x4_pairs = self.get_relative_c2w_RT_pairs(relative_c2w_RT_4x4)  # b,t,t,4,4
+                    R = relative_c2w_RT_4x4_pairs[..., :3, :3]  # b,t,t,3,3
+                    t = relative_c2w_RT_4x4_pairs[..., :3, 3:4]  # b,t,t,3,1
+
+                    if self.epipolar_config.add_small_perturbation_on_zero_T:
+                        t = self.add_small_perturbation(t, epsilon=1e-6)
+
+                    K = camera_intrinsics_3x3.unsqueeze(1)
+                    F = self.get_fundamental_matrix(K, R, t)  # b,t,t,3,3
+                sample_locs_dict = {d: self.get_epipolar_mask(F, T, H // d, W // d, d) for d in downsamples}
             else:
                 sample_locs_dict = None
 
         if self.pose_encoder is not None:
             with torch.no_grad(), torch.autocast('cuda', enabled=False):
-                pluker_embedding = self.ray_condition(camera_intrinsics_3x3, relative_c2w_RT_4x4, H, W, device, flip_flag=None)  # b, 6, t, H, W
+                if use_precomputed and "pluker_embedding" in batch:
+                    pluker_embedding = batch["pluker_embedding"].to(device).float()  # b, 6, t, H, W
+                else:
+                    pluker_embedding = self.ray_condition(camera_intrinsics_3x3, relative_c2w_RT_4x4, H, W, device, flip_flag=None)  # b, 6, t, H, W
 
             pluker_embedding_features = self.pose_encoder(pluker_embedding)  # bf c h w
             pluker_embedding_features = [rearrange(_, '(b f) c h w -> b c f h w', b=batch_size) for _ in pluker_embedding_features]
@@ -1,4 +1,5 @@
 import pdb
+from math import sqrt
 
 import numpy as np
 import torch
@@ -40,6 +41,145 @@ def coord2pix(y, downsample):
     return (y + 0.5 - downsample / 2.0) / downsample
 
 
+def fill_epipolar_config_defaults(epipolar_config):
+    if not hasattr(epipolar_config, "is_3d_full_attn"):
+        epipolar_config.is_3d_full_attn = False
+    if not hasattr(epipolar_config, "attention_resolution"):
+        epipolar_config.attention_resolution = [8, 4, 2, 1]
+    if not hasattr(epipolar_config, "apply_epipolar_soft_mask"):
+        epipolar_config.apply_epipolar_soft_mask = False
+    if not hasattr(epipolar_config, "soft_mask_temperature"):
+        epipolar_config.soft_mask_temperature = 1.0
+    if not hasattr(epipolar_config, "epipolar_hybrid_attention"):
+        epipolar_config.epipolar_hybrid_attention = False
+    if not hasattr(epipolar_config, "epipolar_hybrid_attention_v2"):
+        epipolar_config.epipolar_hybrid_attention_v2 = False
+    if not hasattr(epipolar_config, "only_self_pixel_on_current_frame"):
+        epipolar_config.only_self_pixel_on_current_frame = False
+    if not hasattr(epipolar_config, "current_frame_as_register_token"):
+        epipolar_config.current_frame_as_register_token = False
+    if not hasattr(epipolar_config, "pluker_add_type"):
+        epipolar_config.pluker_add_type = "add_to_pre_x_only"
+    if not hasattr(epipolar_config, "add_small_perturbation_on_zero_T"):
+        epipolar_config.add_small_perturbation_on_zero_T = False
+    return epipolar_config
+
+
+def get_relative_c2w_RT_pairs(RT: Tensor):
+    '''
+    :param RT: B, T, 4 4   c2w relative RT
+    :return: relative RT pairs, c2w, (B, T, T, 4, 4)
+    given c2w RT, camera system transform from T1 to T2: inverse(RT_2) @ (RT_1)
+    '''
+
+    RT_inv = rearrange(RT.inverse(), "b t ... -> b 1 t ...")
+    relative_RT_pairs = RT_inv @ rearrange(RT, "b t ... -> b t 1 ...")  # B, T, T, 4, 4
+
+    return relative_RT_pairs  # B,T,T,4,4
+
+
+def get_fundamental_matrix(K: Tensor, R: Tensor, t: Tensor) -> Tensor:
+    '''
+    :param   K: B, 3, 3
+    :param   R: B, 3, 3
+    :param   t: B, 3, 1
+    :return: F: B, 3, 3
+    '''
+    E = torch.cross(t, R, dim=-2)
+    K_inv = torch.inverse(K)
+    F = K_inv.transpose(-1, -2) @ E @ K_inv
+    return F
+
+
+def get_epipolar_mask(F: Tensor, T: int, H: int, W: int, downsample: int, epipolar_config):
+    """
+    modified to take in batch inputs
+
+    Args:
+        grid: (H*W, 3)
+        F: camera fundamental matrix (B, T1, T2, 3, 3)
+        resolution: feature map resolution H * W
+        downsample: downsample scale
+
+    return: weight matrix M(HW * HW)
+    """
+    # B = F.shape[0]
+    device = F.device
+
+    y = torch.arange(0, H, dtype=torch.float, device=device)  # 0 .. 128
+    x = torch.arange(0, W, dtype=torch.float, device=device)  # 0 .. 84
+
+    y = pix2coord(y, downsample)  # H
+    x = pix2coord(x, downsample)  # W
+
+    grid_y, grid_x = torch.meshgrid(y, x)  # H * W
+    # grid_y: 84x128
+    # 3 x HW·
+    # TODO check whether yx or xy
+    grid = torch.stack([grid_x, grid_y, torch.ones_like(grid_x)], dim=2).view(-1, 3).float()  # H*W, 3
+
+    lines = F @ grid.transpose(-1, -2)  # [B, T1, T2, 3, H*W]
+    norm = torch.norm(lines[..., :2, :], dim=-2, keepdim=True)  # [B, T1, T2, 1, H*W]
+    # norm = torch.where(
+    #     norm == 0.0,
+    #     torch.ones_like(norm),
+    #     norm
+    # )
+    lines = lines / norm  # [B, T1, T2, 3, H*W]
+
+    dist = (lines.transpose(-1, -2) @ grid.transpose(-1, -2)).abs()  # [B, T1, T2, H*W, H*W]
+    mask = dist < (downsample * sqrt(2) / 2)  # [B, T1, T2, H*W, H*W]
+    # switch to 3d full attention if epipolar mask is empty
+    if epipolar_config.apply_epipolar_soft_mask:
+        raise NotImplementedError
+        mask = -dist * epipolar_config.soft_mask_temperature  # 高斯分布形式的权重
+
+    if epipolar_config.epipolar_hybrid_attention:    # Handling Empty Epipolar Masks
+        mask = torch.where(mask.any(dim=-1, keepdim=True), mask, torch.ones_like(mask))
+
+    if epipolar_config.epipolar_hybrid_attention_v2:  # Handling Empty Epipolar Masks
+        mask = torch.where(mask.any(dim=[2,4], keepdim=True).repeat(1,1,T,1,H*W), mask, torch.ones_like(mask))
+
+    if epipolar_config.only_self_pixel_on_current_frame:
+        # Step 1: Zero out masks for same frame interactions
+        same_frame = torch.eye(T, device=device, dtype=mask.dtype).view(1, T, T, 1, 1)
+        mask = mask * (~same_frame)  # Zero out same frame interactions
+
+        # Step 2: Create identity mask for same pixel in the same frame
+        identity_hw = torch.eye(T * H * W, device=device, dtype=mask.dtype).reshape(T, H, W, T, H, W)
+        identity_hw = rearrange(
+            identity_hw,
+            'T1 H1 W1 T2 H2 W2 -> 1 T1 T2 (H1 W1) (H2 W2)'
+        ).repeat(mask.shape[0], 1, 1, 1, 1)
+        mask = torch.where(identity_hw, identity_hw, mask)
+
+    if epipolar_config.current_frame_as_register_token:
+        # Step 1: Zero out masks for same frame interactions
+        same_frame = torch.eye(T, device=device, dtype=mask.dtype).view(1, T, T, 1, 1).repeat(mask.shape[0], 1, 1, H * W, H * W)
+        mask = torch.where(same_frame, same_frame, mask)
+
+    return rearrange(mask, "B T1 T2 HW1 HW2 -> B (T1 HW1) (T2 HW2)")
+
+
+def add_small_perturbation(t, epsilon=1e-6):
+    zero_mask = (t.abs() < epsilon).all(dim=-2, keepdim=True)  # 检查 T 的 x, y, z 是否都接近 0
+    perturbation = torch.randn_like(t) * epsilon  # 生成微小扰动
+    t = torch.where(zero_mask, perturbation, t)  # 如果 T 为零，替换为扰动，否则保持原值
+
+    return t
+
+
+def unpack_epipolar_mask(packed: Tensor, n: int) -> Tensor:
+    '''
+    inverse of np.packbits(mask, axis=-1) with the default big bit order
+    :param packed: ..., ceil(n/8) uint8
+    :return: ..., n bool
+    '''
+    shifts = torch.arange(7, -1, -1, device=packed.device, dtype=torch.uint8)
+    bits = (packed.unsqueeze(-1) >> shifts) & 1
+    return bits.flatten(-2)[..., :n].bool()
+
+
 class EpipolarCrossAttention(nn.Module):
 
     def __init__(self, query_dim, context_dim=None, out_dim=None, heads=8, dim_head=64,
@@ -2,9 +2,9 @@ import logging
 
 import torch
 from einops import rearrange, repeat
-from packaging import version as pver
 from torch import Tensor
 
+from CameraControl.data.utils import ray_condition
 from CameraControl.dynamicrafter.dynamicrafter import DynamiCrafter
 from utils.utils import instantiate_from_config
 
@@ -104,59 +104,7 @@ class CameraControlLVDM(DynamiCrafter):
     @torch.no_grad()
     @torch.autocast(device_type="cuda", enabled=False)
     def ray_condition(self, K, c2w, H, W, device, flip_flag=None):
-        # c2w: B, V, 4, 4
-        # K: B, V, 3, 3
-
-        def custom_meshgrid(*args):
-            # ref: https://pytorch.org/docs/stable/generated/torch.meshgrid.html?highlight=meshgrid#torch.meshgrid
-            if pver.parse(torch.__version__) < pver.parse('1.10'):
-                return torch.meshgrid(*args)
-            else:
-                return torch.meshgrid(*args, indexing='ij')
-
-        B, V = K.shape[:2]
-
-        j, i = custom_meshgrid(
-            torch.linspace(0, H - 1, H, device=device, dtype=c2w.dtype),
-            torch.linspace(0, W - 1, W, device=device, dtype=c2w.dtype),
-        )
-        i = i.reshape([1, 1, H * W]).expand([B, V, H * W]) + 0.5  # [B, V, HxW]
-        j = j.reshape([1, 1, H * W]).expand([B, V, H * W]) + 0.5  # [B, V, HxW]
-
-        n_flip = torch.sum(flip_flag).item() if flip_flag is not None else 0
-        if n_flip > 0:
-            j_flip, i_flip = custom_meshgrid(
-                torch.linspace(0, H - 1, H, device=device, dtype=c2w.dtype),
-                torch.linspace(W - 1, 0, W, device=device, dtype=c2w.dtype)
-            )
-            i_flip = i_flip.reshape([1, 1, H * W]).expand(B, 1, H * W) + 0.5
-            j_flip = j_flip.reshape([1, 1, H * W]).expand(B, 1, H * W) + 0.5
-            i[:, flip_flag, ...] = i_flip
-            j[:, flip_flag, ...] = j_flip
-
-        fx = K[..., 0, 0].unsqueeze(-1)
-        fy = K[..., 1, 1].unsqueeze(-1)
-        cx = K[..., 0, 2].unsqueeze(-1)
-        cy = K[..., 1, 2].unsqueeze(-1)
-
-        zs = torch.ones_like(i)  # [B, V, HxW]
-        xs = (i - cx) / fx * zs
-        ys = (j - cy) / fy * zs
-        zs = zs.expand_as(ys)
-
-        directions = torch.stack((xs, ys, zs), dim=-1)  # B, V, HW, 3
-        directions = directions / directions.norm(dim=-1, keepdim=True)  # B, V, HW, 3
-
-        rays_d = directions @ c2w[..., :3, :3].transpose(-1, -2)  # B, V, HW, 3
-        rays_o = c2w[..., :3, 3]  # B, V, 3
-        rays_o = rays_o[:, :, None].expand_as(rays_d)  # B, V, HW, 3
-        # c2w @ dirctions
-        rays_dxo = torch.cross(rays_o, rays_d)  # B, V, HW, 3
-        plucker = torch.cat([rays_dxo, rays_d], dim=-1)
-        plucker = plucker.reshape(B, c2w.shape[1], H, W, 6)  # B, V, H, W, 6
-        # plucker = plucker.permute(0, 1, 4, 2, 3)
-        plucker = rearrange(plucker, "b f h w c -> b c f h w")  # [b, 6, f, h, w]
-        return plucker
+        return ray_condition(K, c2w, H, W, device, flip_flag=flip_flag)
 
     @torch.autocast(device_type="cuda", enabled=False)
     def get_relative_pose(self, RT_4x4: Tensor, cond_frame_index: Tensor, mode='left', normalize_T0=False):
@@ -189,13 +137,20 @@ class CameraControlLVDM(DynamiCrafter):
         ## x: b c t h w
         x = super().get_input(batch, self.first_stage_key)
         ## encode video frames x to z via a 2D encoder
-        z = self.encode_first_stage(x)
+        if "latent_moments" in batch:
+            ## posterior moments cached offline by datasets/utils/encode_realestate_latents.py
+            z = self.encode_first_stage_from_moments(batch["latent_moments"].to(self.device))
+        else:
+            z = self.encode_first_stage(x)
         batch_size, num_frames, device, H, W = x.shape[0], x.shape[2], self.model.device, x.shape[3], x.shape[4]
 
         ## get caption condition
         cond_input = batch[self.cond_stage_key]
 
-        if isinstance(cond_input, dict) or isinstance(cond_input, list):
+        if "caption_embedding" in batch:
+            ## embedded offline by datasets/utils/embed_realestate_captions.py
+            cond_emb = batch["caption_embedding"].to(self.device).float()
+        elif isinstance(cond_input, dict) or isinstance(cond_input, list):
             cond_emb = self.get_learned_conditioning(cond_input)
         else:
             cond_emb = self.get_learned_conditioning(cond_input.to(self.device))
@@ -214,9 +169,15 @@ class CameraControlLVDM(DynamiCrafter):
         prompt_imb = torch.where(prompt_mask, self.null_prompt, cond_emb.detach())
 
         ## get conditioning frame
+        rand_cond_frame = self.rand_cond_frame if rand_cond_frame is None else rand_cond_frame
+        if cond_frame_index is None and "cond_frame_index" in batch:
+            ## chosen by the dataset, which may have precomputed the camera condition for it,
+            ## only used when picked the same way as here, e.g. not random frames for log_images
+            batch_cond_frame_index = batch["cond_frame_index"].to(device=device, dtype=torch.long)
+            if rand_cond_frame or not batch_cond_frame_index.any():
+                cond_frame_index = batch_cond_frame_index
         if cond_frame_index is None:
             cond_frame_index = torch.zeros(batch_size, device=device, dtype=torch.long)
-            rand_cond_frame = self.rand_cond_frame if rand_cond_frame is None else rand_cond_frame
             if rand_cond_frame:
                 cond_frame_index = torch.randint(0, self.model.diffusion_model.temporal_length, (batch_size,), device=device)
 
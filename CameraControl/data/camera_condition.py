@@ -0,0 +1,75 @@
+import random
+
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+
+from CameraControl.CamI2V.epipolar import (
+    add_small_perturbation,
+    fill_epipolar_config_defaults,
+    get_epipolar_mask,
+    get_fundamental_matrix,
+    get_relative_c2w_RT_pairs,
+)
+from CameraControl.data.utils import ray_condition
+
+
+class CameraConditionTransform:
+    """
+    Precompute the camera condition of CamI2V in dataloader workers, so that it overlaps with GPU compute.
+    Set as `camera_condition_transform` of RealEstate10K, the model uses the results when present.
+
+    The dataset picks the condition frame and adds to each sample:
+        cond_frame_index: int
+        pluker_embedding: float16 [6, t, H, W], relative to the condition frame
+        fundamental_matrix: float32 [t, t, 3, 3], the model builds the epipolar masks from it on the GPU
+        epipolar_mask_{d}: uint8 [t*h*w, ceil(t*h*w/8)], np.packbits of the epipolar mask at downsample d, h=H/d, w=W/d,
+            only with precompute_epipolar_mask
+    Epipolar masks only depend on pairwise relative poses, so they do not change with the condition frame.
+
+    epipolar_config: same as the model, None to skip epipolar data
+    pluker: whether to compute pluker embeddings, needed when the model has a pose_encoder
+    rand_cond_frame: same as the model, e.g. ${model.params.rand_cond_frame}, otherwise the first frame is the condition frame
+    precompute_epipolar_mask: also build the dense masks in the workers. They take (t*h*w)^2 / 8 bytes per sample,
+        33 MB at 256x256 with d=8, and about 1 GB of intermediates to build, so only for small feature maps
+    """
+
+    def __init__(self, epipolar_config=None, pluker=True, rand_cond_frame=False, precompute_epipolar_mask=False):
+        self.epipolar_config = fill_epipolar_config_defaults(OmegaConf.create(epipolar_config)) if epipolar_config is not None else None
+        self.pluker = pluker
+        self.rand_cond_frame = rand_cond_frame
+        self.precompute_epipolar_mask = precompute_epipolar_mask
+
+    @torch.no_grad()
+    def __call__(self, data):
+        H, W = data['video'].shape[-2:]
+        T = data['RT'].shape[0]
+        cond_frame_index = random.randrange(T) if self.rand_cond_frame else 0
+
+        camera_intrinsics_3x3 = data['camera_intrinsics'].float()  # t, 3, 3
+        c2w_RT_4x4 = data['RT'].float().inverse()  # w2c --> c2w
+        # same as CameraControlLVDM.get_relative_pose, normalize_T0 cancels out in it
+        relative_c2w_RT_4x4 = c2w_RT_4x4[cond_frame_index].inverse() @ c2w_RT_4x4  # t, 4, 4
+
+        data['cond_frame_index'] = cond_frame_index
+
+        if self.pluker:
+            pluker_embedding = ray_condition(camera_intrinsics_3x3[None], relative_c2w_RT_4x4[None], H, W, device='cpu')
+            data['pluker_embedding'] = pluker_embedding[0].half()  # 6, t, H, W
+
+        if self.epipolar_config is not None and not self.epipolar_config.is_3d_full_attn:
+            relative_c2w_RT_4x4_pairs = get_relative_c2w_RT_pairs(relative_c2w_RT_4x4[None])  # 1,t,t,4,4
+            R = relative_c2w_RT_4x4_pairs[..., :3, :3]  # 1,t,t,3,3
+            t = relative_c2w_RT_4x4_pairs[..., :3, 3:4]  # 1,t,t,3,1
+            if self.epipolar_config.add_small_perturbation_on_zero_T:
+                t = add_small_perturbation(t, epsilon=1e-6)
+
+            F = get_fundamental_matrix(camera_intrinsics_3x3[None, None], R, t)  # 1,t,t,3,3
+            data['fundamental_matrix'] = F[0]
+
+            if self.precompute_epipolar_mask:
+                for d in [int(8 * ds) for ds in self.epipolar_config.attention_resolution]:
+                    mask = get_epipolar_mask(F, T, H // d, W // d, d, self.epipolar_config)[0]  # t*h*w, t*h*w
+                    data[f'epipolar_mask_{d}'] = torch.from_numpy(np.packbits(mask.numpy(), axis=-1))
+
+        return data
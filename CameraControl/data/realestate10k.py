@@ -1,13 +1,23 @@
+import glob
+import io
+import json
 import os
 import random
+import tarfile
 
+import av
 import numpy as np
 import omegaconf
 import torch
 from decord import VideoReader, cpu
-from torch.utils.data import Dataset
+import torch.distributed as dist
+from torch.utils.data import Dataset, get_worker_info
 from torchvision import transforms
 
+from CameraControl.data.utils import get_packed_string, load_packed_arrays
+from lvdm.data.base import Txt2ImgIterableBaseDataset
+from utils.utils import instantiate_from_config
+
 
 class RealEstate10K(Dataset):
     """
@@ -33,6 +43,12 @@ class RealEstate10K(Dataset):
     spatial_transform: spatial transformation, ["random_crop", "resize_center_crop"]
     count_globalsteps: whether to count global steps
     bs_per_gpu: batch size per gpu, used to count global steps
+    load_raw_resolution: decode at raw resolution and resize in the worker, otherwise decord decodes at the resize target directly
+    per_frame_scale_path: npz of a pickled {clip id: scales} dict, or packed scales from datasets/utils/pack_per_frame_scale.py
+    pose_index_path: packed poses, captions and video paths from datasets/utils/index_realestate.py, replaces reading meta_path txt files
+    uint8_video: return 'video' as uint8 in [0, 255], normalized on device by the model, cuts host-to-device traffic by 4x
+    camera_condition_transform: config of CameraControl.data.camera_condition.CameraConditionTransform, precomputes camera conditions in workers
+    caption_embedding_path: caption embeddings from datasets/utils/embed_realestate_captions.py, returned as 'caption_embedding'
 
     """
 
@@ -52,6 +68,10 @@ class RealEstate10K(Dataset):
                  bs_per_gpu=None,
                  RT_norm=False,
                  load_raw_resolution=True,
+                 caption_embedding_path=None,
+                 pose_index_path=None,
+                 uint8_video=False,
+                 camera_condition_transform=None,
                  ):
         self.meta_path = meta_path
         self.data_dir = data_dir
@@ -67,6 +87,9 @@ class RealEstate10K(Dataset):
         self.invert_video = invert_video
         self.RT_norm = RT_norm
         self.load_raw_resolution = load_raw_resolution
+        self.uint8_video = uint8_video
+        self.camera_condition_transform = instantiate_from_config(camera_condition_transform) if camera_condition_transform is not None else None
+        self.raw_resolutions = {}  # video_path -> (H, W), probed once per worker when not load_raw_resolution
         self.camera_pose_sections = camera_pose_sections
 
         self.metadata = []
@@ -74,30 +97,47 @@ class RealEstate10K(Dataset):
             # self.metadata = [line.strip() for line in f.readlines()]
             self.metadata = np.array([line.strip() for line in f.readlines()], dtype=np.string_)
 
-        if per_frame_scale_path:
+        self.per_frame_scale_path = per_frame_scale_path
+        if per_frame_scale_path and per_frame_scale_path.endswith('.npz'):
             self.per_frame_scale = np.load(per_frame_scale_path, allow_pickle=True)['arr_0'].item()
+        elif per_frame_scale_path:
+            self.per_frame_scale_arrays = None  # memory-mapped lazily in each worker
+
+        self.pose_index_path = pose_index_path
+        if pose_index_path:
+            assert not os.path.exists(f"{pose_index_path}/names_offsets.npy"), \
+                f"{pose_index_path} has unsorted packed names, rebuild it with datasets/utils/index_realestate.py"
+            self.pose_index_arrays = None  # memory-mapped lazily in each worker
+
+        self.caption_embedding_path = caption_embedding_path
+        if caption_embedding_path:
+            # rows of the memmap follow the clip list written next to it
+            with open(f"{os.path.splitext(caption_embedding_path)[0]}.txt", 'r') as f:
+                self.caption_embedding_index = {line.strip(): i for i, line in enumerate(f.readlines())}
+            self.caption_embeddings = None  # opened lazily in each worker
 
         print(f'============= length of dataset {len(self.metadata)} =============')
 
+    @staticmethod
+    def _get_resized_size(ori_H, ori_W, H, W):
+        '''
+        :return: size that covers H,W while keeping the aspect ratio, before center crop
+        '''
+        if ori_W / ori_H > W / H:
+            return H, int(ori_W * H / ori_H)
+        else:
+            return int(ori_H * W / ori_W), W
+
     def _resize_for_rectangle_crop(self, frames, H, W, fx, fy, cx, cy):
         '''
         :param frames: C,F,H,W
         :param image_size: H,W
         :return: frames: C,F,crop_H,crop_W;  camera_intrinsics: F,3,3
         '''
-        ori_H, ori_W = frames.shape[-2:]
-        if ori_W / ori_H > W / H:
-            frames = transforms.functional.resize(
-                frames,
-                size=[H, int(ori_W * H / ori_H)],
-            )
-        else:
-            frames = transforms.functional.resize(
-                frames,
-                size=[int(ori_H * W / ori_W), W],
-            )
+        resized_H, resized_W = self._get_resized_size(*frames.shape[-2:], H, W)
+        if (resized_H, resized_W) != tuple(frames.shape[-2:]):
+            frames = transforms.functional.resize(frames.float(), size=[resized_H, resized_W])
 
-        resized_H, resized_W = frames.shape[2], frames.shape[3]
         frames = frames.squeeze(0)
 
         delta_H = resized_H - H
@@ -115,26 +155,47 @@ class RealEstate10K(Dataset):
 
         return frames, camera_intrinsics, resized_H, resized_W
 
-    def __getitem__(self, index):
-        to_inverse = (self.invert_video and random.random() > 0.5)
-
-        ## get frames until success
-        index = index % len(self.metadata)
-        sample_name = self.metadata[index].decode('utf-8')
-        with open(f"{self.meta_path}/{sample_name}.txt", 'r') as f:
-            lines = f.readlines()
-        caption = lines[2].strip()
-        video_path = os.path.join(self.data_dir, lines[1].strip() + '.mp4')
+    def _load_clip_meta(self, sample_name):
+        '''
+        :return: caption, video_path, camera rows [frame_num, 19]
+        '''
+        if not self.pose_index_path:
+            with open(f"{self.meta_path}/{sample_name}.txt", 'r') as f:
+                lines = f.readlines()
+            return lines[2].strip(), os.path.join(self.data_dir, lines[1].strip() + '.mp4'), np.loadtxt(lines[3:])
+
+        if self.pose_index_arrays is None:
+            self.pose_index_arrays = {k: load_packed_arrays(f"{self.pose_index_path}/{k}") for k in ["poses", "captions", "video_paths"]}
+            self.pose_index_arrays["names"] = np.load(f"{self.pose_index_path}/names.npy", mmap_mode='r')
+        names = self.pose_index_arrays["names"]
+        # names are sorted by index_realestate.py
+        i = int(np.searchsorted(names, sample_name.encode('utf-8')))
+        if i == len(names) or names[i] != sample_name.encode('utf-8'):
+            raise KeyError(sample_name)
+        poses, pose_offsets = self.pose_index_arrays["poses"]
+        caption = get_packed_string(*self.pose_index_arrays["captions"], i)
+        video_path = get_packed_string(*self.pose_index_arrays["video_paths"], i)
+        return caption, os.path.join(self.data_dir, video_path + '.mp4'), poses[pose_offsets[i]:pose_offsets[i + 1]]
+
+    def _get_video_reader(self, video_path, video_bytes=None):
+        '''
+        :param video_bytes: encoded video already in memory, e.g. read from a shard, video_path is then only a key
+        '''
+        source = video_path if video_bytes is None else io.BytesIO(video_bytes)
         if self.load_raw_resolution:
-            video_reader = VideoReader(video_path, ctx=cpu(0))
+            video_reader = VideoReader(source, ctx=cpu(0))
         else:
-            video_reader = VideoReader(video_path, ctx=cpu(0), width=530, height=300)
-            assert len(video_reader) < self.video_length, print(f"video length ({len(video_reader)}) is smaller than target length({self.video_length})")
-
-        fps_ori = video_reader.get_avg_fps()
-        lines = lines[3:]
-        frame_num = len(lines)
-
+            # let decord scale to the size _resize_for_rectangle_crop would resize to, which then only crops
+            if video_path not in self.raw_resolutions:
+                with av.open(video_path if video_bytes is None else io.BytesIO(video_bytes)) as container:
+                    stream = container.streams.video[0]
+                    self.raw_resolutions[video_path] = (stream.codec_context.height, stream.codec_context.width)
+            resized_H, resized_W = self._get_resized_size(*self.raw_resolutions[video_path], *self.resolution)
+            video_reader = VideoReader(source, ctx=cpu(0), width=resized_W, height=resized_H)
+            assert len(video_reader) >= self.video_length, f"video length ({len(video_reader)}) is smaller than target length({self.video_length})"
+        return video_reader
+
+    def _sample_frame_indices(self, frame_num):
         frame_stride_drop = 0
         while True:
             if isinstance(self.frame_stride, int):
@@ -163,7 +224,49 @@ class RealEstate10K(Dataset):
         start_idx = random.randint(0, random_range) if random_range > 0 else 0
         frame_indices = [start_idx + frame_stride * i for i in range(self.video_length)]
 
-        camera_data = torch.from_numpy(np.loadtxt(lines))[frame_indices].float()  # [t, ]
+        return frame_stride, frame_indices
+
+    def _get_extra_data(self, sample_name, frame_indices, to_inverse):
+        data = {}
+        if hasattr(self, "per_frame_scale"):
+            data['per_frame_scale'] = torch.from_numpy(self.per_frame_scale[sample_name][frame_indices]).float()
+        elif self.per_frame_scale_path:
+            if self.per_frame_scale_arrays is None:
+                names = np.load(f"{self.per_frame_scale_path}/names.npy", mmap_mode='r')
+                self.per_frame_scale_arrays = (names, *load_packed_arrays(f"{self.per_frame_scale_path}/scales"))
+            names, scales, offsets = self.per_frame_scale_arrays
+            # names are sorted by pack_per_frame_scale.py
+            i = int(np.searchsorted(names, sample_name.encode('utf-8')))
+            if i == len(names) or names[i] != sample_name.encode('utf-8'):
+                raise KeyError(sample_name)
+            data['per_frame_scale'] = torch.from_numpy(scales[offsets[i]:offsets[i + 1]][frame_indices]).float()
+        if self.caption_embedding_path:
+            if self.caption_embeddings is None:
+                self.caption_embeddings = np.load(self.caption_embedding_path, mmap_mode='r')
+            data['caption_embedding'] = torch.from_numpy(np.array(self.caption_embeddings[self.caption_embedding_index[sample_name]]))  # [77, c]
+        return data
+
+    def __getitem__(self, index):
+        ## get frames until success
+        index = index % len(self.metadata)
+        sample_name = self.metadata[index].decode('utf-8')
+        caption, video_path, camera_rows = self._load_clip_meta(sample_name)
+        video_reader = self._get_video_reader(video_path)
+
+        return self._process_clip(sample_name, caption, video_path, camera_rows, video_reader)
+
+    def _process_clip(self, sample_name, caption, video_path, camera_rows, video_reader):
+        '''
+        sample frames and camera of a training clip
+        :param camera_rows: [frame_num, 19] rows of the meta file
+        '''
+        to_inverse = (self.invert_video and random.random() > 0.5)
+
+        fps_ori = video_reader.get_avg_fps()
+        frame_num = len(camera_rows)
+        frame_stride, frame_indices = self._sample_frame_indices(frame_num)
+
+        camera_data = torch.from_numpy(camera_rows[frame_indices]).float()  # [t, ]
         fx, fy, cx, cy = camera_data[:, 1:5].chunk(4, dim=-1)  # [t,4]
         camera_pose_3x4 = camera_data[:, 7:].reshape(-1, 3, 4)  # [t, 3, 4]
         camera_pose_4x4 = torch.cat([camera_pose_3x4, torch.tensor([[[0.0, 0.0, 0.0, 1.0]]] * len(frame_indices))], dim=1)  # [t, 4, 4]
@@ -173,7 +276,7 @@ class RealEstate10K(Dataset):
 
         ## process data
         assert (frames.shape[0] == self.video_length), f'{len(frames)}, self.video_length={self.video_length}'
-        frames = torch.from_numpy(frames.asnumpy()).permute(3, 0, 1, 2).float()  # [t,h,w,c] -> [c,t,h,w]
+        frames = torch.from_numpy(frames.asnumpy()).permute(3, 0, 1, 2)  # [t,h,w,c] -> [c,t,h,w], uint8 until resized or cropped
 
         ## spatial transformations
         if self.spatial_transform_type == 'resize_center_crop':
@@ -195,7 +298,10 @@ class RealEstate10K(Dataset):
         if self.resolution is not None:
             assert (frames.shape[2] == self.resolution[0] and frames.shape[3] == self.resolution[1]), f'frames={frames.shape}, self.resolution={self.resolution}'
 
-        frames = (frames / 255 - 0.5) * 2
+        if self.uint8_video:
+            frames = frames if frames.dtype == torch.uint8 else frames.round().clamp(0, 255).to(torch.uint8)
+        else:
+            frames = (frames.float() / 255 - 0.5) * 2
         fps_clip = fps_ori // frame_stride
 
         if to_inverse:
@@ -203,7 +309,7 @@ class RealEstate10K(Dataset):
             frames = frames.flip(dims=(1,))
 
         data = {
-            'video': frames,  # [c,t,h,w]
+            'video': frames,  # [c,t,h,w], float in [-1, 1] or uint8 in [0, 255]
             'caption': caption,
             'video_path': video_path,
             'fps': fps_clip,
@@ -214,9 +320,181 @@ class RealEstate10K(Dataset):
             # 'trajs': torch.zeros(2, self.video_length, frames.shape[2], frames.shape[3])
         }
 
-        if hasattr(self, "per_frame_scale"):
-            data['per_frame_scale'] = torch.from_numpy(self.per_frame_scale[sample_name][frame_indices]).float()
+        data.update(self._get_extra_data(sample_name, frame_indices, to_inverse))
+        if self.camera_condition_transform is not None:
+            data = self.camera_condition_transform(data)
         return data
 
     def __len__(self):
         return len(self.metadata)
+
+
+class RealEstate10KLatent(RealEstate10K):
+    """
+    RealEstate10K with first stage latents cached by datasets/utils/encode_realestate_latents.py.
+    Besides everything returned by RealEstate10K, each sample carries 'latent_moments' [2*z_c,t,h,w],
+    the AutoencoderKL posterior mean/logvar of the selected frames, so the model can skip encode_first_stage
+    and still sample from DiagonalGaussianDistribution.
+
+    latent_dir: output_dir of encode_realestate_latents.py, must be encoded at the same resolution and spatial_transform
+    """
+
+    def __init__(self, latent_dir, **kwargs):
+        super().__init__(**kwargs)
+        self.latent_dir = latent_dir
+
+        with open(os.path.join(latent_dir, "meta.json"), 'r') as f:
+            latent_meta = json.load(f)
+        assert list(latent_meta["resolution"]) == list(self.resolution), f"latents are encoded at {latent_meta['resolution']}, but resolution={self.resolution}"
+        # frames, intrinsics and pluker rays follow spatial_transform, the latents have to be cropped the same way.
+        # stores written before the key was recorded are all resize_center_crop
+        latent_transform = latent_meta.get("spatial_transform", "resize_center_crop")
+        assert latent_transform == self.spatial_transform_type, f"latents are encoded with {latent_transform}, but spatial_transform={self.spatial_transform_type}"
+
+        # sample_name -> (shard_id, start, num_frames), only finished shards have their json written
+        self.latent_index = {}
+        for shard_index_path in sorted(glob.glob(os.path.join(latent_dir, "shard_*.json"))):
+            shard_id = int(os.path.basename(shard_index_path)[len("shard_"):-len(".json")])
+            with open(shard_index_path, 'r') as f:
+                for sample_name, (start, num_frames) in json.load(f).items():
+                    self.latent_index[sample_name] = (shard_id, start, num_frames)
+
+        self.metadata = np.array([x for x in self.metadata if x.decode('utf-8') in self.latent_index], dtype=np.string_)
+        self.latent_shards = {}  # opened lazily in each worker
+
+        print(f'============= length of dataset with cached latents {len(self.metadata)} =============')
+
+    def _get_latent_shard(self, shard_id):
+        if shard_id not in self.latent_shards:
+            self.latent_shards[shard_id] = np.load(os.path.join(self.latent_dir, f"shard_{shard_id:05d}.npy"), mmap_mode='r')
+        return self.latent_shards[shard_id]
+
+    def _get_extra_data(self, sample_name, frame_indices, to_inverse):
+        data = super()._get_extra_data(sample_name, frame_indices, to_inverse)
+
+        shard_id, start, num_frames = self.latent_index[sample_name]
+        assert max(frame_indices) < num_frames, f"{sample_name}: frame {max(frame_indices)} is not cached ({num_frames} frames)"
+        moments = self._get_latent_shard(shard_id)[[start + i for i in frame_indices]]  # [t,2*z_c,h,w]
+        moments = torch.from_numpy(moments).permute(1, 0, 2, 3)  # [2*z_c,t,h,w]
+        if to_inverse:
+            moments = moments.flip(dims=(1,))
+        data['latent_moments'] = moments
+        return data
+
+
+class RealEstate10KShards(Txt2ImgIterableBaseDataset):
+    """
+    RealEstate10K streamed from tar shards written by datasets/utils/pack_realestate_shards.py, for filesystems where
+    reading many small clips is slow. Each clip is stored as {clip}.mp4, {clip}.npy (camera rows) and {clip}.json.
+
+    Shards are split over ranks and dataloader workers by split_sample_ids, called from worker_init_fn in
+    main/utils_data.py, iterable datasets are not sharded by a distributed sampler. Each worker reads its
+    shards sequentially in a random order and yields clips through a shuffle buffer, frames and frame stride are
+    sampled on every visit exactly as in RealEstate10K. Each rank yields num_records // world_size samples per epoch,
+    which is also __len__, spread evenly over its workers, which cycle their shards if needed.
+    The integer split leaves len(shards) % (num_workers * world_size) shards unread, and every worker needs at least
+    one shard, see check_shard_split.
+
+    shard_dir: output folder of pack_realestate_shards.py
+    shuffle_buffer_size: number of encoded clips kept in memory per worker for shuffling
+    the rest of the arguments are forwarded to RealEstate10K
+    """
+
+    clip_members = ('mp4', 'npy', 'json')
+
+    def __init__(self, shard_dir, shuffle_buffer_size=256, **kwargs):
+        with open(os.path.join(shard_dir, "index.json"), 'r') as f:
+            shards = json.load(f)["shards"]
+        self.shard_paths = [os.path.join(shard_dir, x["path"]) for x in shards]
+        self.shuffle_buffer_size = shuffle_buffer_size
+
+        # only used for clip processing, clips come from the shards
+        kwargs.update(meta_path=None, meta_list=os.path.join(shard_dir, "list.txt"), data_dir="", pose_index_path=None)
+        self.clip_dataset = RealEstate10K(**kwargs)
+
+        super().__init__(num_records=sum(x["num_clips"] for x in shards), valid_ids=list(range(len(shards))), size=self.clip_dataset.resolution)
+
+    @staticmethod
+    def _world_size():
+        return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+    @staticmethod
+    def _rank():
+        return dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+    def split_sample_ids(self, worker_id, num_workers):
+        """ shards of one dataloader worker, split over the workers of all ranks """
+        split_id = self._rank() * num_workers + worker_id
+        split_size = len(self.valid_ids) // (num_workers * self._world_size())
+        self.sample_ids = self.valid_ids[split_id * split_size:(split_id + 1) * split_size]
+
+    def __len__(self):
+        # samples of this rank
+        return self.num_records // self._world_size()
+
+    def check_shard_split(self, num_workers):
+        """ called when the dataloader is built, fails early instead of inside a worker """
+        num_splits = max(num_workers, 1) * self._world_size()
+        if len(self.valid_ids) < num_splits:
+            raise ValueError(f"{len(self.valid_ids)} shards for {num_splits} dataloader workers over all ranks, "
+                             f"repack with a smaller --clips_per_shard or use fewer workers")
+        if len(self.valid_ids) % num_splits != 0:
+            print(f"WARNING: {len(self.valid_ids) % num_splits} of {len(self.valid_ids)} shards are not read, "
+                  f"use a shard count divisible by {num_splits} dataloader workers over all ranks")
+
+    def _iter_shard(self, shard_id):
+        """
+        members of a clip are written consecutively as {clip}.mp4, {clip}.npy and {clip}.json,
+        other members and clips with missing members, e.g. of a truncated shard, are skipped
+        """
+        shard_path = self.shard_paths[shard_id]
+        sample_name, clip = None, {}
+        with tarfile.open(shard_path, 'r|') as tar:
+            for member in tar:
+                name, _, ext = member.name.rpartition('.')
+                if not member.isfile() or not name or ext not in self.clip_members:
+                    print(f"WARNING: skipping {member.name} in {shard_path}, not a member of a clip")
+                    continue
+                if name != sample_name:
+                    if clip:
+                        print(f"WARNING: skipping {sample_name} in {shard_path}, only has {sorted(clip)}")
+                    sample_name, clip = name, {}
+                clip[ext] = tar.extractfile(member).read()
+                if len(clip) == len(self.clip_members):
+                    yield sample_name, clip
+                    sample_name, clip = None, {}
+        if clip:
+            print(f"WARNING: skipping {sample_name} in {shard_path}, only has {sorted(clip)}")
+
+    def _iter_clips(self, sample_ids):
+        while True:
+            sample_ids = random.sample(sample_ids, len(sample_ids))
+            num_clips = 0
+            for shard_id in sample_ids:
+                for clip in self._iter_shard(shard_id):
+                    num_clips += 1
+                    yield clip
+            if num_clips == 0:  # would cycle forever
+                raise RuntimeError(f"no complete clip in shards {[self.shard_paths[i] for i in sample_ids]}")
+
+    def _decode_clip(self, sample_name, clip):
+        meta = json.loads(clip['json'])
+        camera_rows = np.load(io.BytesIO(clip['npy']))
+        video_reader = self.clip_dataset._get_video_reader(meta['video_path'], video_bytes=clip['mp4'])
+        return self.clip_dataset._process_clip(sample_name, meta['caption'], meta['video_path'], camera_rows, video_reader)
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        num_workers, worker_id = (worker_info.num_workers, worker_info.id) if worker_info is not None else (1, 0)
+        # the samples of this rank, the first workers take one more if they do not divide evenly
+        num_samples = len(self) // num_workers + int(worker_id < len(self) % num_workers)
+        assert len(self.sample_ids) > 0, f"no shard is assigned to this worker, use more than {num_workers * self._world_size()} shards"
+
+        buffer = []
+        clips = self._iter_clips(list(self.sample_ids))
+        for _ in range(num_samples):
+            while len(buffer) < self.shuffle_buffer_size:
+                buffer.append(next(clips))
+            i = random.randrange(len(buffer))
+            buffer[i], buffer[-1] = buffer[-1], buffer[i]
+            yield self._decode_clip(*buffer.pop())
@@ -3,6 +3,8 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 import open3d as o3d
+from einops import rearrange
+from packaging import version as pver
 from torch import Tensor
 
 def relative_pose(rt: Tensor, mode, ref_index) -> Tensor:
@@ -18,6 +20,88 @@ def relative_pose(rt: Tensor, mode, ref_index) -> Tensor:
     return rt
 
 
+def ray_condition(K, c2w, H, W, device, flip_flag=None):
+    # c2w: B, V, 4, 4
+    # K: B, V, 3, 3
+
+    def custom_meshgrid(*args):
+        # ref: https://pytorch.org/docs/stable/generated/torch.meshgrid.html?highlight=meshgrid#torch.meshgrid
+        if pver.parse(torch.__version__) < pver.parse('1.10'):
+            return torch.meshgrid(*args)
+        else:
+            return torch.meshgrid(*args, indexing='ij')
+
+    B, V = K.shape[:2]
+
+    j, i = custom_meshgrid(
+        torch.linspace(0, H - 1, H, device=device, dtype=c2w.dtype),
+        torch.linspace(0, W - 1, W, device=device, dtype=c2w.dtype),
+    )
+    i = i.reshape([1, 1, H * W]).expand([B, V, H * W]) + 0.5  # [B, V, HxW]
+    j = j.reshape([1, 1, H * W]).expand([B, V, H * W]) + 0.5  # [B, V, HxW]
+
+    n_flip = torch.sum(flip_flag).item() if flip_flag is not None else 0
+    if n_flip > 0:
+        j_flip, i_flip = custom_meshgrid(
+            torch.linspace(0, H - 1, H, device=device, dtype=c2w.dtype),
+            torch.linspace(W - 1, 0, W, device=device, dtype=c2w.dtype)
+        )
+        i_flip = i_flip.reshape([1, 1, H * W]).expand(B, 1, H * W) + 0.5
+        j_flip = j_flip.reshape([1, 1, H * W]).expand(B, 1, H * W) + 0.5
+        i[:, flip_flag, ...] = i_flip
+        j[:, flip_flag, ...] = j_flip
+
+    fx = K[..., 0, 0].unsqueeze(-1)
+    fy = K[..., 1, 1].unsqueeze(-1)
+    cx = K[..., 0, 2].unsqueeze(-1)
+    cy = K[..., 1, 2].unsqueeze(-1)
+
+    zs = torch.ones_like(i)  # [B, V, HxW]
+    xs = (i - cx) / fx * zs
+    ys = (j - cy) / fy * zs
+    zs = zs.expand_as(ys)
+
+    directions = torch.stack((xs, ys, zs), dim=-1)  # B, V, HW, 3
+    directions = directions / directions.norm(dim=-1, keepdim=True)  # B, V, HW, 3
+
+    rays_d = directions @ c2w[..., :3, :3].transpose(-1, -2)  # B, V, HW, 3
+    rays_o = c2w[..., :3, 3]  # B, V, 3
+    rays_o = rays_o[:, :, None].expand_as(rays_d)  # B, V, HW, 3
+    # c2w @ dirctions
+    rays_dxo = torch.cross(rays_o, rays_d)  # B, V, HW, 3
+    plucker = torch.cat([rays_dxo, rays_d], dim=-1)
+    plucker = plucker.reshape(B, c2w.shape[1], H, W, 6)  # B, V, H, W, 6
+    # plucker = plucker.permute(0, 1, 4, 2, 3)
+    plucker = rearrange(plucker, "b f h w c -> b c f h w")  # [b, 6, f, h, w]
+    return plucker
+
+
+def save_packed_arrays(prefix, arrays, dtype=None):
+    '''
+    concatenate variable length arrays along dim 0 into {prefix}.npy, item i is rows offsets[i]:offsets[i+1]
+    '''
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in arrays], out=offsets[1:])
+    data = np.concatenate(arrays) if len(arrays) > 0 else np.zeros((0,), dtype=dtype)
+    np.save(f"{prefix}.npy", data if dtype is None else data.astype(dtype, copy=False))
+    np.save(f"{prefix}_offsets.npy", offsets)
+
+
+def load_packed_arrays(prefix, mmap_mode='r'):
+    '''
+    :return: data (memory-mapped by default), offsets
+    '''
+    return np.load(f"{prefix}.npy", mmap_mode=mmap_mode), np.load(f"{prefix}_offsets.npy")
+
+
+def save_packed_strings(prefix, strings):
+    save_packed_arrays(prefix, [np.frombuffer(x.encode('utf-8'), dtype=np.uint8) for x in strings], dtype=np.uint8)
+
+
+def get_packed_string(data, offsets, index):
+    return bytes(data[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+
 def create_line_point_cloud(start_point, end_point, num_points=50, color=np.array([0, 0, 1.0])):
     # 创建从起点到终点的线性空间
     points = np.linspace(start_point, end_point, num_points)
@@ -1,6 +1,8 @@
 import argparse
 import json
+import queue
 import socket
+import threading
 
 import gradio as gr
 import pandas as pd
@@ -37,7 +39,11 @@ def plot_bezier_curve(a: float, b: float):
 
 
 def dynamicrafter_demo(args):
-    image2video = Image2Video(args.result_dir, args.model_meta_path, args.camera_pose_meta_path, device=args.device)
+    image2video = Image2Video(
+        args.result_dir, args.model_meta_path, args.camera_pose_meta_path, device=args.device,
+        latent_previewer_path=args.latent_previewer_path, preview_every=args.preview_every,
+    )
+    use_preview = image2video.latent_previewer is not None
 
     with gr.Blocks(analytics_enabled=False, css=r"""
         #input_img img {height: 320px !important;}
@@ -57,6 +63,9 @@ def dynamicrafter_demo(args):
             output_video1 = gr.Video(label="New Generated Video", elem_id="output_vid", interactive=False, autoplay=True, loop=True)
             output_video2 = gr.Video(label="Previous Generated Video", elem_id="output_vid", interactive=False, autoplay=True, loop=True)
 
+        with gr.Row(visible=use_preview):
+            output_preview = gr.Image(label="Sampling Preview", elem_id="output_preview", interactive=False)
+
         with gr.Row():
             end_btn = gr.Button("Generate")
             reload_btn = gr.Button("Reload", elem_id="reload_button")
@@ -111,12 +120,35 @@ def dynamicrafter_demo(args):
         def generate(*inputs):
             if args.use_qwen2vl_captioner:
                 captioner.offload_cpu()
-            return image2video.get_image(*inputs)
+            if not use_preview:
+                yield *image2video.get_image(*inputs), gr.update()
+                return
+
+            # sample in a worker thread and stream approximate previews of pred_x0 while it runs
+            previews, result = queue.Queue(), {}
+
+            def worker():
+                try:
+                    result["output"] = image2video.get_image(*inputs, preview_callback=previews.put)
+                except Exception as e:
+                    result["error"] = e
+                finally:
+                    previews.put(None)
+
+            thread = threading.Thread(target=worker, daemon=True)
+            thread.start()
+            while (preview := previews.get()) is not None:
+                yield gr.update(), gr.update(), preview
+            thread.join()
+
+            if "error" in result:
+                raise result["error"]
+            yield *result["output"], gr.update()
 
         end_btn.click(
             fn=generate,
             inputs=[model_name, input_image, input_text, negative_prompt, camera_pose_type, trace_extract_ratio, frame_stride, steps, trace_scale_factor, camera_cfg, cfg_scale, seed, enable_camera_condition],
-            outputs=[output_video1, output_3d],
+            outputs=[output_video1, output_3d, output_preview],
         )
         end_btn.click(fn=lambda x: x, inputs=[output_video1], outputs=[output_video2])
 
@@ -140,6 +172,8 @@ def get_parser():
     parser.add_argument("--camera_pose_meta_path", type=str, default="./demo/camera_poses.json")
     parser.add_argument("--use_qwen2vl_captioner", action="store_true")
     parser.add_argument("--use_host_ip", action="store_true")
+    parser.add_argument("--latent_previewer_path", type=str, default=None, help="fitted by lvdm/models/latent_preview.py")
+    parser.add_argument("--preview_every", type=int, default=5, help="DDIM steps between sampling previews")
 
     return parser
 
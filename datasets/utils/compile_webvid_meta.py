@@ -0,0 +1,64 @@
+"""
+Compile the WebVid metadata csv into compact arrays, consumed by WebVid when `meta_path` is a directory.
+
+Frame counts and fps are probed once in parallel, videos that fail to open are dropped, so that WebVid filters
+short clips up front and never retries in __getitem__.
+
+Output (--save_dir):
+    video_paths.npy, video_paths_offsets.npy    {page_dir}/{videoid}.mp4 relative to {data_dir}/videos, utf-8 bytes
+    captions.npy, captions_offsets.npy          utf-8 bytes
+    frame_nums.npy                              int32 [N]
+    fps.npy                                     float32 [N]
+Strings are packed without padding, see save_packed_strings.
+"""
+
+import argparse
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+from decord import VideoReader, cpu
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from CameraControl.data.utils import save_packed_strings
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--meta_path", type=str, required=True, help="csv with videoid, page_dir and name columns")
+    parser.add_argument("--data_dir", type=str, required=True)
+    parser.add_argument("--save_dir", type=str, required=True)
+    parser.add_argument("--num_workers", type=int, default=16)
+    return parser.parse_args()
+
+
+def probe_video(video_path: str):
+    try:
+        video_reader = VideoReader(video_path, ctx=cpu(0))
+        return len(video_reader), video_reader.get_avg_fps()
+    except Exception:
+        return 0, 0.0
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    metadata = pd.read_csv(args.meta_path, dtype=str).dropna(subset=["videoid", "page_dir", "name"])
+    video_paths = [os.path.join(page_dir, f"{videoid}.mp4") for page_dir, videoid in zip(metadata["page_dir"], metadata["videoid"])]
+
+    with Pool(args.num_workers) as pool:
+        full_paths = [os.path.join(args.data_dir, "videos", x) for x in video_paths]
+        results = list(tqdm(pool.imap(probe_video, full_paths, chunksize=16), total=len(full_paths)))
+    frame_nums = np.array([x[0] for x in results], dtype=np.int32)
+    fps = np.array([x[1] for x in results], dtype=np.float32)
+    valid = frame_nums > 0
+
+    os.makedirs(args.save_dir, exist_ok=True)
+    save_packed_strings(f"{args.save_dir}/video_paths", [x for x, v in zip(video_paths, valid) if v])
+    save_packed_strings(f"{args.save_dir}/captions", [x for x, v in zip(metadata["name"], valid) if v])
+    np.save(f"{args.save_dir}/frame_nums.npy", frame_nums[valid])
+    np.save(f"{args.save_dir}/fps.npy", fps[valid])
+    print(f"compiled {valid.sum()}/{len(video_paths)} readable videos to {args.save_dir}")
@@ -0,0 +1,70 @@
+"""
+Embed RealEstate10K captions with the frozen OpenCLIP text encoder, consumed through `caption_embedding_path` of RealEstate10K.
+
+Output:
+    {output}.npy    float16 memmap [num_clips, 77, c], rows in the order of {split}_valid_list.txt
+    {output}.txt    clip id of each row
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import torch
+from numpy.lib.format import open_memmap
+from omegaconf import OmegaConf
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from utils.utils import load_submodule
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset_root", type=str, default="datasets/RealEstate10K")
+    parser.add_argument("--split", type=str, required=True, choices=["train", "test"])
+    parser.add_argument("--config", type=str, default="configs/003_cami2v_512x320.yaml", help="provides cond_stage_config")
+    parser.add_argument("--ckpt_path", type=str, required=True, help="checkpoint containing cond_stage_model weights")
+    parser.add_argument("--output", type=str, default=None)
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--device", type=str, default="cuda")
+    return parser.parse_args()
+
+
+def load_cond_stage_model(config_file, ckpt_path, device):
+    config = OmegaConf.load(config_file)
+    cond_stage_model = load_submodule(config.model.params.cond_stage_config, ckpt_path, "cond_stage_model")
+    cond_stage_model.device = device
+    return cond_stage_model.to(device)
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    output = args.output or f"{args.dataset_root}/{args.split}_caption_embeddings"
+    with open(f"{args.dataset_root}/{args.split}_valid_list.txt", "r") as f:
+        sample_names = [line.strip() for line in f.readlines()]
+
+    captions = []
+    for sample_name in tqdm(sample_names, desc="reading captions"):
+        with open(f"{args.dataset_root}/valid_metadata/{args.split}/{sample_name}.txt", "r") as f:
+            f.readline(), f.readline()
+            captions.append(f.readline().strip())
+
+    if len(captions) == 0:
+        raise SystemExit(f"no clips in {args.dataset_root}/{args.split}_valid_list.txt")
+
+    cond_stage_model = load_cond_stage_model(args.config, args.ckpt_path, args.device)
+    embeddings = None
+    with torch.no_grad():
+        for i in tqdm(range(0, len(captions), args.batch_size), desc="embedding captions"):
+            z = cond_stage_model.encode(captions[i:i + args.batch_size]).half().cpu().numpy()
+            if embeddings is None:
+                embeddings = open_memmap(f"{output}.npy", mode="w+", dtype=np.float16, shape=(len(captions), *z.shape[1:]))
+            embeddings[i:i + len(z)] = z
+    embeddings.flush()
+
+    with open(f"{output}.txt", "w") as f:
+        f.write("\n".join(sample_names) + "\n")
+    print(f"saved {len(sample_names)} caption embeddings to {output}.npy")
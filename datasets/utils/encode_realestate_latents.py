@@ -0,0 +1,113 @@
+"""
+Encode RealEstate10K clips into first stage latent shards, consumed by RealEstate10KLatent.
+
+Every frame of a clip is encoded at the training resolution (clip start and frame stride are drawn at random
+during training, so any frame can be selected), and the AutoencoderKL posterior mean/logvar are stored in
+float16 so that training still samples z from DiagonalGaussianDistribution.
+
+Output layout:
+    {output_dir}/meta.json          resolution, spatial transform and moments shape
+    {output_dir}/shard_xxxxx.npy    [num_frames, 2*z_c, H/8, W/8], frames of all clips in the shard
+    {output_dir}/shard_xxxxx.json   clip -> [start, num_frames], written last, marks the shard as finished
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from CameraControl.data.realestate10k import RealEstate10K
+from lvdm.models.latent_preview import load_first_stage_model
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset_root", type=str, default="datasets/RealEstate10K")
+    parser.add_argument("--split", type=str, required=True, choices=["train", "test"])
+    parser.add_argument("--config", type=str, default="configs/003_cami2v_512x320.yaml", help="provides first_stage_config")
+    parser.add_argument("--ckpt_path", type=str, required=True, help="checkpoint containing first_stage_model weights")
+    parser.add_argument("--resolution", type=int, nargs=2, default=[320, 512], help="H W")
+    parser.add_argument("--output_dir", type=str, default=None)
+    parser.add_argument("--clips_per_shard", type=int, default=64)
+    parser.add_argument("--batch_size", type=int, default=32, help="frames per encoder forward")
+    parser.add_argument("--low_shard", type=int, default=0, help="used for parallel processing")
+    parser.add_argument("--high_shard", type=int, default=-1, help="used for parallel processing")
+    parser.add_argument("--device", type=str, default="cuda")
+    return parser.parse_args()
+
+
+@torch.no_grad()
+def encode_clip(dataset: RealEstate10K, first_stage_model, sample_name: str, batch_size: int, device):
+    _, video_path, _ = dataset._load_clip_meta(sample_name)
+    video_reader = dataset._get_video_reader(video_path)
+
+    H, W = dataset.resolution
+    moments = []
+    for i in range(0, len(video_reader), batch_size):
+        frames = video_reader.get_batch(list(range(i, min(i + batch_size, len(video_reader)))))
+        frames = torch.from_numpy(frames.asnumpy()).permute(3, 0, 1, 2).float()  # [c,t,h,w]
+        _1 = torch.ones(frames.shape[1], 1)  # intrinsics are not needed here
+        frames, *_ = dataset._resize_for_rectangle_crop(frames, H, W, _1, _1, _1, _1)
+        x = ((frames / 255 - 0.5) * 2).permute(1, 0, 2, 3).to(device)  # [t,c,h,w]
+        moments.append(first_stage_model.encode(x).parameters.half().cpu().numpy())
+    del video_reader
+
+    return np.concatenate(moments)
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    output_dir = args.output_dir or f"{args.dataset_root}/latents/{args.split}_{args.resolution[1]}x{args.resolution[0]}"
+    os.makedirs(output_dir, exist_ok=True)
+
+    dataset = RealEstate10K(
+        meta_path=f"{args.dataset_root}/valid_metadata/{args.split}",
+        meta_list=f"{args.dataset_root}/{args.split}_valid_list.txt",
+        data_dir=f"{args.dataset_root}/video_clips/{args.split}",
+        resolution=args.resolution,
+        spatial_transform="resize_center_crop",
+    )
+    sample_names = [x.decode("utf-8") for x in dataset.metadata]
+
+    first_stage_model, _ = load_first_stage_model(args.config, args.ckpt_path)
+    first_stage_model = first_stage_model.to(args.device)
+
+    meta = {"resolution": list(args.resolution), "spatial_transform": dataset.spatial_transform_type,
+            "moments_channels": 2 * first_stage_model.embed_dim, "dtype": "float16"}
+    meta_path = os.path.join(output_dir, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            assert json.load(f) == meta, f"{output_dir} was encoded with different settings"
+    else:
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+
+    num_shards = (len(sample_names) + args.clips_per_shard - 1) // args.clips_per_shard
+    high_shard = num_shards if args.high_shard < 0 else min(args.high_shard, num_shards)
+    for shard_id in range(args.low_shard, high_shard):
+        shard_path = os.path.join(output_dir, f"shard_{shard_id:05d}")
+        if os.path.exists(f"{shard_path}.json"):
+            continue
+
+        moments, shard_index, start = [], {}, 0
+        shard_names = sample_names[shard_id * args.clips_per_shard:(shard_id + 1) * args.clips_per_shard]
+        for sample_name in tqdm(shard_names, desc=f"shard {shard_id}/{num_shards}"):
+            try:
+                clip_moments = encode_clip(dataset, first_stage_model, sample_name, args.batch_size, args.device)
+            except Exception as e:
+                print(f"failed to encode {sample_name}: {e}")
+                continue
+            shard_index[sample_name] = [start, len(clip_moments)]
+            start += len(clip_moments)
+            moments.append(clip_moments)
+
+        if len(moments) > 0:
+            np.save(f"{shard_path}.npy", np.concatenate(moments))
+        with open(f"{shard_path}.json", "w") as f:
+            json.dump(shard_index, f)
@@ -1,15 +1,17 @@
 # modified from https://github.com/cashiwamochi/RealEstate10K_Downloader/blob/master/generate_dataset.py
 
 import glob
+import json
 import os
 import pickle
+import shutil
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from multiprocessing import Pool
 from time import sleep
+from typing import Callable
 from uuid import uuid4
 
-from pytubefix import YouTube
-from pytubefix.cli import on_progress
-from pytubefix.streams import Stream
 from tqdm import tqdm
 
 
@@ -30,15 +32,51 @@ class Data:
         return len(self.list_seqnames)
 
 
+def parse_pose_file(txt_file: str) -> tuple[str, str, list[int]]:
+    seq_name = os.path.basename(txt_file).split(".")[0]
+    with open(txt_file, "r") as f:
+        lines = f.readlines()
+    youtube_url = lines[0].strip()
+    list_timestamps = [int(line.split(" ")[0]) for line in lines[1:]]
+    return seq_name, youtube_url, list_timestamps
+
+
+def download_youtube(url: str, filepath: str):
+    from pytubefix import YouTube
+    from pytubefix.streams import Stream
+
+    tmppath = f"/tmp/re10k_{uuid4().fields[0]:x}.mp4"
+    # sometimes this fails because of known issues of pytube and unknown factors
+    yt = YouTube(url, use_oauth=True)
+    # download the highest resolution by default
+    stream: Stream = yt.streams.filter().order_by("resolution").last()
+    stream.download(output_path=os.path.dirname(tmppath), filename=os.path.basename(tmppath))
+    shutil.move(tmppath, filepath)
+
+
 class DataDownloader:
-    def __init__(self, dataroot: str, split: str):
+    """
+    download_fn: download_fn(url, filepath) saves the video of url to filepath and raises on failure
+    num_workers: number of concurrent downloads
+    retry_failed: retry videos that failed in previous runs, they are skipped otherwise
+    """
+
+    def __init__(self, dataroot: str, split: str, download_fn: Callable[[str, str], None] = download_youtube,
+                 num_workers: int = 4, num_parse_workers: int = 16, retry_failed: bool = False):
         print("[INFO] Loading data list ... ", end="")
         self.dataroot = dataroot
         self.split = split
         self.output_root = f"{dataroot}/videos/{split}"
         os.makedirs(self.output_root, exist_ok=True)
 
+        self.download_fn = download_fn
+        self.num_workers = num_workers
+        self.num_parse_workers = num_parse_workers
+        self.retry_failed = retry_failed
+
         self.list_data_pkl = f"{dataroot}/{split}_list_data.pkl"
+        # one json line per finished video, {"video": ..., "status": "done" | "failed"}, the last line wins
+        self.state_file = f"{dataroot}/{split}_download_state.jsonl"
         self.list_seqnames = sorted(glob.glob(f"{dataroot}/pose_files/{split}/*.txt"))
 
         self.list_data = self.prepare_list_data()
@@ -52,66 +90,68 @@ class DataDownloader:
             with open(self.list_data_pkl, "rb") as f:
                 return pickle.load(f)
 
-        list_data: list[Data] = []
-        for txt_file in tqdm(self.list_seqnames, desc="Loading metadata"):
-            dir_name = txt_file.split("/")[-1]
-            seq_name = dir_name.split(".")[0]
-
-            # extract info from txt
-            seq_file = open(txt_file, "r")
-            lines = seq_file.readlines()
-            youtube_url = ""
-            list_timestamps = []
-            for idx, line in enumerate(lines):
-                if idx == 0:
-                    youtube_url = line.strip()
-                else:
-                    timestamp = int(line.split(" ")[0])
-                    list_timestamps.append(timestamp)
-            seq_file.close()
-
-            isRegistered = False
-            for i in range(len(list_data)):
-                if youtube_url == list_data[i].url:
-                    isRegistered = True
-                    list_data[i].add(seq_name, list_timestamps)
-                else:
-                    pass
-
-            if not isRegistered:
-                list_data.append(Data(youtube_url, seq_name, list_timestamps))
+        with Pool(self.num_parse_workers) as pool:
+            results = list(tqdm(pool.imap(parse_pose_file, self.list_seqnames, chunksize=64), total=len(self.list_seqnames), desc="Loading metadata"))
+
+        # group sequences by url in first-seen order
+        url_to_data: dict[str, Data] = {}
+        for seq_name, youtube_url, list_timestamps in results:
+            if youtube_url in url_to_data:
+                url_to_data[youtube_url].add(seq_name, list_timestamps)
+            else:
+                url_to_data[youtube_url] = Data(youtube_url, seq_name, list_timestamps)
+        list_data = list(url_to_data.values())
 
         with open(self.list_data_pkl, "wb") as f:
             pickle.dump(list_data, f)
-        
+
         return list_data
 
-    def run(self):
-        print("[INFO] Start downloading {} movies".format(len(self.list_data)))
+    def load_state(self) -> dict[str, str]:
+        state = {}
+        if os.path.exists(self.state_file):
+            with open(self.state_file, "r") as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except json.JSONDecodeError:  # truncated by an interruption
+                        continue
+                    state[item["video"]] = item["status"]
+        return state
+
+    def download(self, data: Data, filepath: str):
+        self.download_fn(data.url, filepath)
+        sleep(1)
 
-        for global_count, data in enumerate(self.list_data):
+    def run(self):
+        state = self.load_state()
+        todo = []
+        for data in self.list_data:
             filepath = f"{self.output_root}/{data.url.split('=')[-1]}.mp4"
+            video = os.path.basename(filepath)
+            # a video recorded as done is downloaded again if its file was deleted since
             if os.path.exists(filepath):
                 continue
-
-            print(f"[INFO] Downloading {global_count:04d}: {data.url}")
-
-            tmpname = f"re10k_{uuid4().fields[0]:x}.mp4"
-            try:
-                # sometimes this fails because of known issues of pytube and unknown factors
-                yt = YouTube(data.url, use_oauth=True, on_progress_callback=on_progress)
-                stream: Stream = yt.streams.filter().order_by("resolution").last()
-                # stream.download(output_path=self.output_root, filename=filename)
-                stream.download(output_path="/tmp", filename=tmpname)
-            except Exception as e:
-                print(e)
-                with open(f"failed_videos_{self.split}.txt", "a") as f:
-                    f.writelines(os.path.basename(filepath) + "\n")
+            if state.get(video) == "failed" and not self.retry_failed:
                 continue
-
-            os.system(f"mv /tmp/{tmpname} {filepath}")
-
-            sleep(1)
+            todo.append((data, filepath))
+        print("[INFO] Start downloading {} movies, {} skipped".format(len(todo), len(self.list_data) - len(todo)))
+
+        with ThreadPoolExecutor(self.num_workers) as executor, open(self.state_file, "a") as state_f:
+            futures = {executor.submit(self.download, data, filepath): (data, filepath) for data, filepath in todo}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Downloading"):
+                data, filepath = futures[future]
+                video = os.path.basename(filepath)
+                try:
+                    future.result()
+                    status = "done"
+                except Exception as e:
+                    print(f"[INFO] Failed {data.url}: {e}")
+                    with open(f"failed_videos_{self.split}.txt", "a") as f:
+                        f.writelines(video + "\n")
+                    status = "failed"
+                state_f.write(json.dumps({"video": video, "status": status}) + "\n")
+                state_f.flush()
 
     def show(self):
         print("########################################")
@@ -131,8 +171,10 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--dataroot", type=str, default="datasets/RealEstate10K")
     parser.add_argument("--split", type=str, required=True, choices=["train", "test"])
+    parser.add_argument("--num_workers", type=int, default=4, help="concurrent downloads")
+    parser.add_argument("--retry_failed", action="store_true", help="retry videos that failed in previous runs")
     args = parser.parse_args()
 
-    downloader = DataDownloader(args.dataroot, args.split)
+    downloader = DataDownloader(args.dataroot, args.split, num_workers=args.num_workers, retry_failed=args.retry_failed)
     downloader.show()
     downloader.run()
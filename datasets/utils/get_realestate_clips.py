@@ -3,10 +3,12 @@
 import argparse
 import json
 import os
+from functools import partial
+from multiprocessing import Pool
 
+import av
 import imageio
 from decord import VideoReader
-from moviepy.editor import VideoFileClip
 from tqdm import tqdm
 
 
@@ -14,12 +16,120 @@ def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--dataset_root", type=str, default="datasets/RealEstate10K")
     parser.add_argument("--split", type=str, required=True, choices=["train", "test"])
-    parser.add_argument("--low_idx", type=int, default=0, help="used for parallel processing")
-    parser.add_argument("--high_idx", type=int, default=-1, help="used for parallel processing")
-    parser.add_argument("--resolution", type=int, default=None)
+    parser.add_argument("--resolution", type=int, default=None, help="height of the clips, width keeps the aspect ratio")
+    parser.add_argument("--num_workers", type=int, default=8, help="videos decoded in parallel")
     return parser.parse_args()
 
 
+def is_clip_done(clip_save_path: str, num_frames: int):
+    if not os.path.exists(clip_save_path):
+        return False
+    try:
+        return len(VideoReader(clip_save_path)) == num_frames
+    except:
+        return False
+
+
+def extract_clips(video_path: str, clips: dict[str, list[int]], clip_save_dir: str, resolution: int = None):
+    """
+    Decode the video once in order and write all clips, frame of timestamp t is the last frame starting at or before t.
+    clips: clip name -> timestamps in microseconds
+    :return: names of the clips written completely
+    """
+    # (time in seconds, clip name, frame index in clip), consumed in order while decoding
+    requests = sorted((t / 1_000_000, clip_name, i) for clip_name, timestamps in clips.items() for i, t in enumerate(timestamps))
+    if len(requests) == 0:
+        return []
+
+    writers, num_written, finished = {}, {clip_name: 0 for clip_name in clips}, []
+
+    def write(clip_name, frame):
+        if clip_name not in writers:
+            writers[clip_name] = imageio.get_writer(f"{clip_save_dir}/{clip_name}.tmp.mp4", fps=fps, macro_block_size=None)
+        writers[clip_name].append_data(frame)
+        num_written[clip_name] += 1
+        if num_written[clip_name] == len(clips[clip_name]):
+            writers.pop(clip_name).close()
+            os.replace(f"{clip_save_dir}/{clip_name}.tmp.mp4", f"{clip_save_dir}/{clip_name}.mp4")
+            finished.append(clip_name)
+
+    try:
+        with av.open(video_path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = "AUTO"
+            fps = float(stream.average_rate)
+            start_time = float(stream.start_time * stream.time_base) if stream.start_time is not None else 0.0
+            width, height = stream.codec_context.width, stream.codec_context.height
+            if resolution is not None:
+                width, height = int(width * resolution / height), resolution
+
+            # jump to the keyframe before the first requested frame
+            container.seek(int((requests[0][0] + start_time) / stream.time_base), stream=stream, backward=True)
+
+            # frames are converted to rgb only when requested, and once even if requested by several clips
+            r, prev, prev_array = 0, None, None
+            for frame in container.decode(stream):
+                frame_time = frame.time - start_time
+                # every pending timestamp before this frame belongs to the previous frame
+                while r < len(requests) and requests[r][0] < frame_time - 1e-6:
+                    if prev is None:  # requested before the first decoded frame
+                        prev = frame
+                    if prev_array is None:
+                        prev_array = prev.to_ndarray(format="rgb24", width=width, height=height)
+                    write(requests[r][1], prev_array)
+                    r += 1
+                if r == len(requests):
+                    break
+                prev, prev_array = frame, (prev_array if prev is frame else None)
+
+            # timestamps after the last frame
+            while r < len(requests) and prev is not None:
+                if prev_array is None:
+                    prev_array = prev.to_ndarray(format="rgb24", width=width, height=height)
+                write(requests[r][1], prev_array)
+                r += 1
+    finally:
+        # clips not completed, e.g. on a decode error, are not kept
+        for clip_name, writer in writers.items():
+            writer.close()
+            os.remove(f"{clip_save_dir}/{clip_name}.tmp.mp4")
+
+    return finished
+
+
+def process_video(item: tuple[str, list[str]], dataset_root: str, split: str, resolution: int = None):
+    """
+    :return: video name, status ("done", "partial", "failed" or "missing"), number of clips written, clips still missing
+    """
+    video_name, clip_list = item
+    video_path = f"{dataset_root}/videos/{split}/{video_name}.mp4"
+    if not os.path.exists(video_path):
+        return video_name, "missing", 0, list(clip_list)
+
+    clip_save_dir = f"{dataset_root}/video_clips/{split}/{video_name}"
+    os.makedirs(clip_save_dir, exist_ok=True)
+
+    clips, missing = {}, []
+    for clip_name in clip_list:
+        with open(f"{dataset_root}/pose_files/{split}/{clip_name}.txt", "r") as f:
+            timestamps = [int(x.split(" ")[0]) for x in f.readlines()[1:]]
+        if timestamps[-1] <= timestamps[0]:
+            missing.append(clip_name)
+            continue
+        if is_clip_done(f"{clip_save_dir}/{clip_name}.mp4", len(timestamps)):
+            continue
+        clips[clip_name] = timestamps
+
+    try:
+        finished = extract_clips(video_path, clips, clip_save_dir, resolution)
+    except Exception as e:
+        print(f"failed to extract clips of {video_name}: {e}")
+        return video_name, "failed", 0, list(clip_list)
+    # e.g. nothing could be decoded at the requested timestamps
+    missing += [clip_name for clip_name in clips if clip_name not in finished]
+    return video_name, "partial" if missing else "done", len(finished), missing
+
+
 if __name__ == "__main__":
     args = get_args()
 
@@ -28,34 +138,30 @@ if __name__ == "__main__":
 
     with open(f"{args.dataset_root}/{args.split}_video2clip.json", "r") as f:
         video2clips: list[tuple[str, list[str]]] = list(json.load(f).items())
-    if args.high_idx != -1:
-        video2clips = video2clips[: args.high_idx]
-    video2clips = video2clips[args.low_idx :]
 
-    for video_name, clip_list in tqdm(video2clips):
-        video_path = f"{args.dataset_root}/videos/{args.split}/{video_name}.mp4"
-        if not os.path.exists(video_path):
-            continue
-
-        video = VideoFileClip(video_path, audio=False, target_resolution=(args.resolution, None))
-
-        clip_save_dir = f"{args.dataset_root}/video_clips/{args.split}/{video_name}"
-        os.makedirs(clip_save_dir, exist_ok=True)
-
-        for clip_name in tqdm(clip_list):
-            with open(f"{args.dataset_root}/pose_files/{args.split}/{clip_name}.txt", "r") as f:
-                timestamps = [int(x.split(" ")[0]) for x in f.readlines()[1:]]
-            if timestamps[-1] <= timestamps[0]:
-                continue
-
-            clip_save_path = f"{clip_save_dir}/{clip_name}.mp4"
-            if os.path.exists(clip_save_path):
+    # one json line per processed video, the last line wins. finished videos are skipped when resuming,
+    # only the missing clips of partial videos are retried
+    manifest_path = f"{args.dataset_root}/{args.split}_clips_manifest.jsonl"
+    state = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            for line in f:
                 try:
-                    video_reader = VideoReader(clip_save_path)
-                    if len(video_reader) == len(timestamps):
-                        continue
-                except:
-                    pass
-
-            frames = [video.get_frame(t / 1_000_000) for t in timestamps]
-            imageio.mimsave(clip_save_path, frames, fps=video.fps, macro_block_size=None)
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                state[item["video"]] = item
+    todo = []
+    for video_name, clip_list in video2clips:
+        item = state.get(video_name)
+        if item is None or item["status"] not in ("done", "partial"):
+            todo.append((video_name, clip_list))
+        elif item["status"] == "partial":
+            todo.append((video_name, item["missing"]))
+    print(f"extracting clips of {len(todo)} videos, {len(video2clips) - len(todo)} already done")
+
+    fn = partial(process_video, dataset_root=args.dataset_root, split=args.split, resolution=args.resolution)
+    with Pool(args.num_workers) as pool, open(manifest_path, "a") as manifest:
+        for video_name, status, num_clips, missing in tqdm(pool.imap_unordered(fn, todo), total=len(todo)):
+            manifest.write(json.dumps({"video": video_name, "status": status, "clips": num_clips, "missing": missing}) + "\n")
+            manifest.flush()
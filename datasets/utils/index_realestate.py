@@ -0,0 +1,58 @@
+"""
+Pack valid_metadata/{split}/*.txt into a binary index, consumed through `pose_index_path` of RealEstate10K.
+
+Output ({dataset_root}/pose_index/{split}):
+    poses.npy, poses_offsets.npy                float32 [total_frames, 19] camera rows, clip i is offsets[i]:offsets[i+1]
+    names.npy                                   bytes [num_clips], sorted clip ids, clip i is names[i], looked up by np.searchsorted
+    captions.npy, captions_offsets.npy          captions, utf-8 bytes
+    video_paths.npy, video_paths_offsets.npy    video paths relative to data_dir without extension, utf-8 bytes
+"""
+
+import argparse
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from CameraControl.data.utils import save_packed_arrays, save_packed_strings
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset_root", type=str, default="datasets/RealEstate10K")
+    parser.add_argument("--split", type=str, required=True, choices=["train", "test"])
+    parser.add_argument("--num_workers", type=int, default=16)
+    return parser.parse_args()
+
+
+def parse_meta(meta_file: str):
+    with open(meta_file, "r") as f:
+        lines = f.readlines()
+    poses = np.loadtxt(lines[3:], dtype=np.float64, ndmin=2).astype(np.float32)
+    return lines[2].strip(), lines[1].strip(), poses
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    save_dir = f"{args.dataset_root}/pose_index/{args.split}"
+    os.makedirs(save_dir, exist_ok=True)
+
+    with open(f"{args.dataset_root}/{args.split}_valid_list.txt", "r") as f:
+        sample_names = [line.strip() for line in f.readlines()]
+    # sorted, so that the dataset finds a clip by binary search without building a dict in every worker
+    sample_names = sorted(sample_names)
+    meta_files = [f"{args.dataset_root}/valid_metadata/{args.split}/{x}.txt" for x in sample_names]
+
+    with Pool(args.num_workers) as pool:
+        results = list(tqdm(pool.imap(parse_meta, meta_files, chunksize=64), total=len(meta_files)))
+    captions, video_paths, poses = zip(*results) if len(results) > 0 else ([], [], [])
+
+    save_packed_arrays(f"{save_dir}/poses", poses, dtype=np.float32)
+    np.save(f"{save_dir}/names.npy", np.array([x.encode("utf-8") for x in sample_names], dtype=np.bytes_))
+    save_packed_strings(f"{save_dir}/captions", captions)
+    save_packed_strings(f"{save_dir}/video_paths", video_paths)
+    print(f"indexed {len(sample_names)} clips, {sum(len(x) for x in poses)} frames to {save_dir}")
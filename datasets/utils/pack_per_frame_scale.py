@@ -0,0 +1,42 @@
+"""
+Convert a pickled per-frame scale dict ({clip id: [frame_num] scales}, saved by np.savez) into packed arrays,
+consumed through `per_frame_scale_path` of RealEstate10K without unpickling the dict in every dataloader worker.
+
+Output ({dataset_root}/per_frame_scale/{split}):
+    scales.npy, scales_offsets.npy      float32 [total_frames] scales, clip i is offsets[i]:offsets[i+1]
+    names.npy                           bytes [num_clips], sorted clip ids, clip i is names[i], looked up by np.searchsorted
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from CameraControl.data.utils import save_packed_arrays
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset_root", type=str, default="datasets/RealEstate10K")
+    parser.add_argument("--split", type=str, required=True, choices=["train", "test"])
+    parser.add_argument("--per_frame_scale_path", type=str, required=True, help="npz file of the pickled dict")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    save_dir = f"{args.dataset_root}/per_frame_scale/{args.split}"
+    os.makedirs(save_dir, exist_ok=True)
+
+    per_frame_scale = np.load(args.per_frame_scale_path, allow_pickle=True)["arr_0"].item()
+    with open(f"{args.dataset_root}/{args.split}_valid_list.txt", "r") as f:
+        sample_names = [line.strip() for line in f.readlines()]
+    # sorted, so that the dataset finds a clip by binary search without building a dict in every worker
+    sample_names = sorted(x for x in sample_names if x in per_frame_scale)
+
+    save_packed_arrays(f"{save_dir}/scales", [np.asarray(per_frame_scale[x]).reshape(-1) for x in sample_names], dtype=np.float32)
+    np.save(f"{save_dir}/names.npy", np.array([x.encode("utf-8") for x in sample_names], dtype=np.bytes_))
+    print(f"packed per-frame scales of {len(sample_names)}/{len(per_frame_scale)} clips to {save_dir}")
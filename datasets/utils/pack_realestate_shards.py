@@ -0,0 +1,97 @@
+"""
+Pack RealEstate10K clips, camera rows and captions into tar shards, consumed by RealEstate10KShards.
+
+Output ({dataset_root}/shards/{split}):
+    shard_xxxxx.tar    {clip}.mp4, {clip}.npy (float64 [frame_num, 19] camera rows), {clip}.json (caption, video_path)
+    list.txt           clip ids of all shards
+    index.json         shard paths and number of clips, written last
+Clips are shuffled before sharding, so that every shard mixes clips of many source videos.
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tarfile
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from CameraControl.data.realestate10k import RealEstate10K
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset_root", type=str, default="datasets/RealEstate10K")
+    parser.add_argument("--split", type=str, required=True, choices=["train", "test"])
+    parser.add_argument("--data_dir", type=str, default=None, help="clips to pack, e.g. resized clips, default video_clips/{split}")
+    parser.add_argument("--clips_per_shard", type=int, default=256,
+                        help="training needs at least num_workers * world_size shards, shards beyond a multiple of it are not read")
+    parser.add_argument("--num_workers", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def add_bytes(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_shard(shard: tuple[int, list[str]], dataset: RealEstate10K, save_dir: str):
+    shard_id, sample_names = shard
+    shard_path = f"{save_dir}/shard_{shard_id:05d}.tar"
+
+    packed = []
+    with tarfile.open(f"{shard_path}.tmp", "w") as tar:
+        for sample_name in sample_names:
+            try:
+                caption, video_path, camera_rows = dataset._load_clip_meta(sample_name)
+                with open(video_path, "rb") as f:
+                    video_bytes = f.read()
+            except Exception as e:
+                print(f"failed to pack {sample_name}: {e}")
+                continue
+
+            camera_bytes = io.BytesIO()
+            np.save(camera_bytes, np.asarray(camera_rows))
+            meta = {"caption": caption, "video_path": os.path.relpath(video_path, dataset.data_dir)}
+
+            add_bytes(tar, f"{sample_name}.mp4", video_bytes)
+            add_bytes(tar, f"{sample_name}.npy", camera_bytes.getvalue())
+            add_bytes(tar, f"{sample_name}.json", json.dumps(meta).encode("utf-8"))
+            packed.append(sample_name)
+    os.replace(f"{shard_path}.tmp", shard_path)
+
+    return os.path.basename(shard_path), packed
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    save_dir = f"{args.dataset_root}/shards/{args.split}"
+    os.makedirs(save_dir, exist_ok=True)
+
+    dataset = RealEstate10K(
+        meta_path=f"{args.dataset_root}/valid_metadata/{args.split}",
+        meta_list=f"{args.dataset_root}/{args.split}_valid_list.txt",
+        data_dir=args.data_dir or f"{args.dataset_root}/video_clips/{args.split}",
+        spatial_transform="resize_center_crop",
+    )
+    sample_names = [x.decode("utf-8") for x in dataset.metadata]
+    random.Random(args.seed).shuffle(sample_names)
+    shards = list(enumerate(sample_names[i:i + args.clips_per_shard] for i in range(0, len(sample_names), args.clips_per_shard)))
+
+    with Pool(args.num_workers) as pool:
+        results = list(tqdm(pool.imap(partial(write_shard, dataset=dataset, save_dir=save_dir), shards), total=len(shards)))
+
+    with open(f"{save_dir}/list.txt", "w") as f:
+        f.writelines(f"{x}\n" for _, packed in results for x in packed)
+    with open(f"{save_dir}/index.json", "w") as f:
+        json.dump({"shards": [{"path": path, "num_clips": len(packed)} for path, packed in results]}, f, indent=2)
+    print(f"packed {sum(len(x) for _, x in results)} clips into {len(results)} shards at {save_dir}")
@@ -0,0 +1,242 @@
+"""
+Incremental runner of datasets/preprocess.sh: download -> clips -> metadata, per source video.
+
+Each stage writes a completion marker per video to {dataroot}/.pipeline/{split}/{stage}/{video}.json with a
+signature of its inputs, and a video is only reprocessed by a stage when the signature changes. Stages run
+concurrently: clips of a video are extracted as soon as its download finishes, while other downloads continue.
+At the end, {split}_video2clip.json and {split}_valid_list.txt are rewritten from the markers.
+
+python datasets/utils/pipeline.py --split "test"
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import Pool
+
+from tqdm import tqdm
+
+# sibling scripts, also when imported or run from another directory, e.g. python -m datasets.utils.pipeline
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from generate_dataset import download_youtube, parse_pose_file
+from get_realestate_clips import process_video
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataroot", type=str, default="datasets/RealEstate10K")
+    parser.add_argument("--split", type=str, required=True, choices=["train", "test"])
+    parser.add_argument("--download_workers", type=int, default=4)
+    parser.add_argument("--clip_workers", type=int, default=8)
+    parser.add_argument("--resolution", type=int, default=None, help="height of the clips, see get_realestate_clips.py")
+    parser.add_argument("--retry_failed", action="store_true", help="retry videos that failed in previous runs")
+    parser.add_argument("--skip_download", action="store_true", help="only process videos already downloaded")
+    return parser.parse_args()
+
+
+def get_signature(*items) -> str:
+    return hashlib.sha1(json.dumps(items, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_file_signature(path: str):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Markers:
+    """ per-item completion markers of a stage """
+
+    def __init__(self, root: str, stage: str):
+        self.dir = f"{root}/{stage}"
+        os.makedirs(self.dir, exist_ok=True)
+
+    def load(self, item: str) -> dict:
+        try:
+            with open(f"{self.dir}/{item}.json", "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def is_done(self, item: str, signature: str) -> bool:
+        marker = self.load(item)
+        return marker is not None and marker["status"] == "done" and marker["signature"] == signature
+
+    def save(self, item: str, signature: str, status: str = "done", **info):
+        with open(f"{self.dir}/{item}.json.tmp", "w") as f:
+            json.dump({"status": status, "signature": signature, **info}, f)
+        os.replace(f"{self.dir}/{item}.json.tmp", f"{self.dir}/{item}.json")
+
+
+class Pipeline:
+    def __init__(self, dataroot: str, split: str, download_fn=download_youtube, download_workers: int = 4,
+                 clip_workers: int = 8, resolution: int = None, retry_failed: bool = False, skip_download: bool = False):
+        self.dataroot = dataroot
+        self.split = split
+        self.download_fn = download_fn
+        self.download_workers = download_workers
+        self.clip_workers = clip_workers
+        self.resolution = resolution
+        self.retry_failed = retry_failed
+        self.skip_download = skip_download
+
+        marker_root = f"{dataroot}/.pipeline/{split}"
+        self.markers = {stage: Markers(marker_root, stage) for stage in ["download", "clips", "metadata"]}
+
+        self.pose_root = f"{dataroot}/pose_files/{split}"
+        self.video_root = f"{dataroot}/videos/{split}"
+        self.clip_root = f"{dataroot}/video_clips/{split}"
+        self.metadata_root = f"{dataroot}/valid_metadata/{split}"
+        for path in [self.video_root, self.clip_root, self.metadata_root]:
+            os.makedirs(path, exist_ok=True)
+
+    def gather(self):
+        """ video -> url, clip ids and their pose lines, replaces gather_realestate.py """
+        pose_files = sorted(os.path.join(self.pose_root, x) for x in os.listdir(self.pose_root) if x.endswith(".txt"))
+        with Pool(self.clip_workers) as pool:
+            results = list(tqdm(pool.imap(parse_pose_file, pose_files, chunksize=64), total=len(pose_files), desc="Gathering"))
+
+        self.urls, self.video2clip = {}, defaultdict(list)
+        for seq_name, url, _ in results:
+            video = url.split("=")[-1]
+            self.urls[video] = url
+            self.video2clip[video].append(seq_name)
+        with open(f"{self.dataroot}/{self.split}_video2clip.json", "w") as f:
+            json.dump(self.video2clip, f)
+        print(f"{len(pose_files)} clips of {len(self.video2clip)} videos")
+
+    def clips_signature(self, video: str) -> str:
+        clips = [(x, get_file_signature(f"{self.pose_root}/{x}.txt")) for x in sorted(self.video2clip[video])]
+        return get_signature(get_file_signature(f"{self.video_root}/{video}.mp4"), clips, self.resolution)
+
+    def metadata_signature(self, video: str) -> str:
+        captions = [(x, self.captions.get(f"{x}.mp4")) for x in sorted(self.video2clip[video])]
+        clips_marker = self.markers["clips"].load(video)
+        # clips retried after a partial extraction change the metadata with the same clip inputs
+        return get_signature(clips_marker["signature"], clips_marker.get("missing", []), captions)
+
+    def download(self, video: str):
+        self.download_fn(self.urls[video], f"{self.video_root}/{video}.mp4")
+
+    def extract_metadata(self, video: str) -> list[str]:
+        """ valid_metadata/{clip}.txt of the clips of one video, replaces preprocess_realestate.py """
+        valid = []
+        for clip_id in self.video2clip[video]:
+            captions = self.captions.get(f"{clip_id}.mp4")
+            clip_path = f"{video}/{clip_id}"
+            if captions is None or not os.path.exists(f"{self.clip_root}/{clip_path}.mp4"):
+                continue
+            with open(f"{self.pose_root}/{clip_id}.txt", "r") as f:
+                lines = [line.strip() for line in f.readlines()]
+            if len(lines[1:]) < 16:
+                continue
+            with open(f"{self.metadata_root}/{clip_id}.txt", "w") as f:
+                f.writelines(f"{x}\n" for x in [lines[0], clip_path, captions[0]] + lines[1:])
+            valid.append(clip_id)
+        return valid
+
+    def run(self):
+        self.gather()
+        with open(f"{self.dataroot}/{self.split}_captions.json", "r") as f:
+            self.captions = json.load(f)
+
+        pending_downloads, ready = [], []
+        for video in self.video2clip:
+            if os.path.exists(f"{self.video_root}/{video}.mp4"):
+                ready.append(video)
+                continue
+            marker = self.markers["download"].load(video)
+            if self.skip_download or (marker is not None and marker["status"] == "failed" and not self.retry_failed):
+                continue
+            pending_downloads.append(video)
+        print(f"{len(ready)} videos downloaded, {len(pending_downloads)} to download")
+
+        progress = tqdm(total=len(pending_downloads) + len(ready), desc="Videos")
+        # clip workers start lazily while download threads are running, fork could copy locks held by those threads
+        clip_context = multiprocessing.get_context("forkserver")
+        with ThreadPoolExecutor(self.download_workers) as download_pool, \
+                ProcessPoolExecutor(self.clip_workers, mp_context=clip_context) as clip_pool:
+            futures = {download_pool.submit(self.download, video): ("download", video, None) for video in pending_downloads}
+
+            def schedule_clips(video):
+                signature = self.clips_signature(video)
+                if self.markers["clips"].is_done(video, signature):
+                    return schedule_metadata(video)
+                marker = self.markers["clips"].load(video)
+                if marker is not None and marker["status"] == "partial" and marker["signature"] == signature:
+                    # same inputs, only retry the clips missing from the last run
+                    item = (video, marker["missing"])
+                else:
+                    if marker is not None and marker["signature"] != signature:
+                        # inputs changed, clips of the old video or poses would be kept by get_realestate_clips.py
+                        for clip_id in self.video2clip[video]:
+                            if os.path.exists(f"{self.clip_root}/{video}/{clip_id}.mp4"):
+                                os.remove(f"{self.clip_root}/{video}/{clip_id}.mp4")
+                    item = (video, sorted(self.video2clip[video]))
+                future = clip_pool.submit(process_video, item, self.dataroot, self.split, self.resolution)
+                futures[future] = ("clips", video, signature)
+
+            def schedule_metadata(video):
+                # cheap, run inline
+                signature = self.metadata_signature(video)
+                if not self.markers["metadata"].is_done(video, signature):
+                    self.markers["metadata"].save(video, signature, valid=self.extract_metadata(video))
+                progress.update()
+
+            for video in ready:
+                schedule_clips(video)
+
+            while len(futures) > 0:
+                done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, video, signature = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"{stage} failed for {video}: {e}")
+                        self.markers[stage].save(video, signature, status="failed", error=str(e))
+                        progress.update()
+                        continue
+
+                    if stage == "download":
+                        self.markers["download"].save(video, self.urls[video])
+                        schedule_clips(video)
+                    elif stage == "clips":
+                        _, status, _, missing = result
+                        if status not in ("done", "partial"):
+                            self.markers["clips"].save(video, signature, status=status)
+                            progress.update()
+                            continue
+                        # clips of partial videos are usable, the missing ones are retried by the next run
+                        self.markers["clips"].save(video, signature, status=status, missing=missing)
+                        schedule_metadata(video)
+        progress.close()
+
+        valid = set()
+        for video in self.video2clip:
+            marker = self.markers["metadata"].load(video)
+            if marker is not None and marker["status"] == "done":
+                valid.update(marker["valid"])
+        # same order as the captions, as preprocess_realestate.py
+        valid_list = [x.split(".")[0] for x in self.captions if x.split(".")[0] in valid]
+        with open(f"{self.dataroot}/{self.split}_valid_list.txt", "w") as f:
+            f.writelines(f"{x}\n" for x in valid_list)
+        print(f"{len(valid_list)} valid clips")
+
+
+if __name__ == "__main__":
+    args = get_args()
+    pipeline = Pipeline(
+        args.dataroot,
+        args.split,
+        download_workers=args.download_workers,
+        clip_workers=args.clip_workers,
+        resolution=args.resolution,
+        retry_failed=args.retry_failed,
+        skip_download=args.skip_download,
+    )
+    pipeline.run()
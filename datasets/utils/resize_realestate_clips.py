@@ -0,0 +1,66 @@
+"""
+Store RealEstate10K clips already resized to cover the training resolution, so that RealEstate10K only center crops them.
+
+The size follows RealEstate10K._get_resized_size, so the camera intrinsics computed from the resized clips are
+identical to those computed from the raw clips. Point `data_dir` of the dataset to the output folder.
+"""
+
+import argparse
+import glob
+import os
+import sys
+from functools import partial
+from multiprocessing import Pool
+
+import imageio
+from decord import VideoReader, cpu
+from tqdm import tqdm
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from CameraControl.data.realestate10k import RealEstate10K
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset_root", type=str, default="datasets/RealEstate10K")
+    parser.add_argument("--split", type=str, required=True, choices=["train", "test"])
+    parser.add_argument("--resolution", type=int, nargs=2, default=[320, 512], help="H W of training")
+    parser.add_argument("--num_workers", type=int, default=16)
+    return parser.parse_args()
+
+
+def resize_clip(clip_path: str, src_dir: str, dst_dir: str, resolution: list[int]):
+    save_path = os.path.join(dst_dir, os.path.relpath(clip_path, src_dir))
+    try:
+        video_reader = VideoReader(clip_path, ctx=cpu(0))
+        num_frames, fps = len(video_reader), video_reader.get_avg_fps()
+        ori_H, ori_W = video_reader[0].shape[:2]
+        if os.path.exists(save_path) and len(VideoReader(save_path, ctx=cpu(0))) == num_frames:
+            return True
+
+        resized_H, resized_W = RealEstate10K._get_resized_size(ori_H, ori_W, *resolution)
+        video_reader = VideoReader(clip_path, ctx=cpu(0), width=resized_W, height=resized_H)
+        frames = video_reader.get_batch(list(range(num_frames))).asnumpy()
+        del video_reader
+
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+        # yuv420p needs even sizes, keep the exact size instead of padding so that intrinsics stay correct
+        pixelformat = "yuv420p" if resized_H % 2 == 0 and resized_W % 2 == 0 else "yuv444p"
+        imageio.mimsave(save_path, frames, fps=fps, quality=9, macro_block_size=1, pixelformat=pixelformat)
+        return True
+    except Exception as e:
+        print(f"failed to resize {clip_path}: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    src_dir = f"{args.dataset_root}/video_clips/{args.split}"
+    dst_dir = f"{args.dataset_root}/video_clips_{args.resolution[1]}x{args.resolution[0]}/{args.split}"
+    clip_paths = sorted(glob.glob(f"{src_dir}/**/*.mp4", recursive=True))
+
+    with Pool(args.num_workers) as pool:
+        fn = partial(resize_clip, src_dir=src_dir, dst_dir=dst_dir, resolution=args.resolution)
+        results = list(tqdm(pool.imap_unordered(fn, clip_paths, chunksize=4), total=len(clip_paths)))
+    print(f"resized {sum(results)}/{len(clip_paths)} clips to {dst_dir}")
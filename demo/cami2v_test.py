@@ -22,6 +22,7 @@ from CameraControl.data.single_image_for_inference import SingleImageForInferenc
 from CameraControl.data.utils import camera_pose_lerp, create_line_point_cloud, relative_pose
 from CameraControl.dynamicrafter.dynamicrafter import DynamiCrafter
 from CameraControl.motionctrl.motionctrl import MotionCtrl
+from lvdm.models.latent_preview import LatentPreviewer
 from utils.utils import instantiate_from_config
 
 
@@ -62,6 +63,8 @@ class Image2Video:
         video_length: int = 16,
         save_fps: int = 10,
         device: str = "cuda",
+        latent_previewer_path: str = None,
+        preview_every: int = 5,
     ):
         self.result_dir = result_dir
         self.model_meta_file = model_meta_path
@@ -76,6 +79,11 @@ class Image2Video:
         self.models: dict[str, MotionCtrl | CameraCtrl | CamI2V] = {}
         self.single_image_processors: dict[str, SingleImageForInference] = {}
 
+        self.preview_every = preview_every
+        self.latent_previewer = None
+        if latent_previewer_path:
+            self.latent_previewer = LatentPreviewer.from_pretrained(latent_previewer_path).to(self.device)
+
     def load_model(self, config_file: str, ckpt_path: str, width: int, height: int):
         config = OmegaConf.load(config_file)
         model: DynamiCrafter | MotionCtrl | CameraCtrl | CamI2V = instantiate_from_config(config.model)
@@ -148,6 +156,7 @@ class Image2Video:
         cond_frame_index: int = 0,
         eta: float = 1.0,
         ref_img2: Image.Image = None,
+        preview_callback=None,
     ):
         with open(self.camera_pose_meta_path, "r", encoding="utf-8") as f:
             camera_pose_file_path = json.load(f)[camera_pose_type]
@@ -201,6 +210,8 @@ class Image2Video:
             "result_dir": self.result_dir,
             "negative_prompt": negative_prompt
         }
+        if preview_callback is not None and self.latent_previewer is not None:
+            log_images_kwargs["img_callback"] = self.get_preview_img_callback(preview_callback, steps)
 
         frame_indices = list(range(0, self.video_length))
 
@@ -229,6 +240,14 @@ class Image2Video:
 
         return return_list
 
+    def get_preview_img_callback(self, preview_callback, steps: int):
+        # called by DDIMSampler with pred_x0 after every step, decode it approximately every `preview_every` steps
+        def img_callback(pred_x0: Tensor, i: int):
+            if (i + 1) % self.preview_every == 0 and i + 1 < steps:
+                preview_callback(self.latent_previewer.to_image(pred_x0))
+
+        return img_callback
+
     def get_camera_trace(self, rel_c2ws: Tensor):
         points, colors = [], []
         for frame_idx, rel_c2w in enumerate(rel_c2ws):
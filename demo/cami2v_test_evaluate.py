@@ -1,5 +1,6 @@
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4
 
 import numpy as np
@@ -24,6 +25,9 @@ from CameraControl.dynamicrafter.dynamicrafter import DynamiCrafter
 from CameraControl.motionctrl.motionctrl import MotionCtrl
 from utils.utils import instantiate_from_config
 
+# prepended to the captions of all samples
+PROMPT_PREFIX = "4K resolution, cinematic shot, photorealistic, detailed fur, smooth motion; "
+
 
 def default(a, b):
     return a if a is not None else b
@@ -125,6 +129,104 @@ class Image2Video:
             v.cpu()
         torch.cuda.empty_cache()
 
+    def get_model(self, model_name: str):
+        """ load the model on first use and keep it, other models are offloaded to cpu """
+        for k, v in self.models.items():
+            if k != model_name:
+                v.cpu()
+        torch.cuda.empty_cache()
+
+        if model_name not in self.models:
+            with open(self.model_meta_file, "r", encoding="utf-8") as f:
+                model_metadata = json.load(f)[model_name]
+            print(f"loading model {model_name}, metadata:", model_metadata)
+            model, single_image_preprocessor = self.load_model(**model_metadata)
+
+            self.models[model_name] = model
+            self.single_image_processors[model_name] = single_image_preprocessor
+            print("models loaded:", list(self.models.keys()))
+
+        print("using", model_name)
+        model = self.models[model_name].to(self.device)
+        torch.cuda.empty_cache()
+
+        return model, self.single_image_processors[model_name]
+
+    def get_camera_poses(
+        self,
+        camera_path: str,
+        trace_extract_ratio: float = 1.0,
+        use_bezier_curve: bool = False,
+        bezier_coef_a: float = None,
+        bezier_coef_b: float = None,
+        loop: bool = False,
+    ) -> Tensor:
+        camera_data = torch.from_numpy(np.loadtxt(camera_path, comments="https"))  # t, -1
+        w2cs_3x4 = camera_data[:, 7:].reshape(-1, 3, 4)  # [t, 3, 4]
+        w2cs_4x4 = torch.cat(
+            [w2cs_3x4, torch.tensor([[[0, 0, 0, 1]]] * w2cs_3x4.shape[0], device=w2cs_3x4.device)], dim=1
+        )  # [t, 4, 4]
+        c2ws_4x4 = w2cs_4x4.inverse()  # [t, 4, 4]
+        if use_bezier_curve:
+            c2ws_4x4 = camera_pose_lerp_bezier(c2ws_4x4, c2ws_4x4.shape[0], bezier_coef_a, bezier_coef_b)
+        if loop:
+            c2ws_4x4 = torch.cat([c2ws_4x4, c2ws_4x4.flip(0)], dim=0)
+        return camera_pose_lerp(c2ws_4x4, round(self.video_length / trace_extract_ratio))[: self.video_length]  # [video_length, 4, 4]
+
+    @torch.no_grad
+    def get_videos(
+        self,
+        model_name: str,
+        ref_imgs: list[np.ndarray],
+        captions: list[str],
+        negative_prompt: str,
+        camera_paths: list[str],
+        frame_stride: int = 1,
+        steps: int = 25,
+        camera_cfg: float = 1.0,
+        cfg_scale: float = 7.5,
+        seed: int = 123,
+        eta: float = 1.0,
+    ) -> Tensor:
+        """
+        Sample a batch of videos in one call, same settings as get_image with the condition on the first frame.
+        :return: b, c, f, h, w in [-1, 1], on cpu
+        """
+        model, single_image_preprocessor = self.get_model(model_name)
+
+        inputs = []
+        for ref_img, caption, camera_path in zip(ref_imgs, captions, camera_paths):
+            w2cs_lerp_4x4 = self.get_camera_poses(camera_path).inverse()
+            inputs.append(single_image_preprocessor.get_batch_input(
+                ref_img,
+                PROMPT_PREFIX + caption,
+                w2cs_lerp_4x4[:, :3], frame_stride
+            ))
+        # tensors are concatenated along the batch dim, lists are joined
+        input = {k: torch.cat([x[k] for x in inputs]) if isinstance(inputs[0][k], Tensor) else sum([x[k] for x in inputs], []) for k in inputs[0]}
+        input["cond_frame_index"] = torch.zeros(len(inputs), device=input["video"].device, dtype=torch.long)
+
+        seed_everything(seed)
+        log_images_kwargs = {
+            "ddim_steps": steps,
+            "ddim_eta": eta,
+            "unconditional_guidance_scale": cfg_scale,
+            "timestep_spacing": "uniform_trailing",
+            "guidance_rescale": 0.7,
+            "camera_cfg": camera_cfg,
+            "camera_cfg_scheduler": "constant",
+            "enable_camera_condition": True,
+            "trace_scale_factor": 1.0,
+            "result_dir": self.result_dir,
+            "negative_prompt": negative_prompt,
+            "cond_frame_index": input["cond_frame_index"].clone(),
+            "sampled_img_num": len(inputs),
+        }
+
+        with torch.autocast(self.device.type):
+            output = model.log_images(input, **log_images_kwargs)
+        return output["samples"].clamp(-1.0, 1.0).cpu()  # b, c, f, h, w
+
     @torch.no_grad
     def get_image(
         self,
@@ -149,41 +251,12 @@ class Image2Video:
         eta: float = 1.0,
         ref_img2: Image.Image = None,
     ):
-        camera_pose_file_path=camera_path
-        camera_data = torch.from_numpy(np.loadtxt(camera_pose_file_path, comments="https"))  # t, -1
-        w2cs_3x4 = camera_data[:, 7:].reshape(-1, 3, 4)  # [t, 3, 4]
-        w2cs_4x4 = torch.cat(
-            [w2cs_3x4, torch.tensor([[[0, 0, 0, 1]]] * w2cs_3x4.shape[0], device=w2cs_3x4.device)], dim=1
-        )  # [t, 4, 4]
-        c2ws_4x4 = w2cs_4x4.inverse()  # [t, 4, 4]
-        if use_bezier_curve:
-            c2ws_4x4 = camera_pose_lerp_bezier(c2ws_4x4, c2ws_4x4.shape[0], bezier_coef_a, bezier_coef_b)
-        if loop:
-            c2ws_4x4 = torch.cat([c2ws_4x4, c2ws_4x4.flip(0)], dim=0)
-        c2ws_lerp_4x4 = camera_pose_lerp(c2ws_4x4, round(self.video_length / trace_extract_ratio))[: self.video_length]
+        c2ws_lerp_4x4 = self.get_camera_poses(camera_path, trace_extract_ratio, use_bezier_curve, bezier_coef_a, bezier_coef_b, loop)
         w2cs_lerp_4x4 = c2ws_lerp_4x4.inverse()  # [video_length, 4, 4]
         rel_c2ws_lerp_4x4 = relative_pose(c2ws_lerp_4x4, mode="left", ref_index=cond_frame_index).clone()
         rel_c2ws_lerp_4x4[:, :3, 3] = rel_c2ws_lerp_4x4[:, :3, 3] * trace_scale_factor
 
-        for k, v in self.models.items():
-            if k != model_name:
-                v.cpu()
-        torch.cuda.empty_cache()
-
-        if model_name not in self.models:
-            with open(self.model_meta_file, "r", encoding="utf-8") as f:
-                model_metadata = json.load(f)[model_name]
-            print(f"loading model {model_name}, metadata:", model_metadata)
-            model, single_image_preprocessor = self.load_model(**model_metadata)
-
-            self.models[model_name] = model
-            self.single_image_processors[model_name] = single_image_preprocessor
-            print("models loaded:", list(self.models.keys()))
-
-        print("using", model_name)
-        model = self.models[model_name].to(self.device)
-        single_image_preprocessor = self.single_image_processors[model_name]
-        torch.cuda.empty_cache()
+        model, single_image_preprocessor = self.get_model(model_name)
 
         seed_everything(seed)
         log_images_kwargs = {
@@ -204,7 +277,7 @@ class Image2Video:
 
         input = single_image_preprocessor.get_batch_input(
             ref_img,
-            "4K resolution, cinematic shot, photorealistic, detailed fur, smooth motion; " + caption,
+            PROMPT_PREFIX + caption,
             w2cs_lerp_4x4[frame_indices, :3], frame_stride, ref_img2=ref_img2
         )
         input["cond_frame_index"] = torch.tensor(
@@ -277,25 +350,106 @@ class Image2Video:
     
 from demo.qwen2vl import Qwen2VL_Captioner
 from PIL import Image
+
+CAPTIONER_PATH = "/inspire/hdd/ws-f4d69b29-e0a5-44e6-bd92-acf4de9990f0/public-project/pengzimian-241108540199/model/Qwen2-VL-7B-Instruct-AWQ"
+NEGATIVE_PROMPT = "Fast movement, jittery motion, abrupt transitions, distorted body, missing limbs, unnatural posture, blurry, cropped, extra limbs, bad anatomy, deformed, glitchy motion, artifacts."
+
+
+class EvaluationRunner:
+    """
+    Keeps the diffusion model and the captioner resident across test items, and samples them in batches.
+    Images of the next batch are loaded while the current batch is sampled, and videos of the previous batch are
+    encoded and passed to on_result (e.g. metric updates) in the background. Captioning runs on the same GPU and
+    may draw random numbers, so it runs right before sampling, never concurrently with it, to keep runs reproducible.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "512_CamI2V",
+        captioner_path: str = CAPTIONER_PATH,
+        negative_prompt: str = NEGATIVE_PROMPT,
+        batch_size: int = 4,
+        device: str = "cuda",
+        **sample_kwargs,
+    ):
+        self.model_name = model_name
+        self.negative_prompt = negative_prompt
+        self.batch_size = batch_size
+        self.sample_kwargs = sample_kwargs
+
+        self.i2v = Image2Video(return_camera_trace=False, device=device)
+        self.captioner = Qwen2VL_Captioner(model_path=captioner_path, device=torch.device(device))
+        self.i2v.get_model(model_name)
+
+    def prepare(self, batch: list[dict]) -> list[dict]:
+        for item in batch:
+            item["ref_img"] = np.array(Image.open(item["image_path"]))
+        return batch
+
+    def finish(self, batch: list[dict], videos: Tensor, on_result):
+        for item, video in zip(batch, videos):
+            video_path = f"{self.i2v.result_dir}/{self.model_name}_{uuid4().fields[0]:x}.mp4"
+            _, grid = self.i2v.save_video(video[None], video_path)
+            if on_result is not None:
+                on_result(item, video_path, grid)
+
+    def run(self, items: list[dict], on_result=None):
+        """
+        items: dicts with image_path (condition image) and camera_path (pose file), passed back to on_result
+        on_result: called as on_result(item, video_path, frames) with frames uint8 [t, h, w, c], in the order of items
+        """
+        batches = [items[i : i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+        if len(batches) == 0:
+            return
+
+        with ThreadPoolExecutor(1) as prepare_pool, ThreadPoolExecutor(1) as finish_pool:
+            prepared = prepare_pool.submit(self.prepare, batches[0])
+            finished = None
+            for i in range(len(batches)):
+                batch = prepared.result()
+                if i + 1 < len(batches):
+                    prepared = prepare_pool.submit(self.prepare, batches[i + 1])
+
+                for item in batch:
+                    item["caption"] = self.captioner.caption(item["ref_img"])
+                    print(f"{item['image_path']}: {item['caption']}")
+                videos = self.i2v.get_videos(
+                    self.model_name,
+                    [item["ref_img"] for item in batch],
+                    [item["caption"] for item in batch],
+                    self.negative_prompt,
+                    [item["camera_path"] for item in batch],
+                    **self.sample_kwargs,
+                )
+
+                if finished is not None:
+                    finished.result()
+                finished = finish_pool.submit(self.finish, batch, videos, on_result)
+            finished.result()
+
+
+_runner = None
+
+
 def run_cami2v_inference(image_path, camera_path="/inspire/hdd/ws-f4d69b29-e0a5-44e6-bd92-acf4de9990f0/public-project/pengzimian-241108540199/project/CamI2V/demo/camera_pose_files/zoom in.txt"):
-    input_image = Image.open(image_path)
-    input_image = np.array(input_image)
-    i2v = Image2Video()
-    
-    model_path="/inspire/hdd/ws-f4d69b29-e0a5-44e6-bd92-acf4de9990f0/public-project/pengzimian-241108540199/model/Qwen2-VL-7B-Instruct-AWQ"
-    captioner = Qwen2VL_Captioner(model_path=model_path, device=torch.device('cuda'))
-    prompt = captioner.caption(input_image)    
-    # prompt="man fishing in a boat at sunset"
-
-    print(prompt)
-    model_name="512_CamI2V"
-    negative_prompt="Fast movement, jittery motion, abrupt transitions, distorted body, missing limbs, unnatural posture, blurry, cropped, extra limbs, bad anatomy, deformed, glitchy motion, artifacts."
-    video_path,grid,scene_with_camera_path = i2v.get_image(model_name, input_image, prompt, negative_prompt, camera_path)
-    
-    print("done", video_path,scene_with_camera_path)
+    # models are loaded by the first call and reused by the following ones
+    global _runner
+    if _runner is None:
+        _runner = EvaluationRunner(batch_size=1)
+
+    results = []
+    _runner.run([{"image_path": image_path, "camera_path": camera_path}], on_result=lambda item, video_path, grid: results.append((video_path, grid)))
+    video_path, grid = results[0]
+
+    # camera trace of the condition frame, as Image2Video.get_image returns it
+    i2v = _runner.i2v
+    rel_c2ws = relative_pose(i2v.get_camera_poses(camera_path), mode="left", ref_index=0)
+    points, colors = i2v.get_camera_trace(rel_c2ws[:, :3])
+    scene_with_camera_path = i2v.save_pcd("output_with_cam", points, colors)
 
-    return video_path,grid,scene_with_camera_path
+    print("done", video_path, scene_with_camera_path)
 
+    return video_path, grid, scene_with_camera_path
 
 if __name__ == "__main__":
     run_cami2v_inference("/inspire/hdd/ws-f4d69b29-e0a5-44e6-bd92-acf4de9990f0/public-project/pengzimian-241108540199/project/CamI2V/demo/pexels/pexels-digitech-1438761.jpg")
\ No newline at end of file
@@ -6,15 +6,18 @@
 """
 import os
 import glob
+import hashlib
 import numpy as np
 import random
 import torch
 import torchvision
 from torchvision.io import read_video
 import json
-from demo.cami2v_test_evaluate import run_cami2v_inference
+import time
+from concurrent.futures import ThreadPoolExecutor
+from demo.cami2v_test_evaluate import EvaluationRunner
+from utils.lru_cache import ByteLRUCache
 from torchmetrics.image.fid import FrechetInceptionDistance
-from torchvision import transforms
 # 添加TensorBoard的SummaryWriter
 from torch.utils.tensorboard import SummaryWriter
 
@@ -47,32 +50,27 @@ def parse_trajectory_file(txt_path, device=torch.device('cuda'),num_frames=25):
     # 第1行是视频URL
     video_url = lines[0]
 
-    # 解析相机外参
-    w2cs = []
-    for frame_line in lines[1:]:
-        cols = frame_line.split()
-        if len(cols) >= 19:  # 基础检查：确保至少有19列
-            ext_cols = list(map(float, cols[7:19]))  # 提取外参（7-19列）
-            ext_matrix = np.array(ext_cols).reshape(3, 4)
-            w2cs.append(torch.tensor(ext_matrix, dtype=torch.float).to(device))
-
-    # 转换为Tensor并计算c2w
-    w2cs = torch.stack(w2cs, dim=0)  # [N, 3, 4]
-    bottom = torch.tensor([[[0.0, 0.0, 0.0, 1.0]]], dtype=torch.float).to(device)
-    bottom = bottom.repeat(w2cs.shape[0], 1, 1)  # [N, 1, 4]
-    w2cs_4x4 = torch.cat((w2cs, bottom), dim=1)  # [N, 4, 4]
-    c2ws_4x4 = torch.linalg.inv(w2cs_4x4)        # [N, 4, 4]
-    c2ws = c2ws_4x4[:, :3, :]                   # [N, 3, 4]
-    
+    # 解析相机外参（7-19列），基础检查：确保至少有19列
+    w2cs = np.array([list(map(float, cols[7:19])) for cols in map(str.split, lines[1:]) if len(cols) >= 19])  # [N, 12]
+
     # 均匀采样num_frames帧
-    if len(c2ws) < num_frames:
+    if len(w2cs) < num_frames:
         return video_url, 'NOT_ENOUGH_FRAMES'
     
-    indices = np.linspace(0, len(c2ws) - 1, num_frames, dtype=int)
-    c2ws = c2ws[indices]
-    print(f"c2ws shape: {c2ws.shape}")
-    
-    return video_url, c2ws
+    indices = np.linspace(0, len(w2cs) - 1, num_frames, dtype=int)
+    c2ws = w2c_to_c2w(w2cs[indices])  # 在CPU上批量求逆，最后一次性移到device
+
+    return video_url, c2ws.to(device)
+
+
+def w2c_to_c2w(w2cs):
+    """
+    把 [..., 12] 的w2c外参批量转换成 [..., 3, 4] 的c2w外参（float32 CPU张量）。
+    """
+    w2cs_4x4 = np.zeros((*w2cs.shape[:-1], 4, 4), dtype=np.float32)
+    w2cs_4x4[..., :3, :] = w2cs.reshape(*w2cs.shape[:-1], 3, 4)
+    w2cs_4x4[..., 3, 3] = 1.0
+    return torch.from_numpy(np.linalg.inv(w2cs_4x4)[..., :3, :])  # [..., 3, 4]
 
 """
 1. 加载RealEstate10K数据集
@@ -109,75 +107,142 @@ def sample_frames(frame_folder, num_frames=25):
 """
 1. 加载RealEstate10K数据集
 """
+def index_trajectory(txt_path, dataset_root, video_root):
+    """
+    建立单个轨迹的索引项，供 build_RealEstate10K_index 在进程池中调用。
+    
+    返回:
+        (video_id, video_url, w2cs [N, 12], 帧文件名列表, 原始视频路径或""), 帧文件夹不存在或没有图片时返回None。
+    """
+    basename = os.path.splitext(os.path.basename(txt_path))[0]
+    frame_folder = os.path.join(dataset_root, basename)
+    if not os.path.isdir(frame_folder):
+        return None
+    frame_names = sorted(x for x in os.listdir(frame_folder) if x.endswith(".png"))
+    if len(frame_names) == 0:
+        return None
+
+    with open(txt_path, 'r') as f:
+        lines = [line.strip() for line in f.readlines() if line.strip()]
+    w2cs = np.array([list(map(float, cols[7:19])) for cols in map(str.split, lines[1:]) if len(cols) >= 19], dtype=np.float32).reshape(-1, 12)
+
+    video_file = os.path.join(video_root, f"{basename}.mp4")
+    return basename, lines[0], w2cs, frame_names, video_file if os.path.exists(video_file) else ""
+
+
+def RealEstate10K_signature(camera_root, dataset_root, video_root):
+    """
+    测试集文件的签名：轨迹文件的名字、大小和修改时间，帧文件夹的名字和修改时间，原始视频的文件名。
+    同一路径下重新提取帧或轨迹后签名会改变，索引随之重建。
+    """
+    def listing(root, suffix=None, stat=True):
+        if not os.path.isdir(root):
+            return []
+        with os.scandir(root) as entries:
+            entries = [x for x in entries if suffix is None or x.name.endswith(suffix)]
+            return sorted([x.name, x.stat().st_mtime_ns, x.stat().st_size] if stat else x.name for x in entries)
+
+    items = [listing(camera_root, ".txt"), listing(dataset_root), listing(video_root, ".mp4", stat=False)]
+    return hashlib.sha1(json.dumps(items).encode("utf-8")).hexdigest()
+
+
+def build_RealEstate10K_index(camera_root, dataset_root, video_root, index_path, num_workers=16):
+    """
+    并行解析所有轨迹文件、列出帧文件夹，把测试集索引保存为一个紧凑的 .npz 文件，只需建立一次。
+    变长的轨迹和帧列表拼接成一维数组，用 offsets 切分。
+    """
+    from functools import partial
+    from multiprocessing import Pool
+
+    txt_files = sorted(glob.glob(os.path.join(camera_root, "*.txt")))
+    with Pool(num_workers) as pool:
+        entries = pool.map(partial(index_trajectory, dataset_root=dataset_root, video_root=video_root), txt_files, chunksize=64)
+    entries = [x for x in entries if x is not None]
+    print(f"indexed {len(entries)} of {len(txt_files)} trajectories")
+
+    video_ids, video_urls, w2cs, frame_names, video_files = zip(*entries) if entries else ([], [], [], [], [])
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    np.savez(
+        f"{index_path}.tmp.npz",
+        roots=np.array([camera_root, dataset_root, video_root]),
+        signature=np.array(RealEstate10K_signature(camera_root, dataset_root, video_root)),
+        video_ids=np.array(video_ids, dtype=str),
+        video_urls=np.array(video_urls, dtype=str),
+        video_files=np.array(video_files, dtype=str),
+        w2cs=np.concatenate(w2cs) if entries else np.zeros((0, 12), dtype=np.float32),
+        w2c_offsets=np.cumsum([0] + [len(x) for x in w2cs]),
+        frame_names=np.array(sum(frame_names, []), dtype=str),
+        frame_offsets=np.cumsum([0] + [len(x) for x in frame_names]),
+    )
+    os.replace(f"{index_path}.tmp.npz", index_path)
+
+
+def linspace_indices(lengths, num):
+    """
+    等价于对每个长度L分别做 np.linspace(0, L - 1, num, dtype=int)，返回 [len(lengths), num]。
+    """
+    step = (lengths - 1) / max(num - 1, 1)
+    indices = (np.arange(num)[None] * step[:, None]).astype(int)
+    indices[:, -1] = lengths - 1  # 与 np.linspace 一样，最后一个点精确取到终点
+    return indices
+
+
 def load_RealEstate10K(
     camera_root="/inspire/hdd/ws-f4d69b29-e0a5-44e6-bd92-acf4de9990f0/public-project/public/zhengsixiao/RealEstate10K_camera/test",
     dataset_root="/inspire/hdd/ws-f4d69b29-e0a5-44e6-bd92-acf4de9990f0/public-project/public/zhengsixiao/RealEstate10K/dataset/test",
     video_root="/inspire/hdd/ws-f4d69b29-e0a5-44e6-bd92-acf4de9990f0/public-project/public/zhengsixiao/RealEstate10K/videos/",
     num_frames=25, # 采样的帧数，固定25帧吧
-    sample_num=1000
+    sample_num=1000,
+    index_path="./cache/RealEstate10K_test_index.npz",
+    num_workers=16,
+    rebuild_index=False,
 ):
     """
-    1. 遍历 RealEstate10K_camera/test 下所有 .txt 文件，采样sample_num个视频
-    2. 解析相机轨迹，获取 extrinsics
-    3. 从 dataset/test 下对应帧文件夹采样 num_frames 帧
-    4. 定位到视频文件
+    1. 读取测试集索引（不存在、路径不一致、测试集文件有改动或 rebuild_index 时用 build_RealEstate10K_index 并行建立）
+    2. 按轨迹文件名顺序选出前 sample_num 个帧文件夹非空、外参不少于 num_frames 个的视频
+    3. 均匀采样 num_frames 个外参并在CPU上批量转换成c2w，均匀采样 num_frames 帧
     """
-    # 获取所有轨迹文件
-    txt_files = glob.glob(os.path.join(camera_root, "*.txt"))
-    
-    results = []  # 存放解析结果
-    
-    cnt=0
-    while len(results) < sample_num: # 循环sample_num个视频
-        print(f"cnt:{cnt}")
-        print(f"len(results):{len(results)}")
-        print(len(results))
-        print(f"{len(results)}/{sample_num}")
-        print(f"{cnt}/{len(txt_files)}")
-        
-        # 获取轨迹文件路径               
-        txt_path = txt_files[cnt]
-        cnt=cnt+1
+    index = np.load(index_path) if os.path.exists(index_path) else None
+    if (
+        rebuild_index
+        or index is None
+        or index["roots"].tolist() != [camera_root, dataset_root, video_root]
+        or "signature" not in index
+        or str(index["signature"]) != RealEstate10K_signature(camera_root, dataset_root, video_root)
+    ):
+        build_RealEstate10K_index(camera_root, dataset_root, video_root, index_path, num_workers=num_workers)
+        index = np.load(index_path)
 
-        # 获取视频ID（基于 txt 文件名）
-        basename = os.path.splitext(os.path.basename(txt_path))[0]  # e.g., "2bec33eeeab0bb9d"
-        
-        # 如果所有文件都检查完了，退出循环
-        if cnt >= len(txt_files):
-            break  
-        
-        # 检查对应的帧文件夹是否存在
+    w2c_offsets, frame_offsets = index["w2c_offsets"], index["frame_offsets"]
+    num_w2cs = np.diff(w2c_offsets)
+    # 外参不足num_frames个的视频跳过
+    selected = np.flatnonzero(num_w2cs >= num_frames)[:sample_num]
+    print(f"{len(selected)}/{sample_num} videos selected from {len(num_w2cs)} indexed")
+
+    # 均匀采样num_frames个外参，一次批量求逆
+    w2c_indices = w2c_offsets[selected, None] + linspace_indices(num_w2cs[selected], num_frames)
+    c2ws = w2c_to_c2w(index["w2cs"][w2c_indices])  # [sample_num, num_frames, 3, 4]
+
+    video_ids, video_urls, video_files = index["video_ids"], index["video_urls"], index["video_files"]
+    frame_names = index["frame_names"]
+
+    results = []  # 存放解析结果
+    for i, video_index in enumerate(selected):
+        basename = str(video_ids[video_index])
+        frames = frame_names[frame_offsets[video_index] : frame_offsets[video_index + 1]]
+        # 如果帧数不足num_frames，直接使用所有帧，否则均匀采样num_frames帧
+        if len(frames) > num_frames:
+            frames = frames[np.linspace(0, len(frames) - 1, num_frames, dtype=int)]
         frame_folder = os.path.join(dataset_root, basename)
-        if not os.path.exists(frame_folder):
-            print(f"No frame folder found for {txt_path}")
-            continue  # 如果帧文件夹不存在，跳过该轨迹文件
-        
-        # 检查帧文件夹中是否有图片
-        frame_paths = sample_frames(frame_folder, num_frames=num_frames)
-        if not frame_paths:
-            print(f"No frames found for {txt_path}")
-            continue  # 如果帧文件夹中没有图片，跳过该轨迹文件
-
-        # 解析轨迹
-        video_url, extrinsics = parse_trajectory_file(txt_path,device=torch.device('cuda'), num_frames=num_frames)
-        # 如果外参矩阵不足sample_num个，跳过该视频
-        if extrinsics == 'NOT_ENOUGH_FRAMES':
-            print(f"Not enough extrinsics for {txt_path}")
-            continue
-
-        # 原始视频路径
-        video_file = os.path.join(video_root, f"{basename}.mp4")
-        if not os.path.exists(video_file):
-            video_file = None
 
         # 组装结果
         info_dict = {
-            "txt_file": txt_path,
+            "txt_file": os.path.join(camera_root, f"{basename}.txt"),
             "video_id": basename,
-            "video_url": video_url,
-            "video_file": video_file,
-            "extrinsics": extrinsics,  # [N, 3, 4]
-            "frame_paths": frame_paths  # 采样的num_frames帧图像路径
+            "video_url": str(video_urls[video_index]),
+            "video_file": str(video_files[video_index]) or None,
+            "extrinsics": c2ws[i],  # [N, 3, 4]
+            "frame_paths": [os.path.join(frame_folder, x) for x in frames]  # 采样的num_frames帧图像路径
         }
 
         results.append(info_dict)
@@ -187,27 +252,108 @@ def load_RealEstate10K(
 """
 1. 加载RealEstate10K数据集
 """
-def load_real_frames(frame_paths, height=360, width=640):
+# 缩放后的真实帧（uint8），按 (路径, 高, 宽) 做LRU缓存，上限按字节计，默认4GB，可用 --real_frame_cache_gb 调整，0 为关闭。
+# 360x640 的一帧约 0.7MB，4GB 约可缓存 6000 帧，重复评估或真实帧统计量缓存失效时免去重复解码和缩放。
+REAL_FRAME_CACHE_BYTES = 4 << 30
+_real_frame_cache = ByteLRUCache(REAL_FRAME_CACHE_BYTES)
+_frame_decode_pool = None
+
+
+def get_frame_decode_pool(num_threads=8):
+    """ 解码线程池在第一次使用时才创建，import 本模块不会启动线程 """
+    global _frame_decode_pool
+    if _frame_decode_pool is None:
+        _frame_decode_pool = ThreadPoolExecutor(num_threads)
+    return _frame_decode_pool
+
+
+def load_real_frames(frame_paths, height=360, width=640, pool=None):
     """
     从帧路径列表中加载帧图像，并调整大小。
+    未缓存的帧在线程池中并行解码，相同尺寸的帧拼成一个张量一次完成缩放，再四舍五入成 uint8。
     
     参数:
         frame_paths (list[str]): 帧路径列表。
         height (int): 目标高度。
         width (int): 目标宽度。
+        pool (ThreadPoolExecutor): 解码线程池，默认使用 get_frame_decode_pool()。
         
     返回:
-        real_frames (torch.Tensor): 调整大小后的帧图像张量 [N, C, H, W]。
+        real_frames (torch.Tensor): 调整大小后的帧图像张量 [N, C, H, W]，uint8。
     """
-    real_frames = []
-    for frame_path in frame_paths:
-        frame = torchvision.io.read_image(frame_path).float() # / 255.0 # 归一化
-        frame = torchvision.transforms.Resize((height, width))(frame)
-        real_frames.append(frame)
-    real_frames = torch.stack(real_frames, dim=0)
+    keys = [(frame_path, height, width) for frame_path in frame_paths]
+    missing = list(dict.fromkeys(key for key in keys if key not in _real_frame_cache))
+    loaded = {}
+    if missing:
+        pool = pool or get_frame_decode_pool()
+        decoded = list(pool.map(torchvision.io.read_image, [key[0] for key in missing]))
+        resize = torchvision.transforms.Resize((height, width))
+        by_shape = {}
+        for key, frame in zip(missing, decoded):
+            by_shape.setdefault(tuple(frame.shape), []).append((key, frame))
+        for group in by_shape.values():
+            resized = resize(torch.stack([frame for _, frame in group]).float())
+            resized = resized.round().clamp(0, 255).to(torch.uint8)
+            for (key, _), frame in zip(group, resized):
+                # clone，否则缓存中的一帧会让整个batch留在内存里
+                loaded[key] = frame.clone()
+
+    real_frames = torch.stack([loaded[key] if key in loaded else _real_frame_cache.get(key) for key in keys], dim=0)
+
+    for key, frame in loaded.items():
+        _real_frame_cache.put(key, frame, frame.numel())  # uint8，一个元素一个字节
     return real_frames
 
 
+"""
+3. 根据推理测试结果，计算评估指标
+"""
+def real_fid_stats_path(parsed_results, cache_dir, height=360, width=640, feature=2048):
+    """
+    真实帧Inception统计量的缓存路径，由所有真实帧路径、缩放尺寸和特征维度决定，帧列表不变时可以直接复用。
+    """
+    frame_paths = [frame_path for item in parsed_results for frame_path in item["frame_paths"]]
+    # "round": 真实帧缩放后四舍五入成 uint8，与早先截断得到的统计量区分
+    key = hashlib.sha1(json.dumps([frame_paths, height, width, feature, "round"]).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"fid_real_{key}.npz")
+
+
+def prepare_real_fid_stats(fid, parsed_results, cache_dir="./cache/fid", height=360, width=640, batch_videos=8):
+    """
+    计算（或从缓存读取）整个测试集真实帧的Inception统计量，写入fid的real状态。
+    fid需以reset_real_features=False初始化，这样fid.reset()只清空生成帧的统计量。
+
+    参数:
+        fid (FrechetInceptionDistance): FID 计算器。
+        parsed_results (list[dict]): load_RealEstate10K 的结果。
+        cache_dir (str): 缓存目录。
+    """
+    cache_path = real_fid_stats_path(parsed_results, cache_dir, height, width, fid.real_features_sum.shape[0])
+    if os.path.exists(cache_path):
+        stats = np.load(cache_path)
+        fid.real_features_sum.copy_(torch.from_numpy(stats["features_sum"]))
+        fid.real_features_cov_sum.copy_(torch.from_numpy(stats["features_cov_sum"]))
+        fid.real_features_num_samples.fill_(int(stats["num_samples"]))
+        print(f"Real FID stats loaded from {cache_path}")
+        return
+
+    # 多个视频的帧合并成一批加载
+    for i in range(0, len(parsed_results), batch_videos):
+        frame_paths = [frame_path for item in parsed_results[i : i + batch_videos] for frame_path in item["frame_paths"]]
+        real_frames = load_real_frames(frame_paths, height=height, width=width)
+        fid.update(real_frames.to(fid.device), real=True)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    np.savez(
+        f"{cache_path}.tmp.npz",
+        features_sum=fid.real_features_sum.cpu().numpy(),
+        features_cov_sum=fid.real_features_cov_sum.cpu().numpy(),
+        num_samples=fid.real_features_num_samples.item(),
+    )
+    os.replace(f"{cache_path}.tmp.npz", cache_path)
+    print(f"Real FID stats of {fid.real_features_num_samples.item()} frames saved to {cache_path}")
+
+
 """
 2. 把数据集转成对应测试模型(如cami2v)的输入格式，并完成推理测试
 """
@@ -219,7 +365,7 @@ def RealEstate2Cami2v(parsed_results):
 """
 2. 把数据集转成对应测试模型(如cami2v)的输入格式，并完成推理测试
 """
-def run_cami2v(RealEstate10K_parsed_results):
+def run_cami2v(RealEstate10K_parsed_results, fid_cache_dir="./cache/fid", fid_log_every=50, batch_size=4):
     
     # 转成cami2v的轨迹格式
     RealEstate2Cami2v(RealEstate10K_parsed_results)
@@ -235,61 +381,49 @@ def run_cami2v(RealEstate10K_parsed_results):
         # print(len(item["frame_paths"]))
         print("-------------------------------------------------\n")
 
-    # 初始化 FID 计算器
-    fid = FrechetInceptionDistance(feature=2048, reset_real_features=True, normalize=False, input_img_size=(3, 299, 299), feature_extractor_weights_path="/inspire/hdd/ws-f4d69b29-e0a5-44e6-bd92-acf4de9990f0/public-project/pengzimian-241108540199/model/FID/weights-inception-2015-12-05-6726825d.pth")
-    fid_values = [ ]
+    # 初始化 FID 计算器，整个测试集共用一份真实帧统计量，生成帧逐视频累积到同一份统计量中
+    fid = FrechetInceptionDistance(feature=2048, reset_real_features=False, normalize=False, input_img_size=(3, 299, 299), feature_extractor_weights_path="/inspire/hdd/ws-f4d69b29-e0a5-44e6-bd92-acf4de9990f0/public-project/pengzimian-241108540199/model/FID/weights-inception-2015-12-05-6726825d.pth")
+    prepare_real_fid_stats(fid, RealEstate10K_parsed_results, cache_dir=fid_cache_dir)
     
     # 初始化SummaryWriter
     writer = SummaryWriter(log_dir='./runs/cami2v')
     
-    # 遍历 parsed_results，调用 run_cami2v_inference（运行cami2v测试）
-    for idx, item in enumerate(RealEstate10K_parsed_results):
-        video_id = item["video_id"]
-        frame_paths = item["frame_paths"]
-        
-        # 取出用于inference的轨迹txt文件
-        pose_path=item["txt_file"]
-        
-        # 取第 1 帧作为 input
-        image_input = frame_paths[0]
-        
-        # 读取，查看shape
-        import cv2
-        image = cv2.imread(image_input)
-        print(f"Image shape: {image.shape}")
-
-        print(f"\n=== [{idx}] Start inference for video_id={video_id} ===")
-        print(f"Use first frame: {image_input}")
-
-        # 调用推理函数
-        
-        generated_videos, generated_frames,scene_with_camera_path=run_cami2v_inference(image_path=image_input, camera_path=pose_path)
-        print(generated_videos)
-        
+    # 常驻的推理runner：模型和captioner只加载一次，按batch_size批量采样，图片加载、视频编码和FID更新与采样流水线执行，captioning在采样前串行执行
+    runner = EvaluationRunner(batch_size=batch_size)
+    start_time = time.perf_counter()
+    
+    def on_result(item, video_path, generated_frames):
         """
         3. 根据推理测试结果，计算评估指标
         在线计算的指标可以在这里算，如torchmetric的FID
         """
+        idx = item["index"]
+        print(f"=== [{idx}] video_id={item['video_id']} done: {video_path}, {time.perf_counter() - start_time:.1f}s elapsed ===")
         
         # 加载生成帧
-        generated_frames=generated_frames.permute(0, 3, 1, 2)  # [N, H, W, C] -> [N, C, H, W]
-        print(generated_frames.shape)
+        generated_frames = generated_frames.permute(0, 3, 1, 2)  # [N, H, W, C] -> [N, C, H, W]
         
-        # 加载真实帧
-        real_frames = load_real_frames(frame_paths)
-        
-        print(f"generated_frames: {check_tensor_range(generated_frames)}")
-        print(f"real_frames:{check_tensor_range(real_frames)}")
-
-        # 计算FID
-        fid_value = calculate_fid(generated_frames, real_frames,fid)
-        fid_values.append(fid_value)
+        # 生成帧累积到整个测试集的统计量，真实帧统计量已在 prepare_real_fid_stats 中算好
+        fid.update(generated_frames.to(torch.uint8).to(fid.device), real=False)
         
-        # 使用SummaryWriter记录FID值
-        writer.add_scalar('FID', fid_value, global_step=idx)
+        # 每 fid_log_every 个视频用SummaryWriter记录一次当前的FID值
+        if (idx + 1) % fid_log_every == 0:
+            writer.add_scalar('FID', fid.compute().item(), global_step=idx)
     
-    print(f"FID value: {fid_values}")
-    print(f"Mean FID: {np.mean(fid_values)}")
+    # 取第 1 帧作为 input，轨迹txt文件用于inference
+    items = [
+        {"index": idx, "video_id": item["video_id"], "image_path": item["frame_paths"][0], "camera_path": item["txt_file"]}
+        for idx, item in enumerate(RealEstate10K_parsed_results)
+    ]
+    runner.run(items, on_result=on_result)
+    
+    elapsed = time.perf_counter() - start_time
+    print(f"{len(items)} videos in {elapsed:.1f}s, {elapsed / max(len(items), 1):.2f}s per video")
+    writer.add_scalar('time_per_video', elapsed / max(len(items), 1), global_step=0)
+    
+    fid_value = fid.compute().item()
+    writer.add_scalar('FID', fid_value, global_step=len(RealEstate10K_parsed_results) - 1)
+    print(f"FID over {fid.fake_features_num_samples.item()} generated frames: {fid_value}")
     
     # 关闭SummaryWriter
     writer.close()
@@ -311,27 +445,16 @@ def calculate_fid(generated_frames, real_frames, fid):
     print("-------------calculate_fid--------------")
     print(generated_frames.shape)
     print(real_frames.shape)
-    # 定义调整图像尺寸的 transform
-    resize_transform = transforms.Compose([
-        # transforms.Resize((299, 299)),  # 调整图像尺寸为 299x299
-        # transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])  # 归一化
-    ])
     
-    # 确保输入数据为 uint8 类型
+    # 确保输入数据为 uint8 类型，FID 计算器内部会缩放到 299x299
     if generated_frames.dtype != torch.uint8:
         generated_frames = generated_frames.to(torch.uint8)
     if real_frames.dtype != torch.uint8:
         real_frames = real_frames.to(torch.uint8)
 
-    # 调整生成图像的尺寸
-    generated_frames_resized = torch.stack([resize_transform(frame) for frame in generated_frames])
-
-    # 调整真实图像的尺寸
-    real_frames_resized = torch.stack([resize_transform(frame) for frame in real_frames])
-
     # 更新 FID 计算器
-    fid.update(real_frames_resized, real=True)
-    fid.update(generated_frames_resized, real=False)
+    fid.update(real_frames, real=True)
+    fid.update(generated_frames, real=False)
 
     # 计算 FID
     fid_value = fid.compute()
@@ -349,8 +472,15 @@ def calculate_fid(generated_frames, real_frames, fid):
 if __name__ == "__main__":
     
     
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rebuild_index", action="store_true", help="重建测试集索引")
+    parser.add_argument("--real_frame_cache_gb", type=float, default=REAL_FRAME_CACHE_BYTES / (1 << 30), help="真实帧LRU缓存上限(GB)，0为关闭")
+    args = parser.parse_args()
+    _real_frame_cache.max_bytes = int(args.real_frame_cache_gb * (1 << 30))
+    
     # 获取测试数据集信息
-    parsed_results = load_RealEstate10K(num_frames=25)
+    parsed_results = load_RealEstate10K(num_frames=25, rebuild_index=args.rebuild_index)
     print("RealEstate10K loaded")
     
     # 在对比模型上跑测试数据集，保存推理结果
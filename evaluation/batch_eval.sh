@@ -1,15 +1,9 @@
 # example
 EXP_DIR="/mnt/nfs/data/guangcong/DynamiCrafter/test_results/test_256_cami2v_pluckerEmbedding+EpipolarAttn_randCondFrame/images/test/ImageTextcfg7.5_CameraConditionTrue_CameraCfg1.0_eta1.0_guidanceRescale0.7_cfgScheduler=constant_steps25"
 
-for trial_id in 0 1 2 3 4; do
-    echo $trial_id
+# 5 trials of every video, spread over one worker per gpu
+python glomap_evaluation.py --exp_dir $EXP_DIR --trial_ids 0 1 2 3 4 --devices 0 1 2 3 4
 
-    CUDA_VISIBLE_DEVICES=$trial_id python glomap_evaluation.py --exp_dir $EXP_DIR --trial_id $trial_id &
-done
-
-wait
-
-python utils/merge.py
-python utils/summary.py
+python utils/results.py
 
 python fvd_test.py --gt_folder $EXP_DIR/gt_video --sample_folder $EXP_DIR/samples
\ No newline at end of file
@@ -1,10 +1,15 @@
 import glob
+import hashlib
+import json
+import os
 from argparse import ArgumentParser
 
+import numpy as np
 import torch
 from fvdcal import FVDCalculation
 from fvdcal.video_preprocess import load_video
 from torch import Tensor
+from torch.utils.data import DataLoader, Dataset
 from tqdm import tqdm
 
 
@@ -17,22 +22,94 @@ class MyFVDCalculation(FVDCalculation):
 
         return fvd.detach().cpu().numpy()
 
+    def extract_features(self, model, videos: Tensor, device) -> Tensor:  # B, D
+        # same features as _compute_fvd_between_video, for one batch of videos
+        return torch.as_tensor(self.get_fvd_feats(videos, model, device))
 
-def load_videos(paths, desc):
-    return torch.stack([load_video(path, num_frames=None) for path in tqdm(paths, desc=desc)])
 
+class RunningStats:
+    """ running mean and covariance of features, in float64 """
 
-def metric(gt_folder, sample_folder):
+    def __init__(self, num: int = 0, sum: np.ndarray = None, outer_sum: np.ndarray = None):
+        self.num, self.sum, self.outer_sum = num, sum, outer_sum
+
+    def update(self, feats: Tensor):  # B, D
+        feats = feats.detach().double().cpu().numpy()
+        if self.sum is None:
+            self.sum, self.outer_sum = np.zeros(feats.shape[1]), np.zeros((feats.shape[1], feats.shape[1]))
+        self.num += feats.shape[0]
+        self.sum += feats.sum(0)
+        self.outer_sum += feats.T @ feats
+
+    def mean_cov(self) -> tuple[np.ndarray, np.ndarray]:
+        mu = self.sum / self.num
+        return mu, (self.outer_sum - self.num * np.outer(mu, mu)) / (self.num - 1)
+
+
+def frechet_distance(mu_1: np.ndarray, sigma_1: np.ndarray, mu_2: np.ndarray, sigma_2: np.ndarray) -> float:
+    # tr(sqrt(sigma_1 @ sigma_2)) = sum of sqrt of eigenvalues of sqrt(sigma_1) @ sigma_2 @ sqrt(sigma_1), both symmetric
+    eigvals, eigvecs = np.linalg.eigh(sigma_1)
+    sqrt_sigma_1 = (eigvecs * np.sqrt(eigvals.clip(0))) @ eigvecs.T
+    tr_covmean = np.sqrt(np.linalg.eigvalsh(sqrt_sigma_1 @ sigma_2 @ sqrt_sigma_1).clip(0)).sum()
+    return float(((mu_1 - mu_2) ** 2).sum() + np.trace(sigma_1) + np.trace(sigma_2) - 2 * tr_covmean)
+
+
+class VideoDataset(Dataset):
+    def __init__(self, paths: list[str]):
+        self.paths = paths
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        return load_video(self.paths[index], num_frames=None)
+
+
+def extract_stats(paths, calculators, models, device, batch_size, num_workers, desc) -> dict[str, RunningStats]:
+    """
+    Videos are decoded by dataloader workers and every batch is fed to the models of all FVD variants,
+    so each video is decoded once and never more than a few batches are held in memory.
+    """
+    stats = {method: RunningStats() for method in calculators}
+    loader = DataLoader(VideoDataset(paths), batch_size=batch_size, num_workers=num_workers, pin_memory=device.type == "cuda")
+    for videos in tqdm(loader, desc=desc):
+        for method, calculator in calculators.items():
+            stats[method].update(calculator.extract_features(models[method], videos, device))
+    return stats
+
+
+def get_cache_path(cache_dir: str, paths: list[str], methods: list[str]) -> str:
+    """ real features are keyed by the video files, their sizes and modification times, and the FVD variants """
+    files = [(path, os.path.getsize(path), os.path.getmtime(path)) for path in sorted(paths)]
+    key = hashlib.sha1(json.dumps([files, sorted(methods)]).encode("utf-8")).hexdigest()
+    return f"{cache_dir}/fvd_real_{key}.npz"
+
+
+def metric(gt_folder, sample_folder, batch_size=16, num_workers=8, cache_dir="cache/fvd", model_path="FVD/model"):
     gt_video_paths = glob.glob(f"{gt_folder}/*.mp4")
     sample_video_paths = glob.glob(f"{sample_folder}/*.mp4")
 
-    gt_videos = load_videos(gt_video_paths, "loading real videos")
-    sample_videos = load_videos(sample_video_paths, "loading generated videos")
-
-    score_videogpt = fvd_videogpt.calculate_fvd_by_video_list(gt_videos, sample_videos)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    calculators = {"videogpt": fvd_videogpt, "stylegan": fvd_stylegan}
+    # each model is loaded once for both real and generated videos
+    models = {method: calculator._load_model(model_path, device) for method, calculator in calculators.items()}
+
+    cache_path = get_cache_path(cache_dir, gt_video_paths, list(calculators)) if cache_dir else None
+    if cache_path is not None and os.path.exists(cache_path):
+        cached = np.load(cache_path)
+        real_stats = {m: RunningStats(int(cached[f"{m}_num"]), cached[f"{m}_sum"], cached[f"{m}_outer_sum"]) for m in calculators}
+    else:
+        real_stats = extract_stats(gt_video_paths, calculators, models, device, batch_size, num_workers, "real videos")
+        if cache_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            arrays = {f"{m}_{k}": getattr(s, k) for m, s in real_stats.items() for k in ["num", "sum", "outer_sum"]}
+            np.savez(f"{cache_path}.tmp.npz", **arrays)
+            os.replace(f"{cache_path}.tmp.npz", cache_path)
+    sample_stats = extract_stats(sample_video_paths, calculators, models, device, batch_size, num_workers, "generated videos")
+
+    scores = {m: frechet_distance(*sample_stats[m].mean_cov(), *real_stats[m].mean_cov()) for m in calculators}
+    score_videogpt, score_stylegan = scores["videogpt"], scores["stylegan"]
     print(score_videogpt)
-
-    score_stylegan = fvd_stylegan.calculate_fvd_by_video_list(gt_videos, sample_videos)
     print(score_stylegan)
 
     return score_videogpt, score_stylegan
@@ -44,7 +121,10 @@ fvd_stylegan = MyFVDCalculation(method="stylegan")
 parser = ArgumentParser()
 parser.add_argument("--gt_folder", type=str)
 parser.add_argument("--sample_folder", type=str)
+parser.add_argument("--batch_size", type=int, default=16)
+parser.add_argument("--num_workers", type=int, default=8, help="dataloader workers decoding videos")
+parser.add_argument("--cache_dir", type=str, default="cache/fvd", help="cache of real video features, empty to disable")
 
 if __name__ == "__main__":
     args = parser.parse_args()
-    metric(args.gt_folder, args.sample_folder)
+    metric(args.gt_folder, args.sample_folder, args.batch_size, args.num_workers, args.cache_dir)
@@ -1,29 +1,29 @@
 import argparse
+import hashlib
+import json
 import os
 import shutil
 import time
 import uuid
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import Queue
 
-import pandas as pd
+import numpy as np
+import torch
 from torch import Tensor
+from tqdm import tqdm
 
-from utils.common import cli_wrapper, get_frames, get_rt, load_rt_from_txt, normalize_t, relative_pose, rt34_to_44
+from utils.common import cli_wrapper, extract_frames, get_frames, get_rt, load_rt_from_txt, relative_pose, rt34_to_44
 from utils.convert import write_depth_pose_from_colmap_format
+from utils.results import METRICS, append_results, camera_metrics, load_results
 
 
-def run_glomap(img_dir: str, pose_dir: str, f: float, cx: float, cy: float) -> tuple[Tensor, float]:
-    def convert(config: dict) -> list[str]:
-        return sum([[f"--{k}", f"{v}"] for k, v in config.items()], [])
-
-    def runner(exec: str, stage: str, redirect: bool = False):
-        cli_wrapper(exec, stage, *convert(config[stage]), redirect=redirect)
-
+def get_glomap_config(img_dir: str, pose_dir: str, f: float, cx: float, cy: float) -> dict:
     model_dir = f"{pose_dir}/model"
-    os.makedirs(model_dir, exist_ok=True)
-
     db_path = f"{pose_dir}/database.db"
 
-    config = {
+    return {
         "feature_extractor": {
             "database_path": db_path,
             "image_path": img_dir,
@@ -42,116 +42,224 @@ def run_glomap(img_dir: str, pose_dir: str, f: float, cx: float, cy: float) -> t
             "database_path": db_path,
             "image_path": img_dir,
             "output_path": model_dir,
-            "output_format": "txt",
+            "output_format": "bin",
             "RelPoseEstimation.max_epipolar_error": 4,
             "BundleAdjustment.optimize_intrinsics": 0,
         },
     }
 
-    runner("colmap", "feature_extractor", redirect=True)
-    runner("colmap", "sequential_matcher", redirect=True)
-    runner("glomap", "mapper", redirect=True)
 
-    write_depth_pose_from_colmap_format(f"{model_dir}/0", model_dir, ext=".txt")
-
-    w2c = rt34_to_44(get_rt(f"{model_dir}/poses"))
-    c2w = w2c.inverse()
-    rel_c2w = relative_pose(c2w, mode="left")
+def run_glomap(img_dir: str, pose_dir: str, f: float, cx: float, cy: float, colmap: str = "colmap", glomap: str = "glomap") -> tuple[Tensor, float]:
+    def convert(config: dict) -> list[str]:
+        return sum([[f"--{k}", f"{v}"] for k, v in config.items()], [])
 
-    return rel_c2w
+    def runner(exec: str, stage: str, redirect: bool = False):
+        cli_wrapper(exec, stage, *convert(config[stage]), redirect=redirect)
 
+    model_dir = f"{pose_dir}/model"
+    os.makedirs(model_dir, exist_ok=True)
 
-def calc_roterr(r1: Tensor, r2: Tensor) -> Tensor:  # N, 3, 3
-    return (((r1.transpose(-1, -2) @ r2).diagonal(dim1=-1, dim2=-2).sum(-1) - 1) / 2).clamp(-1, 1).acos()
+    config = get_glomap_config(img_dir, pose_dir, f, cx, cy)
 
+    runner(colmap, "feature_extractor", redirect=True)
+    runner(colmap, "sequential_matcher", redirect=True)
+    runner(glomap, "mapper", redirect=True)
 
-def calc_transerr(t1: Tensor, t2: Tensor) -> Tensor:  # N, 3
-    return (t2 - t1).norm(p=2, dim=-1)
+    # only poses are evaluated
+    write_depth_pose_from_colmap_format(f"{model_dir}/0", model_dir, ext=".bin", save_depth=False)
 
+    w2c = rt34_to_44(get_rt(f"{model_dir}/poses"))
+    c2w = w2c.inverse()
+    rel_c2w = relative_pose(c2w, mode="left")
 
-def calc_cammc(rt1: Tensor, rt2: Tensor) -> Tensor:  # N, 3, 4
-    return (rt2 - rt1).reshape(-1, 12).norm(p=2, dim=-1)
+    return rel_c2w
 
 
-def metric(c2w_1: Tensor, c2w_2: Tensor) -> tuple[float, float, float]:  # N, 3, 4
-    RotErr = calc_roterr(c2w_1[:, :3, :3], c2w_2[:, :3, :3]).sum().item()  # N, 3, 3
+def metric(c2w_1: Tensor, c2w_2: Tensor) -> tuple[float, float, float]:  # N, 4, 4
+    items = camera_metrics(c2w_1[None].double().numpy(), c2w_2[None].double().numpy())
+    return tuple(items[k][0].item() for k in METRICS)
 
-    c2w_1_rel = normalize_t(c2w_1, c2w_1)
-    c2w_2_rel = normalize_t(c2w_2, c2w_2)
 
-    TransErr = calc_transerr(c2w_1_rel[:, :3, 3], c2w_2_rel[:, :3, 3]).sum().item()  # N, 3, 1
-    CamMC = calc_cammc(c2w_1_rel[:, :3, :4], c2w_2_rel[:, :3, :4]).sum().item()  # N, 3, 4
+def get_cache_path(cache_dir: str, exp_dir: str, file: str, trial_id: int) -> str:
+    """
+    Reconstructions are keyed by the sample video bytes, intrinsics, colmap/glomap options and the trial, so
+    rerunning unchanged samples, e.g. after changing the metrics, reads the cached poses instead of running glomap.
+    """
+    name, _ = os.path.splitext(file)
+    fx, fy, cx, cy = load_rt_from_txt(f"{exp_dir}/camera_data/{name}.txt")[0, :4].tolist()
+    # paths differ between runs and do not change the result
+    config = {stage: {k: v for k, v in options.items() if not k.endswith("_path")} for stage, options in get_glomap_config("", "", fx, cx, cy).items()}
 
-    return RotErr, TransErr, CamMC
+    with open(f"{exp_dir}/samples/{file}", "rb") as f:
+        video_hash = hashlib.sha1(f.read()).hexdigest()
+    key = hashlib.sha1(json.dumps([video_hash, [fx, cx, cy], config, trial_id], sort_keys=True).encode("utf-8")).hexdigest()
+    return f"{cache_dir}/{key[:2]}/{key}.npz"
 
 
-def evaluate(tmp_dir: str, name: str):
-    gt = load_rt_from_txt(f"{args.exp_dir}/camera_data/{name}.txt")
+def evaluate(exp_dir: str, file: str, tmp_dir: str, img_dir: str = None, colmap: str = "colmap", glomap: str = "glomap",
+             trial_id: int = 0, cache_dir: str = None):
+    name, _ = os.path.splitext(file)
+    gt = load_rt_from_txt(f"{exp_dir}/camera_data/{name}.txt")
     gt_w2c = gt[:, 6:].reshape((-1, 3, 4))
     gt_c2w = rt34_to_44(gt_w2c).inverse()
     gt_rel_c2w = relative_pose(gt_c2w, mode="left")
 
-    img_dir = f"{tmp_dir}/img"
-    os.makedirs(img_dir, exist_ok=True)
-    get_frames(f"{args.exp_dir}/samples/{file}", img_dir)
+    cache_path = get_cache_path(cache_dir, exp_dir, file, trial_id) if cache_dir else None
+    if cache_path is not None and os.path.exists(cache_path):
+        cached = np.load(cache_path)
+        sample_rel_c2w, elapsed = torch.from_numpy(cached["rel_c2w"]), float(cached["time"])
+    else:
+        # frames extracted beforehand are only read, so they can be shared by concurrent trials
+        if img_dir is None:
+            img_dir = f"{tmp_dir}/img"
+            os.makedirs(img_dir, exist_ok=True)
+            get_frames(f"{exp_dir}/samples/{file}", img_dir)
+
+        start = time.perf_counter()
+
+        fx, fy, cx, cy = gt[0, :4]
+        sample_rel_c2w = run_glomap(img_dir, f"{tmp_dir}/pose", fx, cx, cy, colmap=colmap, glomap=glomap)
+
+        end = time.perf_counter()
+        elapsed = round(end - start, 2)
 
-    start = time.perf_counter()
+        if cache_path is not None:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            np.savez(f"{cache_path}.tmp.npz", rel_c2w=sample_rel_c2w.numpy(), time=elapsed)
+            os.replace(f"{cache_path}.tmp.npz", cache_path)
 
-    fx, fy, cx, cy = gt[0, :4]
-    sample_rel_c2w = run_glomap(img_dir, f"{tmp_dir}/pose", fx, cx, cy)
+    if sample_rel_c2w.shape != gt_rel_c2w.shape:
+        raise RuntimeError(f"{len(sample_rel_c2w)} of {len(gt_rel_c2w)} frames registered")
+    return {"video": file, "time": elapsed, "gt_rel_c2w": gt_rel_c2w.numpy(), "sample_rel_c2w": sample_rel_c2w.numpy()}
 
-    end = time.perf_counter()
 
-    metrics = ["RotErr", "TransErr", "CamMC"]
-    items = metric(gt_rel_c2w.clone(), sample_rel_c2w.clone())
-    print(", ".join(map(lambda x: f"{x[0]}: {x[1]:.3f}", zip(metrics, items))))
+def init_worker(devices: Queue):
+    # each worker holds one device slot for its lifetime, colmap picks its gpu from CUDA_VISIBLE_DEVICES
+    os.environ["CUDA_VISIBLE_DEVICES"] = str(devices.get())
 
-    return file, round(end - start, 2), *items
+
+def evaluate_task(exp_dir: str, file: str, img_dir: str, tmp_root: str, colmap: str, glomap: str, trial_id: int, cache_dir: str):
+    tmp_dir = f"{tmp_root}/{uuid.uuid4().fields[0]:x}"
+    os.makedirs(tmp_dir)
+    try:
+        return evaluate(exp_dir, file, tmp_dir, img_dir=img_dir, colmap=colmap, glomap=glomap, trial_id=trial_id, cache_dir=cache_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--exp_dir", type=str, required=True)
 parser.add_argument("--tmp_dir", type=str, default="/tmp")
-parser.add_argument("--trial_id", type=int, default=0)
+parser.add_argument("--results_dir", type=str, default="results", help="results store, see utils/results.py")
+parser.add_argument("--flush_every", type=int, default=16, help="rows buffered before they are appended to the store")
+parser.add_argument("--trial_ids", type=int, nargs="+", default=[0, 1, 2, 3, 4])
 parser.add_argument("--low_idx", type=int, default=0)
 parser.add_argument("--high_idx", type=int, default=-1)
+parser.add_argument("--devices", type=str, nargs="+", default=None, help="gpu ids, default CUDA_VISIBLE_DEVICES or 0")
+parser.add_argument("--workers_per_device", type=int, default=1)
+parser.add_argument("--frames_dir", type=str, default="/dev/shm" if os.path.isdir("/dev/shm") else "/tmp", help="where frames are extracted, tmpfs by default")
+parser.add_argument("--frame_ext", type=str, default=".bmp", choices=[".bmp", ".png"])
+parser.add_argument("--extract_workers", type=int, default=4)
+parser.add_argument("--cache_dir", type=str, default="cache/glomap", help="cache of reconstructed poses, empty to disable")
+parser.add_argument("--colmap", type=str, default="colmap", help="colmap executable, can be replaced by a stub")
+parser.add_argument("--glomap", type=str, default="glomap", help="glomap executable, can be replaced by a stub")
 
 if __name__ == "__main__":
     args = parser.parse_args()
 
-    tmp_dir = f"{args.tmp_dir}/{uuid.uuid4().fields[0]:x}"
-    *_, method, _, _, setting = args.exp_dir.split("/")
-    csv_dir = f"results/{method}/{setting}"
-    csv_path = f"{csv_dir}/trial_{args.trial_id}.csv"
-    os.makedirs(csv_dir, exist_ok=True)
-
-    if os.path.exists(csv_path):
-        names = pd.read_csv(csv_path).iloc[:, 0].values.tolist()
-    else:
-        names = []
-        metrics = ["RotErr", "TransErr", "CamMC"]
-        with open(csv_path, "w") as f:
-            f.write("Name,Time," + ",".join(metrics) + "\n")
+    *_, method, _, _, setting = args.exp_dir.rstrip("/").split("/")
 
     files = sorted(os.listdir(f"{args.exp_dir}/gt_video"))
     if args.high_idx != -1:
         files = files[: args.high_idx]
     files = files[args.low_idx :]
 
-    for file in filter(lambda x: x not in names, files):
-        name, _ = os.path.splitext(file)
-        print(f"[Trial ID {args.trial_id}] {name}")
-
-        if os.path.exists(tmp_dir):
-            shutil.rmtree(tmp_dir)
-        os.makedirs(tmp_dir)
-        
-        try:
-            entry = evaluate(tmp_dir, name)
-        except Exception as e:
-            # print(e)
-            # with open("failed_videos.txt", "a+") as f:
-            #     f.write(f"{file}: {e}\n")
-            continue
-
-        pd.DataFrame([entry]).to_csv(csv_path, mode="a", header=False, index=False)
+    # (video, trial) pairs not yet in the results store
+    stored = load_results(args.results_dir, poses=False)
+    stored = set(stored.loc[(stored["method"] == method) & (stored["setting"] == setting), ["video", "trial"]].itertuples(index=False, name=None))
+    video_trials = defaultdict(list)
+    for file in files:
+        for trial_id in args.trial_ids:
+            if (file, trial_id) not in stored:
+                video_trials[file].append(trial_id)
+    num_tasks = sum(map(len, video_trials.values()))
+
+    devices = args.devices or os.environ.get("CUDA_VISIBLE_DEVICES", "0").split(",")
+    num_workers = len(devices) * args.workers_per_device
+    device_slots = Queue()
+    for device in devices * args.workers_per_device:
+        device_slots.put(device)
+    print(f"{num_tasks} (video, trial) pairs of {len(video_trials)} videos to evaluate with {num_workers} workers on devices {devices}")
+
+    # frames of a video are extracted once, shared by all its trials and removed after the last one
+    frames_root = f"{args.frames_dir}/frames_{uuid.uuid4().fields[0]:x}"
+    pending_videos = iter(video_trials.items())
+    remaining_trials = {}
+    progress = tqdm(total=num_tasks)
+    # only the main process appends, rows are written in batches to keep the number of part files small
+    rows = []
+
+    with ThreadPoolExecutor(args.extract_workers) as extract_pool, \
+            ProcessPoolExecutor(num_workers, initializer=init_worker, initargs=(device_slots,)) as eval_pool:
+        futures = {}
+
+        def submit_eval(file, img_dir, trial_id):
+            eval_future = eval_pool.submit(evaluate_task, args.exp_dir, file, img_dir, args.tmp_dir, args.colmap, args.glomap, trial_id, args.cache_dir)
+            futures[eval_future] = ("eval", file, trial_id)
+
+        def submit_extract():
+            for file, trial_ids in pending_videos:
+                remaining_trials[file] = len(trial_ids)
+                if args.cache_dir and all(os.path.exists(get_cache_path(args.cache_dir, args.exp_dir, file, x)) for x in trial_ids):
+                    # all trials are looked up, no frames needed
+                    for trial_id in trial_ids:
+                        submit_eval(file, None, trial_id)
+                    continue
+                img_dir = f"{frames_root}/{os.path.splitext(file)[0]}"
+                future = extract_pool.submit(extract_frames, f"{args.exp_dir}/samples/{file}", img_dir, ext=args.frame_ext)
+                futures[future] = ("extract", file, (img_dir, trial_ids))
+                return
+
+        # keep enough extracted videos in flight to occupy all workers, bounded to limit tmpfs usage
+        for _ in range(2 * num_workers):
+            submit_extract()
+
+        while len(futures) > 0:
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, file, info = futures.pop(future)
+                if stage == "extract":
+                    img_dir, trial_ids = info
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print(f"failed to extract frames of {file}: {e}")
+                        progress.update(len(trial_ids))
+                        shutil.rmtree(img_dir, ignore_errors=True)
+                        submit_extract()
+                        continue
+                    for trial_id in trial_ids:
+                        submit_eval(file, img_dir, trial_id)
+                    continue
+
+                trial_id = info
+                progress.update()
+                try:
+                    row = future.result()
+                    items = metric(torch.from_numpy(row["gt_rel_c2w"]), torch.from_numpy(row["sample_rel_c2w"]))
+                    print(f"[Trial ID {trial_id}] {file} " + ", ".join(f"{k}: {v:.3f}" for k, v in zip(METRICS, items)))
+                    rows.append({"method": method, "setting": setting, "trial": trial_id, **row})
+                    if len(rows) >= args.flush_every:
+                        append_results(args.results_dir, rows)
+                        rows = []
+                except Exception as e:
+                    print(f"[Trial ID {trial_id}] failed {file}: {e}")
+
+                remaining_trials[file] -= 1
+                if remaining_trials[file] == 0:
+                    shutil.rmtree(f"{frames_root}/{os.path.splitext(file)[0]}", ignore_errors=True)
+                    submit_extract()
+
+    append_results(args.results_dir, rows)
+    progress.close()
+    shutil.rmtree(frames_root, ignore_errors=True)
@@ -21,7 +21,7 @@ import numpy as np
 from matplotlib import pyplot as plt
 from tqdm import tqdm
 
-from .read_write_model import qvec2rotmat, read_model
+from .read_write_model import qvec2rotmat, qvec2rotmat_batch, read_model, read_model_arrays
 
 
 def gray2rgb(im, cmap):
@@ -94,13 +94,55 @@ def save_depth_pose(output_dir, cameras, images, points3D):
         plt.imsave(os.path.join(depth_dir, os.path.splitext(image_name)[0]+'.png'), normalize_depth_for_display(depth, cmap='binary'))
         np.savetxt(os.path.join(pose_dir, os.path.splitext(image_name)[0]+'.txt'), np.concatenate([R, t], -1))
 
-def write_depth_pose_from_colmap_format(input_dir, output_dir, ext=''):
-    model = read_model(input_dir, ext=ext)
-    if model is None:
-        return
-    else:
-        cameras, images, points3D = model
-    save_depth_pose(output_dir, cameras, images, points3D)
+def save_depth_pose_arrays(output_dir, cameras, images, points3D=None):
+    # Same outputs as save_depth_pose from read_model_arrays, depths are skipped when points3D is None
+    pose_dir = os.path.join(output_dir, "poses")
+    intrinsic_dir = os.path.join(output_dir, "intrinsics")
+    os.makedirs(pose_dir, exist_ok=True)
+    os.makedirs(intrinsic_dir, exist_ok=True)
+    if points3D is not None:
+        depth_dir = os.path.join(output_dir, "depths")
+        os.makedirs(depth_dir, exist_ok=True)
+        # id -> row of points3D
+        point_order = np.argsort(points3D["ids"])
+        point_ids = points3D["ids"][point_order]
+
+    # world-to-cam rotations and translations of all images
+    Rs = qvec2rotmat_batch(images["qvecs"])  # N, 3, 3
+    ts = images["tvecs"][:, :, None]  # N, 3, 1
+    for i, image_name in enumerate(images["names"]):
+        stem = os.path.splitext(image_name)[0]
+        camera = cameras[images["camera_ids"][i]]
+        h, w, params = camera.height, camera.width, camera.params
+        if camera.model in ('SIMPLE_PINHOLE', 'SIMPLE_RADIAL'):
+            f, cx, cy = params[:3]
+        else:
+            raise NotImplementedError
+        K = np.array([[f, 0, cx], [0, f, cy], [0, 0, 1]])
+        np.savetxt(os.path.join(intrinsic_dir, stem + '.txt'), K)
+        np.savetxt(os.path.join(pose_dir, stem + '.txt'), np.concatenate([Rs[i], ts[i]], -1))
+
+        if points3D is None:
+            continue
+        # look up the 3d points observed by this image and project them
+        xys = images["xys"][images["offsets"][i]:images["offsets"][i + 1]]
+        ids = images["point3D_ids"][images["offsets"][i]:images["offsets"][i + 1]]
+        valid = ids != -1
+        rows = point_order[np.searchsorted(point_ids, ids[valid])]
+        cam_points = Rs[i] @ points3D["xyz"][rows].T + ts[i]  # 3, P
+        project_depth = (K @ cam_points)[-1]
+        xy_int = np.round(xys[valid]).astype(np.int32)
+        xy_int[:, 0] = np.clip(xy_int[:, 0], 0, w - 1)
+        xy_int[:, 1] = np.clip(xy_int[:, 1], 0, h - 1)
+        depth = np.zeros(shape=(h, w))
+        depth[xy_int[:, 1], xy_int[:, 0]] = project_depth
+        np.save(os.path.join(depth_dir, stem + '.npy'), depth)
+        plt.imsave(os.path.join(depth_dir, stem + '.png'), normalize_depth_for_display(depth, cmap='binary'))
+
+def write_depth_pose_from_colmap_format(input_dir, output_dir, ext='', save_depth=True):
+    # depth maps need all 3d points, skip them when only poses are used
+    cameras, images, points3D = read_model_arrays(input_dir, ext=ext, read_points3D=save_depth)
+    save_depth_pose_arrays(output_dir, cameras, images, points3D)
 
 def main():
     parser = argparse.ArgumentParser(description="Read and write COLMAP binary and text models")
@@ -444,6 +444,124 @@ def read_model(path, ext=""):
     return cameras, images, points3D
 
 
+def read_images_arrays_text(path):
+    """
+    read_images_text into arrays, 2D points of image i are xys[offsets[i]:offsets[i+1]]
+    :return: dict of ids [N], qvecs [N, 4], tvecs [N, 3], camera_ids [N], names [N], offsets [N+1], xys [M, 2], point3D_ids [M]
+    """
+    with open(path, "r") as fid:
+        lines = [line.strip() for line in fid.readlines()]
+    lines = [line for line in lines if not line.startswith("#")]
+    while len(lines) % 2 == 1 and lines[-1] == "":
+        lines.pop()
+    # image lines alternate with their 2D point lines, which may be empty
+    headers = np.array([line.split()[:10] for line in lines[0::2]], dtype=object).reshape(-1, 10)
+    points = [np.fromstring(line, sep=" ").reshape(-1, 3) for line in lines[1::2]]
+    points = points + [np.zeros((0, 3))] * (len(headers) - len(points))
+
+    offsets = np.zeros(len(points) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in points], out=offsets[1:])
+    points = np.concatenate(points) if len(points) > 0 else np.zeros((0, 3))
+    return {
+        "ids": headers[:, 0].astype(np.int64),
+        "qvecs": headers[:, 1:5].astype(np.float64),
+        "tvecs": headers[:, 5:8].astype(np.float64),
+        "camera_ids": headers[:, 8].astype(np.int64),
+        "names": headers[:, 9].astype(str),
+        "offsets": offsets,
+        "xys": points[:, :2],
+        "point3D_ids": points[:, 2].astype(np.int64),
+    }
+
+
+def read_images_arrays_binary(path_to_model_file):
+    """
+    read_images_binary into arrays, see read_images_arrays_text, only the image headers are parsed in a python loop
+    """
+    with open(path_to_model_file, "rb") as fid:
+        data = fid.read()
+    point_dtype = np.dtype([("x", "<f8"), ("y", "<f8"), ("id", "<i8")])
+
+    num_reg_images = struct.unpack_from("<Q", data, 0)[0]
+    pos = 8
+    headers, names, points = [], [], []
+    for _ in range(num_reg_images):
+        headers.append(struct.unpack_from("<idddddddi", data, pos))
+        pos += 64
+        end = data.index(b"\x00", pos)
+        names.append(data[pos:end].decode("utf-8"))
+        pos = end + 1
+        num_points2D = struct.unpack_from("<Q", data, pos)[0]
+        pos += 8
+        points.append(np.frombuffer(data, dtype=point_dtype, count=num_points2D, offset=pos))
+        pos += point_dtype.itemsize * num_points2D
+
+    headers = np.array(headers, dtype=np.float64).reshape(-1, 9)
+    offsets = np.zeros(len(points) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in points], out=offsets[1:])
+    points = np.concatenate(points) if len(points) > 0 else np.zeros((0,), dtype=point_dtype)
+    return {
+        "ids": headers[:, 0].astype(np.int64),
+        "qvecs": headers[:, 1:5],
+        "tvecs": headers[:, 5:8],
+        "camera_ids": headers[:, 8].astype(np.int64),
+        "names": np.array(names, dtype=str),
+        "offsets": offsets,
+        "xys": np.stack([points["x"], points["y"]], axis=-1),
+        "point3D_ids": points["id"].astype(np.int64),
+    }
+
+
+def read_points3D_arrays_text(path):
+    """
+    :return: dict of ids [P], xyz [P, 3], tracks are skipped
+    """
+    with open(path, "r") as fid:
+        rows = [line.split(maxsplit=4)[:4] for line in fid if line.strip() and not line.startswith("#")]
+    rows = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    return {"ids": rows[:, 0].astype(np.int64), "xyz": rows[:, 1:4]}
+
+
+def read_points3D_arrays_binary(path_to_model_file):
+    """
+    :return: dict of ids [P], xyz [P, 3], tracks are skipped
+    """
+    with open(path_to_model_file, "rb") as fid:
+        data = fid.read()
+    num_points = struct.unpack_from("<Q", data, 0)[0]
+    point_dtype = np.dtype([("id", "<u8"), ("xyz", "<f8", (3,)), ("rgb", "u1", (3,)), ("error", "<f8")])
+
+    # records are 43 bytes + 8 bytes per track element, only the offsets need a python loop
+    starts = np.empty(num_points, dtype=np.int64)
+    pos = 8
+    for i in range(num_points):
+        starts[i] = pos
+        track_length = struct.unpack_from("<Q", data, pos + 43)[0]
+        pos += 51 + 8 * track_length
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    records = buffer[starts[:, None] + np.arange(43)].copy().view(point_dtype).reshape(-1)
+    return {"ids": records["id"].astype(np.int64), "xyz": records["xyz"].astype(np.float64)}
+
+
+def read_model_arrays(path, ext="", read_points3D=True):
+    """
+    read_model into arrays, prefers the binary format, cameras are returned as in read_model
+    :return: cameras, images (see read_images_arrays_text), points3D (see read_points3D_arrays_text) or None
+    """
+    if ext == "":
+        ext = ".bin" if detect_model_format(path, ".bin") else ".txt"
+    if ext == ".txt":
+        cameras = read_cameras_text(os.path.join(path, "cameras" + ext))
+        images = read_images_arrays_text(os.path.join(path, "images" + ext))
+        points3D = read_points3D_arrays_text(os.path.join(path, "points3D" + ext)) if read_points3D else None
+    else:
+        cameras = read_cameras_binary(os.path.join(path, "cameras" + ext))
+        images = read_images_arrays_binary(os.path.join(path, "images" + ext))
+        points3D = read_points3D_arrays_binary(os.path.join(path, "points3D" + ext)) if read_points3D else None
+    return cameras, images, points3D
+
+
 def write_model(cameras, images, points3D, path, ext=".bin"):
     if ext == ".txt":
         write_cameras_text(cameras, os.path.join(path, "cameras" + ext))
@@ -469,6 +587,16 @@ def qvec2rotmat(qvec):
          1 - 2 * qvec[1]**2 - 2 * qvec[2]**2]])
 
 
+def qvec2rotmat_batch(qvecs):
+    """ qvec2rotmat of [N, 4] qvecs, returns [N, 3, 3] """
+    w, x, y, z = qvecs.T
+    return np.stack([
+        1 - 2 * y**2 - 2 * z**2, 2 * x * y - 2 * w * z, 2 * z * x + 2 * w * y,
+        2 * x * y + 2 * w * z, 1 - 2 * x**2 - 2 * z**2, 2 * y * z - 2 * w * x,
+        2 * z * x - 2 * w * y, 2 * y * z + 2 * w * x, 1 - 2 * x**2 - 2 * y**2,
+    ], axis=-1).reshape(-1, 3, 3)
+
+
 def rotmat2qvec(R):
     Rxx, Ryx, Rzx, Rxy, Ryy, Rzy, Rxz, Ryz, Rzz = R.flat
     K = np.array([
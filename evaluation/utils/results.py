@@ -0,0 +1,152 @@
+"""
+Columnar store of camera evaluation results and batched camera metrics, replacing utils/merge.py and utils/summary.py.
+
+Every (method, setting, video, trial) row keeps the relative c2w poses of ground truth and sample, so metrics are
+recomputed over whole result sets at once, e.g. after changing the metric code, without running GLOMAP again.
+Rows are appended as parquet part files under {results_dir}/store.
+
+python utils/results.py --results_dir results
+"""
+
+import argparse
+import glob
+import os
+import re
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+METRICS = ["RotErr", "TransErr", "CamMC"]
+KEYS = ["method", "setting", "video", "trial"]
+
+regs = {int: r"(0|[1-9]\d*)", float: r"(\d+(\.\d+)?)", bool: r"(True|False)", str: r"([a-z]+)"}
+configs = {
+    "iters": ("", "k", int, 0),
+    "ImageTextcfg": ("ImageTextcfg", "", float, 7.5),
+    "CameraCondition": ("CameraCondition", "", bool, False),
+    "CameraCfg": ("CameraCfg", "", float, 1.0),
+    "eta": ("eta", "", float, 1.0),
+    "guidanceRescale": ("guidanceRescale", "", float, 0.7),
+    "cfgScheduler": ("cfgScheduler=", "", str, "constant"),
+    "frameStride": ("frameStride", "", int, 8),
+}
+
+
+def normalize_t(c2w: np.ndarray, eps: float = 1e-9) -> np.ndarray:  # N, T, 4, 4
+    scale = np.linalg.norm(c2w[..., :3, 3], axis=-1).max(axis=-1) + eps  # N
+    c2w = c2w.copy()
+    c2w[..., :3, 3] /= scale[:, None, None]
+    return c2w
+
+
+def camera_metrics(c2w_1: np.ndarray, c2w_2: np.ndarray) -> dict[str, np.ndarray]:  # N, T, 4, 4
+    """
+    RotErr, TransErr and CamMC of N videos at once, each summed over T frames
+    """
+    R_1, R_2 = c2w_1[..., :3, :3], c2w_2[..., :3, :3]
+    trace = np.einsum("ntji,ntji->nt", R_1, R_2)  # trace(R_1^T @ R_2)
+    RotErr = np.arccos(np.clip((trace - 1) / 2, -1, 1)).sum(-1)
+
+    c2w_1_rel, c2w_2_rel = normalize_t(c2w_1), normalize_t(c2w_2)
+    TransErr = np.linalg.norm(c2w_2_rel[..., :3, 3] - c2w_1_rel[..., :3, 3], axis=-1).sum(-1)
+    CamMC = np.linalg.norm((c2w_2_rel[..., :3, :4] - c2w_1_rel[..., :3, :4]).reshape(*c2w_1.shape[:2], 12), axis=-1).sum(-1)
+
+    return {"RotErr": RotErr, "TransErr": TransErr, "CamMC": CamMC}
+
+
+def append_results(results_dir: str, rows: list[dict]):
+    """
+    rows: dicts of method, setting, video, trial, time, gt_rel_c2w [T, 4, 4], sample_rel_c2w [T, 4, 4]
+    """
+    if len(rows) == 0:
+        return
+    store_dir = f"{results_dir}/store"
+    os.makedirs(store_dir, exist_ok=True)
+
+    columns = {k: [row[k] for row in rows] for k in KEYS + ["time"]}
+    for k in ["gt_rel_c2w", "sample_rel_c2w"]:
+        columns[k] = pa.array([np.asarray(row[k], dtype=np.float64).reshape(-1) for row in rows], type=pa.list_(pa.float64()))
+    path = f"{store_dir}/part-{uuid.uuid4().hex}.parquet"
+    pq.write_table(pa.table(columns), f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+
+def load_results(results_dir: str, poses: bool = True) -> pd.DataFrame:
+    """
+    :return: rows of the store, with gt_rel_c2w and sample_rel_c2w as [T, 4, 4] arrays if poses
+    """
+    parts = sorted(glob.glob(f"{results_dir}/store/part-*.parquet"), key=os.path.getmtime)
+    columns = KEYS + ["time"] + (["gt_rel_c2w", "sample_rel_c2w"] if poses else [])
+    if len(parts) == 0:
+        return pd.DataFrame(columns=columns)
+    table = pa.concat_tables([pq.read_table(x, columns=columns) for x in parts])
+    df = table.select(KEYS + ["time"]).to_pandas()
+    if poses:
+        for k in ["gt_rel_c2w", "sample_rel_c2w"]:
+            df[k] = [np.asarray(x).reshape(-1, 4, 4) for x in table.column(k).to_pylist()]
+    # a rerun may have appended a row twice
+    return df.drop_duplicates(subset=KEYS, keep="last").reset_index(drop=True)
+
+
+def compute_metrics(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    add metric columns, rows with the same number of frames are stacked and computed in one batch
+    """
+    df = df.copy()
+    num_frames = df["gt_rel_c2w"].map(len)
+    for k in METRICS:
+        df[k] = np.nan
+    for T, index in df.groupby(num_frames).groups.items():
+        gt = np.stack(df.loc[index, "gt_rel_c2w"].values)  # N, T, 4, 4
+        sample = np.stack(df.loc[index, "sample_rel_c2w"].values)
+        for k, v in camera_metrics(gt, sample).items():
+            df.loc[index, k] = v
+    return df
+
+
+def parse_settings(df: pd.DataFrame) -> pd.DataFrame:
+    """ configs of the setting names and short method names, as utils/summary.py """
+    df = df.copy()
+    settings = pd.Series(df["setting"].unique())
+    for name, (before, after, kind, default) in configs.items():
+        captured = settings.str.extract(f"{before}{regs[kind]}{after}")[0]
+        captured = captured.map(lambda x: default if pd.isna(x) else (eval(x) if kind in (int, float, bool) else x))
+        df[name] = df["setting"].map(dict(zip(settings, captured)))
+    df["Method"] = df["method"].map(lambda x: re.sub(r"_\d+(_\dgpu)?$", "", x.removeprefix("test_256_")))
+    return df
+
+
+def summarize(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    :return: per video metrics averaged over trials (merge.csv), per (method, setting) averages (summary.csv)
+    """
+    per_video = compute_metrics(df).groupby(["method", "setting", "video"], sort=False)[["time"] + METRICS].mean().reset_index()
+    per_setting = per_video.groupby(["method", "setting"], sort=False)[["time"] + METRICS].mean().reset_index()
+    per_setting = parse_settings(per_setting).sort_values(["method"] + list(configs)).reset_index(drop=True)
+    return per_video, per_setting
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--results_dir", type=str, default="results")
+    parser.add_argument("--summary_path", type=str, default="summary.csv")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+
+    per_video, per_setting = summarize(load_results(args.results_dir))
+
+    # same files as utils/merge.py and utils/summary.py
+    for (method, setting), group in per_video.groupby(["method", "setting"], sort=False):
+        os.makedirs(f"{args.results_dir}/{method}/{setting}", exist_ok=True)
+        group[["video", "time"] + METRICS].rename(columns={"video": "Name", "time": "Time"}).to_csv(
+            f"{args.results_dir}/{method}/{setting}/merge.csv", index=False)
+
+    summary = per_setting[["Method", "ImageTextcfg", "CameraCfg", "time"] + METRICS].rename(columns={"time": "Time"})
+    summary.to_csv(args.summary_path, index=False)
+    print(summary.to_string(index=False, float_format=lambda x: f"{x:.4f}"))
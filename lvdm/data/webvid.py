@@ -1,6 +1,7 @@
 import os
 import random
 from tqdm import tqdm
+import numpy as np
 import pandas as pd
 from decord import VideoReader, cpu
 
@@ -9,6 +10,8 @@ from torch.utils.data import Dataset
 from torch.utils.data import DataLoader
 from torchvision import transforms
 
+from CameraControl.data.utils import get_packed_string, load_packed_arrays
+
 
 class WebVid(Dataset):
     """
@@ -21,6 +24,9 @@ class WebVid(Dataset):
                 ...
                 5000.mp4
             ...
+
+    meta_path: csv with videoid, page_dir and name columns, or directory compiled by datasets/utils/compile_webvid_meta.py,
+        whose clips are filtered by length up front so that __getitem__ never retries
     """
     def __init__(self,
                  meta_path,
@@ -36,6 +42,7 @@ class WebVid(Dataset):
                  load_raw_resolution=False,
                  fixed_fps=None,
                  random_fs=False,
+                 uint8_video=False,
                  ):
         self.meta_path = meta_path
         self.data_dir = data_dir
@@ -48,6 +55,7 @@ class WebVid(Dataset):
         self.fixed_fps = fixed_fps
         self.load_raw_resolution = load_raw_resolution
         self.random_fs = random_fs
+        self.uint8_video = uint8_video  # return uint8 frames in [0, 255], normalized on device by the model
         self._load_metadata()
         if spatial_transform is not None:
             if spatial_transform == "random_crop":
@@ -70,6 +78,10 @@ class WebVid(Dataset):
             self.spatial_transform = None
                 
     def _load_metadata(self):
+        self.compiled = os.path.isdir(self.meta_path)
+        if self.compiled:
+            return self._load_compiled_metadata()
+
         metadata = pd.read_csv(self.meta_path, dtype=str)
         print(f'>>> {len(metadata)} data samples loaded.')
         if self.subsample is not None:
@@ -80,6 +92,27 @@ class WebVid(Dataset):
         self.metadata = metadata
         self.metadata.dropna(inplace=True)
 
+    def _load_compiled_metadata(self):
+        frame_nums = np.load(f"{self.meta_path}/frame_nums.npy")
+        fps = np.load(f"{self.meta_path}/fps.npy")
+        print(f'>>> {len(frame_nums)} data samples loaded.')
+
+        ## same drops as the csv path, done once instead of retrying in __getitem__
+        valid = frame_nums >= self.video_length
+        if self.fixed_fps is not None:
+            frame_stride = self.frame_stride_min if self.random_fs else self.frame_stride
+            frame_stride = np.maximum((frame_stride * (fps / self.fixed_fps)).astype(np.int64), 1)
+            valid &= frame_nums >= (frame_stride * (self.video_length - 1) + 1) * 0.5
+        indices = np.flatnonzero(valid)
+        if self.subsample is not None:
+            indices = np.sort(np.random.RandomState(0).choice(indices, min(self.subsample, len(indices)), replace=False))
+        print(f'>>> {len(indices)} data samples are long enough.')
+
+        ## rows of the packed strings, which are memory-mapped lazily in each worker
+        self.indices = indices
+        self.frame_nums, self.fps = frame_nums[indices], fps[indices]
+        self.packed_strings = None
+
     def _get_video_path(self, sample):
         rel_video_fp = os.path.join(sample['page_dir'], str(sample['videoid']) + '.mp4')
         full_video_fp = os.path.join(self.data_dir, 'videos', rel_video_fp)
@@ -91,6 +124,9 @@ class WebVid(Dataset):
         else:
             frame_stride = self.frame_stride
 
+        if self.compiled:
+            return self._get_compiled_item(index, frame_stride)
+
         ## get frames until success
         while True:
             index = index % len(self.metadata)
@@ -147,7 +183,39 @@ class WebVid(Dataset):
                 print(f"Get frames failed! path = {video_path}; [max_ind vs frame_total:{max(frame_indices)} / {frame_num}]")
                 index += 1
                 continue
-        
+
+        return self._process_frames(frames, caption, video_path, fps_ori, frame_stride)
+
+    def _get_compiled_item(self, index, frame_stride):
+        index = index % len(self.indices)
+        if self.packed_strings is None:
+            self.packed_strings = {k: load_packed_arrays(f"{self.meta_path}/{k}") for k in ['video_paths', 'captions']}
+        video_path = os.path.join(self.data_dir, 'videos', get_packed_string(*self.packed_strings['video_paths'], self.indices[index]))
+        caption = get_packed_string(*self.packed_strings['captions'], self.indices[index])
+        fps_ori, frame_num = float(self.fps[index]), int(self.frame_nums[index])
+
+        if self.fixed_fps is not None:
+            frame_stride = int(frame_stride * (1.0 * fps_ori / self.fixed_fps))
+        frame_stride = max(frame_stride, 1)
+
+        required_frame_num = frame_stride * (self.video_length-1) + 1
+        if frame_num < required_frame_num:
+            ## too short clips are filtered in _load_compiled_metadata, shrink the stride instead of dropping
+            frame_stride = frame_num // self.video_length
+            required_frame_num = frame_stride * (self.video_length-1) + 1
+
+        random_range = frame_num - required_frame_num
+        start_idx = random.randint(0, random_range) if random_range > 0 else 0
+        frame_indices = [start_idx + frame_stride*i for i in range(self.video_length)]
+
+        if self.load_raw_resolution:
+            video_reader = VideoReader(video_path, ctx=cpu(0))
+        else:
+            video_reader = VideoReader(video_path, ctx=cpu(0), width=530, height=300)
+        frames = video_reader.get_batch(frame_indices)
+        return self._process_frames(frames, caption, video_path, fps_ori, frame_stride)
+
+    def _process_frames(self, frames, caption, video_path, fps_ori, frame_stride):
         ## process data
         assert(frames.shape[0] == self.video_length),f'{len(frames)}, self.video_length={self.video_length}'
         frames = torch.tensor(frames.asnumpy()).permute(3, 0, 1, 2).float() # [t,h,w,c] -> [c,t,h,w]
@@ -158,8 +226,12 @@ class WebVid(Dataset):
         if self.resolution is not None:
             assert (frames.shape[2], frames.shape[3]) == (self.resolution[0], self.resolution[1]), f'frames={frames.shape}, self.resolution={self.resolution}'
         
-        ## turn frames tensors to [-1,1]
-        frames = (frames / 255 - 0.5) * 2
+        if self.uint8_video:
+            ## normalized to [-1,1] on device by the model
+            frames = frames.round().clamp(0, 255).to(torch.uint8)
+        else:
+            ## turn frames tensors to [-1,1]
+            frames = (frames / 255 - 0.5) * 2
         fps_clip = fps_ori // frame_stride
         if self.fps_max is not None and fps_clip > self.fps_max:
             fps_clip = self.fps_max
@@ -168,7 +240,7 @@ class WebVid(Dataset):
         return data
     
     def __len__(self):
-        return len(self.metadata)
+        return len(self.indices) if self.compiled else len(self.metadata)
 
 
 if __name__== "__main__":
@@ -372,6 +372,9 @@ class DDPM(pl.LightningModule):
             x = x[..., None]
         x = rearrange(x, 'b h w c -> b c h w')
         '''
+        if x.dtype == torch.uint8:
+            ## uint8 transport from the dataloader, normalize to [-1, 1] on device
+            x = (x.float() / 255 - 0.5) * 2
         x = x.to(memory_format=torch.contiguous_format).float()
         return x
 
@@ -488,6 +491,7 @@ class LatentDiffusion(DDPM):
                  logdir=None,
                  rand_cond_frame=False,
                  en_and_decode_n_samples_a_time=None,
+                 cond_stage_on_cpu=False,
                  *args, **kwargs):
         self.num_timesteps_cond = default(num_timesteps_cond, 1)
         self.scale_by_std = scale_by_std
@@ -509,6 +513,9 @@ class LatentDiffusion(DDPM):
         self.logdir = logdir
         self.rand_cond_frame = rand_cond_frame
         self.en_and_decode_n_samples_a_time = en_and_decode_n_samples_a_time
+        ## captions are embedded offline (batch["caption_embedding"]), keep the frozen text encoder off GPU
+        self.cond_stage_on_cpu = cond_stage_on_cpu
+        assert not (cond_stage_on_cpu and cond_stage_trainable), "cond_stage_on_cpu requires a frozen cond_stage_model"
 
         try:
             self.num_downs = len(first_stage_config.params.ddconfig.ch_mult) - 1
@@ -550,6 +557,13 @@ class LatentDiffusion(DDPM):
         ids = torch.round(torch.linspace(0, self.num_timesteps - 1, self.num_timesteps_cond)).long()
         self.cond_ids[:self.num_timesteps_cond] = ids
 
+    def on_fit_start(self):
+        if self.cond_stage_on_cpu:
+            self.cond_stage_model.float().cpu()
+            self.cond_stage_model.device = torch.device("cpu")
+            torch.cuda.empty_cache()
+            mainlogger.info("cond_stage_model is kept on cpu, expecting precomputed caption embeddings")
+
     @rank_zero_only
     @torch.no_grad()
     def on_train_batch_start(self, batch, batch_idx, dataloader_idx=None):
@@ -606,6 +620,8 @@ class LatentDiffusion(DDPM):
         else:
             assert hasattr(self.cond_stage_model, self.cond_stage_forward)
             c = getattr(self.cond_stage_model, self.cond_stage_forward)(c)
+        if self.cond_stage_on_cpu:
+            c = c.to(self.device)
         return c
 
     def get_first_stage_encoding(self, encoder_posterior, noise=None):
@@ -642,6 +658,17 @@ class LatentDiffusion(DDPM):
             results = rearrange(results, '(b t) c h w -> b c t h w', b=b,t=t)
         
         return results
+
+    @torch.no_grad()
+    def encode_first_stage_from_moments(self, moments):
+        '''
+        :param moments: b,2*c,t,h,w posterior mean/logvar of the 2d encoder, cached offline
+        :return: z sampled exactly as encode_first_stage does
+        '''
+        b, _, t, _, _ = moments.shape
+        moments = rearrange(moments, 'b c t h w -> (b t) c h w').float()
+        results = self.get_first_stage_encoding(DiagonalGaussianDistribution(moments)).detach()
+        return rearrange(results, '(b t) c h w -> b c t h w', b=b, t=t)
     
     def decode_core(self, z, **kwargs):
         if self.encoder_type == "2d" and z.dim() == 5:
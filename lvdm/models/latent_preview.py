@@ -0,0 +1,156 @@
+"""
+Fast approximate latent-to-RGB previewer.
+
+A single 1x1 affine projection from the (scaled) first stage latent to RGB, fitted by least squares
+against the frozen AutoencoderKL. It is cheap enough to run inside the DDIM `img_callback` on `pred_x0`
+at latent resolution, so progressive results can be shown without invoking the full decoder.
+
+Fit on CPU:
+    python -m lvdm.models.latent_preview --config configs/003_cami2v_512x320.yaml \
+        --ckpt_path ckpts/512_cami2v_50k.pt --image_dir demo/pexels --output ckpts/latent_previewer.pt
+"""
+import argparse
+import glob
+import os
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from einops import rearrange
+from omegaconf import OmegaConf
+from PIL import Image
+from torchvision import transforms
+from torchvision.utils import make_grid
+
+from utils.utils import load_submodule
+
+
+class LatentPreviewer(nn.Module):
+    def __init__(self, latent_channels=4, downsample=8):
+        super().__init__()
+        self.downsample = downsample
+        self.proj = nn.Conv2d(latent_channels, 3, kernel_size=1)
+
+    @classmethod
+    def from_pretrained(cls, path, map_location="cpu"):
+        ckpt = torch.load(path, map_location=map_location)
+        previewer = cls(**ckpt["config"])
+        previewer.load_state_dict(ckpt["state_dict"])
+        return previewer.eval()
+
+    def save(self, path):
+        config = {"latent_channels": self.proj.in_channels, "downsample": self.downsample}
+        torch.save({"config": config, "state_dict": self.state_dict()}, path)
+
+    def forward(self, z):
+        '''
+        :param z: scaled latent (same space as pred_x0), b,c,t,h,w or b,c,h,w
+        :return: rgb in [-1, 1] at latent resolution, same layout as z
+        '''
+        is_video = z.dim() == 5
+        if is_video:
+            b = z.shape[0]
+            z = rearrange(z, 'b c t h w -> (b t) c h w')
+        x = self.proj(z.to(self.proj.weight)).clamp(-1.0, 1.0)
+        if is_video:
+            x = rearrange(x, '(b t) c h w -> b c t h w', b=b)
+        return x
+
+    @torch.no_grad()
+    def to_image(self, z, nrow=8, upscale=2):
+        '''
+        :param z: b,c,t,h,w latent, only the first sample is previewed
+        :return: uint8 numpy image [H, W, 3], frames tiled in a grid
+        '''
+        x = self(z[:1].float())
+        frames = rearrange(x[0], 'c t h w -> t c h w') if x.dim() == 5 else x
+        if upscale > 1:
+            frames = F.interpolate(frames, scale_factor=upscale, mode='bilinear', align_corners=False)
+        grid = make_grid(frames, nrow=nrow, padding=0)
+        grid = ((grid + 1.0) * 127.5).round().clamp(0, 255).to(torch.uint8)
+        return grid.permute(1, 2, 0).cpu().numpy()
+
+
+@torch.no_grad()
+def fit_latent_previewer(first_stage_model, images, scale_factor, batch_size=8, ridge=1e-4):
+    '''
+    Least squares fit of rgb ~ W @ z + b, where rgb is the input image average pooled to latent resolution.
+    :param images: tensor, n,3,h,w in [-1, 1]
+    '''
+    latent_channels = first_stage_model.embed_dim
+    downsample = None
+
+    xtx = torch.zeros(latent_channels + 1, latent_channels + 1, dtype=torch.float64)
+    xty = torch.zeros(latent_channels + 1, 3, dtype=torch.float64)
+    for i in range(0, images.shape[0], batch_size):
+        x = images[i:i + batch_size]
+        z = first_stage_model.encode(x).mode() * scale_factor  # n,c,h',w'
+        downsample = x.shape[-1] // z.shape[-1]
+        rgb = F.avg_pool2d(x, downsample)  # n,3,h',w'
+
+        z = rearrange(z, 'n c h w -> (n h w) c').double()
+        z = torch.cat([z, torch.ones_like(z[:, :1])], dim=1)
+        rgb = rearrange(rgb, 'n c h w -> (n h w) c').double()
+        xtx += z.T @ z
+        xty += z.T @ rgb
+
+    xtx += ridge * torch.eye(xtx.shape[0], dtype=xtx.dtype)
+    solution = torch.linalg.solve(xtx, xty)  # c+1, 3
+
+    previewer = LatentPreviewer(latent_channels=latent_channels, downsample=downsample)
+    previewer.proj.weight.data.copy_(solution[:-1].T.reshape(3, latent_channels, 1, 1).float())
+    previewer.proj.bias.data.copy_(solution[-1].float())
+    return previewer.eval()
+
+
+def load_first_stage_model(config_file, ckpt_path=None):
+    config = OmegaConf.load(config_file)
+    first_stage_model = load_submodule(config.model.params.first_stage_config, ckpt_path, "first_stage_model")
+    return first_stage_model, config.model.params.get("scale_factor", 1.0)
+
+
+def load_training_images(image_dir, resolution, crops_per_image=8, seed=0):
+    paths = sorted(sum([glob.glob(os.path.join(image_dir, f"*.{ext}")) for ext in ["jpg", "jpeg", "png"]], []))
+    assert len(paths) > 0, f"no images found in {image_dir}"
+
+    torch.manual_seed(seed)
+    transform = transforms.Compose([
+        transforms.Resize(min(resolution)),
+        transforms.RandomCrop(resolution),
+        transforms.ToTensor(),
+    ])
+    images = []
+    for path in paths:
+        image = Image.open(path).convert("RGB")
+        images.extend(transform(image) for _ in range(crops_per_image))
+    return torch.stack(images) * 2.0 - 1.0
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, required=True)
+    parser.add_argument("--ckpt_path", type=str, default=None)
+    parser.add_argument("--image_dir", type=str, default="demo/pexels")
+    parser.add_argument("--resolution", type=int, nargs=2, default=[320, 512], help="H W")
+    parser.add_argument("--crops_per_image", type=int, default=8)
+    parser.add_argument("--output", type=str, default="ckpts/latent_previewer.pt")
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+
+    first_stage_model, scale_factor = load_first_stage_model(args.config, args.ckpt_path)
+    images = load_training_images(args.image_dir, args.resolution, args.crops_per_image)
+    print(f"fitting latent previewer on {images.shape[0]} crops of {args.resolution}")
+
+    previewer = fit_latent_previewer(first_stage_model, images, scale_factor)
+
+    with torch.no_grad():
+        z = first_stage_model.encode(images[:4]).mode() * scale_factor
+        target = F.avg_pool2d(images[:4], previewer.downsample)
+        print(f"preview mse on [-1, 1]: {F.mse_loss(previewer(z), target).item():.4f}")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    previewer.save(args.output)
+    print(f"saved latent previewer to {args.output}")
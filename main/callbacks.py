@@ -170,3 +170,19 @@ class CUDACallback(Callback):
             rank_zero_info(f"Average Peak memory {max_memory:.2f}MiB")
         except AttributeError:
             pass
+
+
+class DataWaitTimeLogger(Callback):
+    """ log the time training waits on the dataloader, needs `prefetch_to_device` of DataModuleFromConfig """
+
+    def __init__(self, logging_interval=100):
+        super().__init__()
+        self.logging_interval = logging_interval
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        prefetcher = trainer.train_dataloader
+        if not hasattr(prefetcher, "wait_time") or prefetcher.num_batches < self.logging_interval:
+            return
+        pl_module.log("train/data_wait_time", prefetcher.wait_time / prefetcher.num_batches,
+                      on_step=True, on_epoch=False, rank_zero_only=True, logger=True)
+        prefetcher.reset_stats()
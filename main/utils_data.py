@@ -1,9 +1,11 @@
+import random
+import time
 from functools import partial
 import numpy as np
 
 import torch
 import pytorch_lightning as pl
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, DistributedSampler
 
 import os, sys
 os.chdir(sys.path[0])
@@ -19,9 +21,13 @@ def worker_init_fn(_):
     worker_id = worker_info.id
 
     if isinstance(dataset, Txt2ImgIterableBaseDataset):
-        split_size = dataset.num_records // worker_info.num_workers
-        # reset num_records to the true number to retain reliable length information
-        dataset.sample_ids = dataset.valid_ids[worker_id * split_size:(worker_id + 1) * split_size]
+        if hasattr(dataset, "split_sample_ids"):
+            # the dataset splits itself, e.g. over the workers of all ranks
+            dataset.split_sample_ids(worker_id, worker_info.num_workers)
+        else:
+            split_size = dataset.num_records // worker_info.num_workers
+            # reset num_records to the true number to retain reliable length information
+            dataset.sample_ids = dataset.valid_ids[worker_id * split_size:(worker_id + 1) * split_size]
         current_id = np.random.choice(len(np.random.get_state()[1]), 1)
         return np.random.seed(np.random.get_state()[1][current_id] + worker_id)
     else:
@@ -41,11 +47,153 @@ class WrappedDataset(Dataset):
         return self.data[idx]
 
 
+def move_to_device(data, device, non_blocking=False):
+    """ recursively move tensors in nested dicts / lists / tuples, e.g. RT, camera_intrinsics, camera_data, per_frame_scale """
+    if isinstance(data, torch.Tensor):
+        return data.to(device, non_blocking=non_blocking)
+    if isinstance(data, dict):
+        return {k: move_to_device(v, device, non_blocking) for k, v in data.items()}
+    if isinstance(data, (list, tuple)):
+        return type(data)(move_to_device(v, device, non_blocking) for v in data)
+    return data
+
+
+def record_stream(data, stream):
+    """ mark tensors as used by `stream`, so the caching allocator does not reuse them while it runs """
+    if isinstance(data, torch.Tensor):
+        data.record_stream(stream)
+    elif isinstance(data, dict):
+        for v in data.values():
+            record_stream(v, stream)
+    elif isinstance(data, (list, tuple)):
+        for v in data:
+            record_stream(v, stream)
+
+
+class SeededDataset(Dataset):
+    """ takes (index, seed) from ResumableDistributedSampler and reseeds random, numpy and torch before loading the sample """
+
+    def __init__(self, dataset):
+        self.data = dataset
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        index, seed = idx
+        random.seed(seed)
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+        return self.data[index]
+
+
+class ResumableDistributedSampler(DistributedSampler):
+    """
+    DistributedSampler that resumes in the middle of an epoch. The position (epoch, offset) is saved in the lightning
+    checkpoint through DataModuleFromConfig.state_dict, and the first `offset` indices of this rank are skipped
+    without loading them. Yields (index, seed) with the seed derived from (seed, epoch, index), so that random
+    frame strides, start indices etc. of SeededDataset are reproduced after resuming.
+    """
+
+    def __init__(self, dataset, num_replicas, rank, shuffle=True, seed=0, drop_last=False):
+        super().__init__(dataset, num_replicas=num_replicas, rank=rank, shuffle=shuffle, seed=seed, drop_last=drop_last)
+        self.offset = 0
+
+    def set_epoch(self, epoch):
+        if epoch != self.epoch:
+            self.offset = 0
+        super().set_epoch(epoch)
+
+    def state_dict(self, consumed):
+        return {"epoch": self.epoch, "offset": consumed}
+
+    def load_state_dict(self, state_dict):
+        self.epoch = state_dict["epoch"]
+        self.offset = state_dict["offset"]
+
+    def __len__(self):
+        # samples left in this epoch, so that lightning counts the batches actually yielded after resuming
+        return self.num_samples - min(self.offset, self.num_samples)
+
+    def __iter__(self):
+        indices = list(super().__iter__())
+        for index in indices[self.offset:]:
+            yield index, int(np.random.SeedSequence([self.seed, self.epoch, index]).generate_state(1)[0])
+        self.offset = 0  # only the resumed epoch starts in the middle
+
+
+class DevicePrefetcher:
+    """
+    Wraps a DataLoader and copies the next batch to `device` on a side CUDA stream while the current step runs.
+    Batches need pinned memory for the copy to be asynchronous. On CPU devices batches are moved synchronously.
+
+    wait_time: seconds spent blocked on the dataloader since the last reset_stats()
+    num_batches: batches yielded since the last reset_stats()
+    """
+
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.use_stream = self.device.type == "cuda" and torch.cuda.is_available()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.wait_time = 0.0
+        self.num_batches = 0
+
+    def __len__(self):
+        return len(self.loader)
+
+    # exposed for lightning to call set_epoch
+    @property
+    def sampler(self):
+        return self.loader.sampler
+
+    @property
+    def batch_sampler(self):
+        return self.loader.batch_sampler
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    def _preload(self, iterator, stream):
+        start = time.perf_counter()
+        try:
+            batch = next(iterator)
+        except StopIteration:
+            return None
+        finally:
+            self.wait_time += time.perf_counter() - start
+
+        if stream is None:
+            return move_to_device(batch, self.device)
+        with torch.cuda.stream(stream):
+            return move_to_device(batch, self.device, non_blocking=True)
+
+    def __iter__(self):
+        stream = torch.cuda.Stream(device=self.device) if self.use_stream else None
+        iterator = iter(self.loader)
+
+        next_batch = self._preload(iterator, stream)
+        while next_batch is not None:
+            batch = next_batch
+            if stream is not None:
+                current_stream = torch.cuda.current_stream(self.device)
+                current_stream.wait_stream(stream)
+                record_stream(batch, current_stream)
+            # issue the copy of the next batch before handing out the current one
+            next_batch = self._preload(iterator, stream)
+            self.num_batches += 1
+            yield batch
+
+
 class DataModuleFromConfig(pl.LightningDataModule):
     def __init__(self, batch_size, train=None, validation=None, test=None, predict=None,
                  wrap=False, num_workers=None, shuffle_test_loader=False, use_worker_init_fn=False,
                  shuffle_val_dataloader=False, train_img=None,
-                 test_max_n_samples=None, validation_max_n_samples=None):
+                 test_max_n_samples=None, validation_max_n_samples=None, prefetch_to_device=False,
+                 resumable_sampler=False, sampler_seed=0):
         super().__init__()
         self.batch_size = batch_size
         self.dataset_configs = dict()
@@ -69,6 +217,13 @@ class DataModuleFromConfig(pl.LightningDataModule):
         self.test_max_n_samples = test_max_n_samples
         self.validation_max_n_samples = validation_max_n_samples
         self.collate_fn = None
+        # copy train batches to the device on a side stream, see DevicePrefetcher
+        self.prefetch_to_device = prefetch_to_device
+        # resume the train sampler in the middle of an epoch, see ResumableDistributedSampler
+        self.resumable_sampler = resumable_sampler
+        self.sampler_seed = sampler_seed
+        self.train_sampler = None
+        self.sampler_state = None
 
     def prepare_data(self):
         pass
@@ -85,12 +240,44 @@ class DataModuleFromConfig(pl.LightningDataModule):
             init_fn = worker_init_fn
         else:
             init_fn = None
-        loader = DataLoader(self.datasets["train"], batch_size=self.batch_size,
-                          num_workers=self.num_workers, shuffle=False if is_iterable_dataset else True,
-                          worker_init_fn=init_fn, collate_fn=self.collate_fn, persistent_workers=True, pin_memory=True
+        dataset = self.datasets["train"]
+        if hasattr(dataset, "check_shard_split"):
+            dataset.check_shard_split(self.num_workers)
+        sampler = None
+        if self.resumable_sampler and not is_iterable_dataset:
+            num_replicas, rank = (self.trainer.world_size, self.trainer.global_rank) if self.trainer is not None else (1, 0)
+            sampler = ResumableDistributedSampler(dataset, num_replicas=num_replicas, rank=rank, shuffle=True, seed=self.sampler_seed)
+            if self.sampler_state is not None:
+                sampler.load_state_dict(self.sampler_state)
+            self.train_sampler = sampler
+            dataset = SeededDataset(dataset)
+        # lightning only injects a distributed sampler into DataLoader, not into the prefetcher wrapping it
+        elif self.prefetch_to_device and not is_iterable_dataset and self.trainer is not None and self.trainer.world_size > 1:
+            sampler = DistributedSampler(dataset, num_replicas=self.trainer.world_size,
+                                         rank=self.trainer.global_rank, shuffle=True)
+        loader = DataLoader(dataset, batch_size=self.batch_size,
+                          num_workers=self.num_workers, shuffle=False if is_iterable_dataset or sampler is not None else True,
+                          sampler=sampler, worker_init_fn=init_fn, collate_fn=self.collate_fn, persistent_workers=True, pin_memory=True
                           )
+        if self.prefetch_to_device and self.trainer is not None:
+            loader = DevicePrefetcher(loader, self.trainer.strategy.root_device)
         return loader
 
+    def state_dict(self):
+        if self.train_sampler is None or self.trainer is None:
+            return {}
+        # samples already trained on, the sampler itself runs ahead by the prefetched batches.
+        # batch_progress counts dataloader batches of this epoch, including those before a resume, regardless of
+        # gradient accumulation, and batch_size is the per-rank micro batch that deepspeed also sees
+        consumed = self.trainer.fit_loop.epoch_loop.batch_progress.current.processed * self.batch_size
+        return {"train_sampler": self.train_sampler.state_dict(consumed)}
+
+    def load_state_dict(self, state_dict):
+        # restored before the train dataloader is created
+        self.sampler_state = state_dict.get("train_sampler")
+        if self.train_sampler is not None and self.sampler_state is not None:
+            self.train_sampler.load_state_dict(self.sampler_state)
+
     def _val_dataloader(self, shuffle=False):
         if isinstance(self.datasets['validation'], Txt2ImgIterableBaseDataset) or self.use_worker_init_fn:
             init_fn = worker_init_fn
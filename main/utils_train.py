@@ -72,6 +72,11 @@ def get_trainer_callbacks(lightning_config, config, logdir, ckptdir, logger):
         default_callbacks_cfg["model_checkpoint"]["params"]["save_top_k"] = 3
         default_callbacks_cfg["model_checkpoint"]["params"]["mode"] = "min"
 
+    if check_config_attribute(config.data.params, "prefetch_to_device"):
+        default_callbacks_cfg["data_wait_time_logger"] = {
+            "target": "callbacks.DataWaitTimeLogger",
+        }
+
     if 'metrics_over_trainsteps_checkpoint' in lightning_config.callbacks:
         mainlogger.info('Caution: Saving checkpoints every n train steps without deleting. This might require some free space.')
         default_metrics_over_trainsteps_ckpt_dict = {
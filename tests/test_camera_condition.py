@@ -0,0 +1,68 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("open3d")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from omegaconf import OmegaConf
+
+from CameraControl.CamI2V.epipolar import (
+    fill_epipolar_config_defaults,
+    get_epipolar_mask,
+    get_fundamental_matrix,
+    get_relative_c2w_RT_pairs,
+    unpack_epipolar_mask,
+)
+from CameraControl.data.camera_condition import CameraConditionTransform
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def make_sample(T=3, H=40, W=24):
+    """ cameras on a small arc looking at the origin, w2c RT as in RealEstate10K """
+    c2w = torch.eye(4).repeat(T, 1, 1)
+    for i in range(T):
+        angle = torch.tensor(0.2 * i)
+        c2w[i, 0, 0], c2w[i, 0, 2], c2w[i, 2, 0], c2w[i, 2, 2] = angle.cos(), angle.sin(), -angle.sin(), angle.cos()
+        c2w[i, :3, 3] = torch.tensor([0.5 * i, 0.1 * i, -2.0])
+    K = torch.tensor([[30.0, 0, W / 2], [0, 30.0, H / 2], [0, 0, 1]]).repeat(T, 1, 1)
+    return {"video": torch.zeros(3, T, H, W), "RT": c2w.inverse(), "camera_intrinsics": K}
+
+
+def test_packed_mask_matches_gpu_mask():
+    # t*h*w = 3*5*3 = 45 is not a multiple of 8, the last byte is padded
+    config = {"attention_resolution": [1]}
+    data = CameraConditionTransform(config, pluker=False, precompute_epipolar_mask=True)(make_sample())
+    assert data["fundamental_matrix"].shape == (3, 3, 3, 3)
+    assert data["epipolar_mask_8"].dtype == torch.uint8 and data["epipolar_mask_8"].shape == (45, 6)
+
+    # as CamI2V builds it from the precomputed fundamental matrices
+    epipolar_config = fill_epipolar_config_defaults(OmegaConf.create(config))
+    F = data["fundamental_matrix"][None].to(device)
+    mask = get_epipolar_mask(F, 3, 5, 3, 8, epipolar_config)  # 1, 45, 45
+    assert mask.any() and not mask.all()
+
+    packed = torch.from_numpy(np.packbits(mask.cpu().numpy(), axis=-1)).to(device)
+    assert torch.equal(packed[0], data["epipolar_mask_8"].to(device))
+    assert torch.equal(unpack_epipolar_mask(packed, 45), mask)
+
+
+def test_fundamental_matrix_does_not_depend_on_cond_frame():
+    sample = make_sample()
+    data = CameraConditionTransform({"attention_resolution": [1]}, pluker=False)(dict(sample))
+    assert not any(k.startswith("epipolar_mask_") for k in data)
+
+    # relative to another condition frame, as the model computes it without the precomputed data
+    c2w = sample["RT"].inverse()
+    relative_c2w = c2w[2].inverse() @ c2w
+    pairs = get_relative_c2w_RT_pairs(relative_c2w[None])
+    F = get_fundamental_matrix(sample["camera_intrinsics"][None, None], pairs[..., :3, :3], pairs[..., :3, 3:4])[0]
+    assert torch.allclose(data["fundamental_matrix"], F, atol=1e-5)
+
+
+def test_cond_frame_follows_rand_cond_frame():
+    transform = CameraConditionTransform(None, pluker=False)
+    assert all(transform(make_sample())["cond_frame_index"] == 0 for _ in range(10))
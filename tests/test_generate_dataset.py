@@ -0,0 +1,65 @@
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "datasets", "utils"))
+import generate_dataset
+from generate_dataset import DataDownloader
+
+
+class FakeDownloader:
+    """ stands in for download_youtube, writes the url into the file and fails for the urls in `fail` """
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.urls = []
+
+    def __call__(self, url, filepath):
+        self.urls.append(url)
+        if url in self.fail:
+            raise RuntimeError("video unavailable")
+        with open(filepath, "w") as f:
+            f.write(url)
+
+
+def make_dataroot(root, split, videos):
+    os.makedirs(f"{root}/pose_files/{split}")
+    for i, video in enumerate(videos):
+        with open(f"{root}/pose_files/{split}/seq{i}.txt", "w") as f:
+            f.write(f"https://www.youtube.com/watch?v={video}\n0 0.5 0.5 0.5 0.5 0 0\n")
+
+
+def read_state(root, split):
+    with open(f"{root}/{split}_download_state.jsonl") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_resume_and_failed_download(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # failed_videos_{split}.txt is written to the working directory
+    monkeypatch.setattr(generate_dataset, "sleep", lambda _: None)
+    root, split = str(tmp_path / "RealEstate10K"), "test"
+    make_dataroot(root, split, ["aaa", "bbb", "ccc"])
+    url = "https://www.youtube.com/watch?v={}".format
+
+    download_fn = FakeDownloader(fail=[url("bbb")])
+    DataDownloader(root, split, download_fn, num_workers=2, num_parse_workers=1).run()
+    assert sorted(download_fn.urls) == [url("aaa"), url("bbb"), url("ccc")]
+    assert sorted(os.listdir(f"{root}/videos/{split}")) == ["aaa.mp4", "ccc.mp4"]
+    state = {item["video"]: item["status"] for item in read_state(root, split)}
+    assert state == {"aaa.mp4": "done", "bbb.mp4": "failed", "ccc.mp4": "done"}
+    with open(f"failed_videos_{split}.txt") as f:
+        assert f.read() == "bbb.mp4\n"
+
+    # resume: downloaded and failed videos are skipped, a deleted video is downloaded again
+    os.remove(f"{root}/videos/{split}/ccc.mp4")
+    download_fn = FakeDownloader()
+    DataDownloader(root, split, download_fn, num_workers=2, num_parse_workers=1).run()
+    assert download_fn.urls == [url("ccc")]
+    assert os.path.exists(f"{root}/videos/{split}/ccc.mp4")
+
+    # failed videos are only retried on request
+    download_fn = FakeDownloader()
+    DataDownloader(root, split, download_fn, num_workers=2, num_parse_workers=1, retry_failed=True).run()
+    assert download_fn.urls == [url("bbb")]
+    assert read_state(root, split)[-1] == {"video": "bbb.mp4", "status": "done"}
+    assert sorted(os.listdir(f"{root}/videos/{split}")) == ["aaa.mp4", "bbb.mp4", "ccc.mp4"]
@@ -0,0 +1,39 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.lru_cache import ByteLRUCache
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = ByteLRUCache(max_bytes=10)
+    cache.put("a", "A", 4)
+    cache.put("b", "B", 4)
+    assert cache.get("a") == "A"  # b is now the least recently used
+
+    cache.put("c", "C", 4)  # 12 bytes, one eviction is enough
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert cache.nbytes == 8
+
+    cache.put("d", "D", 6)  # 14 bytes, evicting a is enough to get back to 10
+    assert list(cache._items) == ["c", "d"] and cache.nbytes == 10
+    assert cache.get("a") is None
+
+    cache.put("e", "E", 9)  # 19 bytes, both c and d go
+    assert list(cache._items) == ["e"] and cache.nbytes == 9
+
+
+def test_replace_and_oversized_values():
+    cache = ByteLRUCache(max_bytes=10)
+    cache.put("a", "A", 3)
+    cache.put("a", "A2", 5)
+    assert cache.get("a") == "A2" and cache.nbytes == 5 and len(cache) == 1
+
+    cache.put("big", "BIG", 11)  # larger than the cache, not stored and evicts nothing
+    assert "big" not in cache and "a" in cache and cache.nbytes == 5
+
+
+def test_disabled():
+    cache = ByteLRUCache(max_bytes=0)
+    cache.put("a", "A", 1)
+    assert len(cache) == 0 and cache.nbytes == 0
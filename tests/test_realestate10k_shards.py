@@ -0,0 +1,50 @@
+import io
+import os
+import sys
+import tarfile
+
+import pytest
+
+for module in ["torch", "av", "decord", "open3d"]:
+    pytest.importorskip(module)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CameraControl.data.realestate10k import RealEstate10KShards
+
+
+def write_shard(path, members):
+    with tarfile.open(path, "w") as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def make_shards(shard_paths):
+    # only the shard iteration is tested, without the clip dataset
+    dataset = RealEstate10KShards.__new__(RealEstate10KShards)
+    dataset.shard_paths = shard_paths
+    return dataset
+
+
+def test_iter_shard_skips_unexpected_and_incomplete(tmp_path):
+    path = str(tmp_path / "shard_00000.tar")
+    write_shard(path, [
+        ("a.mp4", b"a0"), ("a.npy", b"a1"), ("a.json", b"a2"),
+        ("README", b"x"),  # no extension
+        ("b.mp4", b"b0"), ("b.json", b"b2"),  # no npy
+        ("c.txt", b"c"),  # not a clip member
+        ("c.mp4", b"c0"), ("c.npy", b"c1"), ("c.json", b"c2"),
+        ("d.mp4", b"d0"),  # truncated shard
+    ])
+    clips = list(make_shards([path])._iter_shard(0))
+    assert clips == [
+        ("a", {"mp4": b"a0", "npy": b"a1", "json": b"a2"}),
+        ("c", {"mp4": b"c0", "npy": b"c1", "json": b"c2"}),
+    ]
+
+
+def test_iter_clips_fails_without_complete_clips(tmp_path):
+    path = str(tmp_path / "shard_00000.tar")
+    write_shard(path, [("a.mp4", b"a0")])
+    with pytest.raises(RuntimeError):
+        next(make_shards([path])._iter_clips([0]))
@@ -0,0 +1,174 @@
+import math
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+from torch.utils.data import DataLoader, Dataset, DistributedSampler
+
+try:
+    from lightning.fabric.utilities.data import _set_sampler_epoch
+except ImportError:
+    from lightning_fabric.utilities.data import _set_sampler_epoch
+
+# main/utils_data.py changes the working directory on import
+cwd = os.getcwd()
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lvdm.data.base import Txt2ImgIterableBaseDataset
+from main.utils_data import DataModuleFromConfig, DevicePrefetcher, ResumableDistributedSampler, SeededDataset, move_to_device, worker_init_fn
+os.chdir(cwd)
+
+
+class RandomDataset(Dataset):
+    """ index and a random draw, which only reproduces with the seed given by ResumableDistributedSampler """
+
+    def __len__(self):
+        return 23
+
+    def __getitem__(self, index):
+        return index, torch.rand(())
+
+
+class NestedDataset(Dataset):
+    """ samples shaped like camera batches, with tensors nested in dicts and lists """
+
+    def __len__(self):
+        return 10
+
+    def __getitem__(self, index):
+        return {
+            "index": index,
+            "video": torch.full((2, 3), float(index)),
+            "camera_data": {"RT": torch.eye(4) * index, "intrinsics": [torch.tensor([index, index])]},
+            "caption": f"video {index}",
+        }
+
+
+def test_move_to_device_nested():
+    data = {"a": torch.zeros(2), "b": [torch.ones(1), (torch.ones(2), "x")], "c": 3}
+    moved = move_to_device(data, torch.device("cpu"))
+    assert isinstance(moved["b"], list) and isinstance(moved["b"][1], tuple)
+    assert torch.equal(moved["b"][1][0], torch.ones(2))
+    assert moved["b"][1][1] == "x" and moved["c"] == 3
+
+
+def test_prefetcher_order_and_stats():
+    loader = DataLoader(NestedDataset(), batch_size=3, shuffle=False)
+    prefetcher = DevicePrefetcher(loader, "cpu")
+    assert len(prefetcher) == len(loader) == 4
+    assert prefetcher.dataset is loader.dataset
+
+    batches = list(prefetcher)
+    assert [batch["index"].tolist() for batch in batches] == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+    for batch in batches:
+        assert batch["video"].device.type == "cpu"
+        assert torch.equal(batch["video"][:, 0, 0], batch["index"].float())
+        assert torch.equal(batch["camera_data"]["RT"][:, 0, 0], batch["index"].float())
+        assert torch.equal(batch["camera_data"]["intrinsics"][0][:, 0], batch["index"])
+        assert batch["caption"] == [f"video {i}" for i in batch["index"].tolist()]
+    assert prefetcher.num_batches == 4
+    assert prefetcher.wait_time > 0
+
+    prefetcher.reset_stats()
+    assert prefetcher.num_batches == 0 and prefetcher.wait_time == 0
+    # the stats accumulate over epochs until reset
+    list(prefetcher)
+    list(prefetcher)
+    assert prefetcher.num_batches == 8
+
+
+def test_prefetcher_set_epoch_reaches_sampler():
+    dataset = NestedDataset()
+    sampler = DistributedSampler(dataset, num_replicas=2, rank=0, shuffle=True, seed=0)
+    prefetcher = DevicePrefetcher(DataLoader(dataset, batch_size=2, sampler=sampler), "cpu")
+    assert prefetcher.sampler is sampler and prefetcher.batch_sampler.sampler is sampler
+
+    # what lightning calls on the train dataloader at the start of every epoch
+    _set_sampler_epoch(prefetcher, 3)
+    assert sampler.epoch == 3
+
+    indices = torch.cat([batch["index"] for batch in prefetcher]).tolist()
+    assert indices == list(sampler)
+    assert len(indices) == 5
+
+
+def test_resumable_sampler_tail():
+    dataset = RandomDataset()
+    full = ResumableDistributedSampler(dataset, num_replicas=2, rank=1, seed=5)
+    full.set_epoch(3)
+    expected = list(full)
+    assert len(full) == len(expected) == 12
+
+    sampler = ResumableDistributedSampler(dataset, num_replicas=2, rank=1, seed=5)
+    sampler.set_epoch(3)
+    iterator = iter(sampler)
+    consumed = [next(iterator) for _ in range(5)]
+    assert consumed == expected[:5]
+
+    resumed = ResumableDistributedSampler(dataset, num_replicas=2, rank=1, seed=5)
+    resumed.load_state_dict(sampler.state_dict(len(consumed)))
+    resumed.set_epoch(3)  # called by lightning before the epoch, keeps the offset of the same epoch
+    assert len(resumed) == 7
+    assert list(resumed) == expected[5:]
+    # the next epoch is complete again
+    assert len(resumed) == 12
+    resumed.set_epoch(4)
+    assert len(list(resumed)) == 12
+
+
+def make_datamodule(processed=0):
+    datamodule = DataModuleFromConfig(batch_size=2, num_workers=1, resumable_sampler=True, sampler_seed=5)
+    datamodule.datasets = {"train": RandomDataset()}
+    batch_progress = SimpleNamespace(current=SimpleNamespace(processed=processed))
+    datamodule.trainer = SimpleNamespace(world_size=2, global_rank=1, fit_loop=SimpleNamespace(epoch_loop=SimpleNamespace(batch_progress=batch_progress)))
+    return datamodule
+
+
+def test_datamodule_resume_matches_uninterrupted_run():
+    datamodule = make_datamodule()
+    loader = datamodule._train_dataloader()
+    loader.sampler.set_epoch(3)
+    expected = [(index.tolist(), value.tolist()) for index, value in loader]
+    assert len(loader) == len(expected) == 6
+
+    # interrupted after 2 batches, the dataloader worker has already drawn further indices from the sampler
+    datamodule = make_datamodule()
+    loader = datamodule._train_dataloader()
+    loader.sampler.set_epoch(3)
+    iterator = iter(loader)
+    assert [(index.tolist(), value.tolist()) for index, value in (next(iterator), next(iterator))] == expected[:2]
+    datamodule.trainer.fit_loop.epoch_loop.batch_progress.current.processed = 2
+    state = datamodule.state_dict()
+    assert state == {"train_sampler": {"epoch": 3, "offset": 4}}
+
+    # restored before the train dataloader is created, as lightning does
+    datamodule = make_datamodule(processed=2)
+    datamodule.load_state_dict(state)
+    loader = datamodule._train_dataloader()
+    loader.sampler.set_epoch(3)
+    assert len(loader) == math.ceil((12 - 4) / 2) == 4
+    assert [(index.tolist(), value.tolist()) for index, value in loader] == expected[2:]
+
+
+class RecordsDataset(Txt2ImgIterableBaseDataset):
+    def __iter__(self):
+        yield from self.sample_ids
+
+
+class SplittingDataset(RecordsDataset):
+    def split_sample_ids(self, worker_id, num_workers):
+        self.sample_ids = self.valid_ids[worker_id::num_workers]
+
+
+def test_worker_init_fn_split(monkeypatch):
+    dataset = RecordsDataset(num_records=10, valid_ids=list(range(10)))
+    monkeypatch.setattr(torch.utils.data, "get_worker_info", lambda: SimpleNamespace(dataset=dataset, id=1, num_workers=3))
+    worker_init_fn(1)
+    # iterable datasets without split_sample_ids keep the per-worker split of num_records
+    assert dataset.sample_ids == [3, 4, 5]
+
+    dataset = SplittingDataset(num_records=10, valid_ids=list(range(10)))
+    worker_init_fn(1)
+    assert dataset.sample_ids == [1, 4, 7]
@@ -0,0 +1,40 @@
+from collections import OrderedDict
+
+
+class ByteLRUCache:
+    """
+    LRU cache bounded by the total size of its values in bytes, e.g. decoded frames of different resolutions.
+    max_bytes: least recently used values are evicted beyond it, 0 disables caching
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()  # key -> (value, nbytes)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key][0]
+
+    def put(self, key, value, nbytes):
+        if key in self._items:
+            self.nbytes -= self._items.pop(key)[1]
+        if nbytes > self.max_bytes:  # would evict everything else and itself
+            return
+        self._items[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted) = self._items.popitem(last=False)
+            self.nbytes -= evicted
+
+    def clear(self):
+        self._items.clear()
+        self.nbytes = 0
@@ -34,6 +34,25 @@ def instantiate_from_config(config):
     return get_obj_from_str(config["target"])(**config.get("params", dict()))
 
 
+def load_submodule(config, ckpt_path, key):
+    """
+    instantiate a submodule of a full model, e.g. first_stage_model, and load its weights from a full model checkpoint
+    :param config: config of the submodule, e.g. model.params.first_stage_config
+    :param key: attribute name of the submodule in the full model, prefix of its weights in the checkpoint
+    """
+    module = instantiate_from_config(config)
+    if ckpt_path:
+        state_dict = torch.load(ckpt_path, map_location="cpu")
+        if "module" in state_dict:  # deepspeed checkpoint
+            state_dict = state_dict["module"]
+        elif "state_dict" in state_dict:  # lightning checkpoint
+            state_dict = state_dict["state_dict"]
+        prefix = f"{key}."
+        state_dict = {k[len(prefix):]: v for k, v in state_dict.items() if k.startswith(prefix)}
+        module.load_state_dict(state_dict, strict=True)
+    return module.eval()
+
+
 def get_obj_from_str(string, reload=False):
     module, cls = string.rsplit(".", 1)
     if reload: